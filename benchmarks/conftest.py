@@ -0,0 +1,22 @@
+"""
+Benchmarks of the validator API on a synthetic experiment (the fixtures shared with the
+tests are in the conftest.py of the repository)
+
+    pip install .[bench]
+    pytest benchmarks --benchmark-autosave
+    pytest benchmarks --benchmark-compare   # against the last saved run
+"""
+import itertools
+
+import pytest
+
+
+@pytest.fixture
+def frames(experiment):
+    """Endless iterator over the frames of the experiment, so repeated calls do not hit the same frame"""
+    return itertools.cycle(range(experiment["min_frame"], experiment["max_frame"]+1, 7))
+
+
+@pytest.fixture
+def middle_frame(experiment):
+    return (experiment["min_frame"]+experiment["max_frame"])//2
@@ -0,0 +1,23 @@
+import os
+
+import pytest
+
+
+@pytest.mark.parametrize("pose", [False, True])
+def test_render_segment(benchmark, validator, experiment, tmp_path, pose):
+    """Rendering 100 annotated frames in this process (the server spreads the chunks over a pool)"""
+    from idtrackerai_validator_server import clips
+    flat=experiment["experiment"].replace("/", "_")
+    pose_files={}
+    if pose:
+        for identity in experiment["identities"]:
+            _, path=validator.pose_file_path(str(identity).zfill(2), flat)
+            pose_files[int(identity)]=path
+    task={
+        "start": experiment["min_frame"], "end": experiment["min_frame"]+99,
+        "chunksize": validator.CHUNKSIZE, "dbfile": experiment["dbfile"], "use_val": "_VAL",
+        "store_path": os.path.join(experiment["basedir"], "metadata.yaml"),
+        "number_of_animals": len(experiment["identities"]), "fps": 25,
+        "pose_files": pose_files, "square": (100, 100), "output": str(tmp_path / "clip.mp4"),
+    }
+    assert benchmark(clips.render_segment, task)==100
@@ -0,0 +1,13 @@
+def test_swap_identities(benchmark, client, experiment, tracking_backend):
+    """Swapping two identities over the whole experiment and undoing it, with the caches updated"""
+    body={"start": experiment["min_frame"], "end": experiment["max_frame"], "identity": 1, "to": 2, "swap": True}
+
+    def swap_and_undo():
+        response=client.post("/api/corrections/range", json=body)
+        assert response.status_code==200, response.get_json()
+        undone=client.post(f"/api/corrections/{response.get_json()['id']}/undo")
+        assert undone.status_code==200, undone.get_json()
+        return response.get_json()
+
+    correction=benchmark(swap_and_undo)
+    assert correction["rows"] > 0
@@ -0,0 +1,16 @@
+import pytest
+
+
+def test_fragment_index_build(benchmark, validator, tracking_backend):
+    """One grouped count of the fragments of the whole experiment, without the cache"""
+    def build():
+        validator.fragments._INDEXES.clear()
+        return validator._get_fragment_index()
+    index=benchmark(build)
+    assert len(index) > 0
+
+
+@pytest.mark.parametrize("route", ["next_fragment_start", "prev_fragment_end", "next_short_fragment", "next_fragment_conflict"])
+def test_fragment_navigation(benchmark, get_ok, frames, route):
+    response=benchmark(lambda: get_ok(f"/api/{route}/{next(frames)}"))
+    assert "frame_number" in response.get_json()
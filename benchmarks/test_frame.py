@@ -0,0 +1,23 @@
+def test_get_frame_decode(benchmark, validator, get_ok, frames, monkeypatch):
+    """Decode, segmentation and JPEG encoding of a new frame (shared frame cache disabled)"""
+    monkeypatch.setattr(validator, "get_frame_cache", lambda: None)
+    benchmark(lambda: get_ok(f"/api/frame/{next(frames)}"))
+
+
+def test_get_frame_cached(benchmark, get_ok, middle_frame):
+    get_ok(f"/api/frame/{middle_frame}")
+    response=benchmark(get_ok, f"/api/frame/{middle_frame}")
+    assert response.mimetype=="image/jpeg"
+
+
+def test_get_preprocess(benchmark, validator, get_ok, frames, monkeypatch):
+    monkeypatch.setattr(validator, "get_frame_cache", lambda: None)
+    response=benchmark(lambda: get_ok(f"/api/preprocess/{next(frames)}"))
+    assert "contours" in response.get_json()
+
+
+def test_get_frame_overlay(benchmark, validator, get_ok, frames, monkeypatch):
+    """Frame with the identities, contours and pose drawn on it (shared frame cache disabled)"""
+    monkeypatch.setattr(validator, "get_frame_cache", lambda: None)
+    response=benchmark(lambda: get_ok(f"/api/frame/{next(frames)}?overlay=identity,contours,pose"))
+    assert response.mimetype=="image/jpeg"
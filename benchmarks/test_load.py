@@ -0,0 +1,12 @@
+def test_load(benchmark, client, experiment):
+    """Switching to an experiment, from the request to the swap of the experiment state"""
+    def load():
+        return client.post("/api/load", json={"experiment": experiment["experiment"], "wait": True})
+
+    response=benchmark.pedantic(load, rounds=5, iterations=1)
+    assert response.status_code==200, response.get_json()
+
+
+def test_list(benchmark, get_ok):
+    response=benchmark(get_ok, "/api/list")
+    assert response.get_json()["experiments"]
@@ -0,0 +1,11 @@
+import pytest
+
+
+@pytest.mark.parametrize("route", [
+    "next_error", "prev_error", "next_ok", "prev_ok", "next_ai", "prev_ai",
+])
+def test_navigation(benchmark, get_ok, middle_frame, route, tracking_backend):
+    response=benchmark(get_ok, f"/api/{route}/{middle_frame}")
+    frame_number=response.get_json()["frame_number"]
+    if frame_number is not None:
+        assert (frame_number > middle_frame) == route.startswith("next")
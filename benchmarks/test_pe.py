@@ -0,0 +1,60 @@
+import itertools
+
+import pytest
+
+
+@pytest.fixture
+def fly(experiment):
+    return experiment["flies"][0]
+
+
+@pytest.fixture
+def bouts(get_ok, fly):
+    return get_ok("/api/pe/bouts", query_string={"fly": fly}).get_json()
+
+
+@pytest.mark.parametrize("query", [{}, {"limit": 20}, {"label": "pe", "min_score": 0.5}])
+def test_pe_bouts(benchmark, get_ok, fly, query):
+    response=benchmark(get_ok, "/api/pe/bouts", query_string={"fly": fly, **query})
+    assert int(response.headers["X-Total-Count"]) >= len(response.get_json())
+
+
+@pytest.mark.parametrize("query", [{}, {"format": "columns"}])
+def test_pe_trace(benchmark, get_ok, fly, bouts, query):
+    bursts=itertools.cycle(sorted({bout["burst_id"] for bout in bouts}))
+    response=benchmark(lambda: get_ok("/api/pe/trace", query_string={"fly": fly, "burst_id": next(bursts), **query}))
+    out=response.get_json()
+    if query:
+        assert out["columns"]["t_s"] and "points" not in out
+    else:
+        assert out["points"][0].keys()=={"t_s", "dist", "conf", "bout_uid", "is_peak"}
+
+
+def test_pe_summary(benchmark, get_ok, experiment):
+    response=benchmark(get_ok, "/api/pe/summary")
+    assert len(response.get_json()["flies"])==len(experiment["flies"])
+
+
+def test_pe_audit_all(benchmark, get_ok):
+    response=benchmark(get_ok, "/api/pe/audit_all")
+    assert response.get_json()
+
+
+def test_pe_annotate_batch(benchmark, client, fly, bouts):
+    annotations=[
+        {"fly": fly, "start_frame": bout["start_fn"], "end_frame": bout["end_fn"], "verdict": "pe"}
+        for bout in bouts
+    ]
+    response=benchmark(client.post, "/api/pe/annotate_batch", json={"annotations": annotations})
+    assert response.status_code==200, response.get_json()
+
+
+@pytest.mark.parametrize("fmt", ["json", "csv", "parquet"])
+def test_pe_export(benchmark, get_ok, fmt):
+    benchmark(get_ok, "/api/pe/export", query_string={"format": fmt})
+
+
+def test_pe_media_range(benchmark, client, get_ok):
+    stem=get_ok("/api/pe/media_index").get_json()["videos"][0]
+    response=benchmark(client.get, f"/api/pe/media/videos/{stem}.mp4", headers={"Range": "bytes=0-65535"})
+    assert response.status_code==206
@@ -0,0 +1,11 @@
+def test_segmentation_sweep(benchmark, client, experiment):
+    """A 4x4 grid of intensity and area thresholds over 8 frames, spread over the sweep pool"""
+    body={
+        "intensity": [[0, 100], [0, 120], [0, 140], [0, 160]],
+        "area": [[10, 200], [20, 400], [40, 800], [80, 1600]],
+        "sample": 8,
+    }
+    client.post("/api/segmentation/sweep", json=body)   # start the pool
+    response=benchmark(client.post, "/api/segmentation/sweep", json=body)
+    assert response.status_code==200, response.data[:200]
+    assert len(response.get_json()["settings"])==16
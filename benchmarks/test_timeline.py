@@ -0,0 +1,25 @@
+import pytest
+
+
+@pytest.mark.parametrize("bins", [200, 2000])
+def test_timeline(benchmark, get_ok, experiment, bins):
+    response=benchmark(get_ok, f"/api/timeline?bins={bins}")
+    payload=response.get_json()
+    assert sum(payload["counts"]["frames"])==experiment["max_frame"]-experiment["min_frame"]+1
+
+
+def test_timeline_build(benchmark, validator, tracking_backend):
+    """Counting the events of the whole experiment, without the cache"""
+    def build():
+        validator.timeline._TIMELINES.clear()
+        with validator.app.app_context():
+            return validator._get_timeline()
+    timeline=benchmark(build)
+    assert timeline.levels[-1]["frames"].size==1
+
+
+def test_timeline_zoom(benchmark, get_ok, frames):
+    def zoom():
+        start=next(frames)
+        return get_ok(f"/api/timeline?bins=100&start={start}&end={start+500}")
+    benchmark(zoom)
@@ -0,0 +1,15 @@
+import pytest
+
+
+@pytest.mark.parametrize("pose", ["1", "0"])
+def test_get_tracking(benchmark, get_ok, frames, experiment, pose, tracking_backend):
+    response=benchmark(lambda: get_ok(f"/api/tracking/{next(frames)}?pose={pose}"))
+    payload=response.get_json()
+    assert len(payload["tracking_data"])==len(experiment["identities"])
+    if pose=="1":
+        assert payload["pose"]
+
+
+def test_frame_range(benchmark, get_ok, experiment, tracking_backend):
+    response=benchmark(get_ok, "/api/frame_range")
+    assert response.get_json()=={"min_frame": experiment["min_frame"], "max_frame": experiment["max_frame"]}
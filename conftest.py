@@ -0,0 +1,84 @@
+"""
+Fixtures shared by the tests and the benchmarks: the validator API on a synthetic experiment
+(see idtrackerai_validator_server.synthetic)
+
+The size of the experiment is set with BENCH_ANIMALS, BENCH_CHUNKS and BENCH_CHUNKSIZE.
+Everything is written to a temporary folder, no real data or network is needed
+"""
+import os
+import logging
+import importlib
+
+import pytest
+
+BENCH_ANIMALS=int(os.environ.get("BENCH_ANIMALS", 6))
+BENCH_CHUNKS=int(os.environ.get("BENCH_CHUNKS", 2))
+BENCH_CHUNKSIZE=int(os.environ.get("BENCH_CHUNKSIZE", 1000))
+
+PACKAGE_DIR=os.path.join(os.path.dirname(os.path.abspath(__file__)), "idtrackerai_validator_server")
+
+
+@pytest.fixture(scope="session")
+def experiment(tmp_path_factory):
+    from idtrackerai_validator_server.synthetic import make_experiment
+    root=tmp_path_factory.mktemp("flyhostel_videos")
+    return make_experiment(
+        str(root), number_of_animals=BENCH_ANIMALS, chunks=BENCH_CHUNKS, chunksize=BENCH_CHUNKSIZE
+    )
+
+
+@pytest.fixture(scope="session")
+def validator(experiment, tmp_path_factory):
+    """The module of the Flask app, with the synthetic experiment loaded"""
+    state=tmp_path_factory.mktemp("validator")
+    with pytest.MonkeyPatch.context() as mp:
+        # read when the modules are imported
+        mp.setenv("FLYHOSTEL_VIDEOS", experiment["root"])
+        mp.setenv("PE_DB", str(state / "pe_annotations.db"))
+        mp.setenv("PE_AUDIT_CSV", experiment["audit_csv"])
+        mp.setenv("CATALOG_DB", str(state / "validator_catalog.db"))
+        mp.setenv("FRAME_CACHE_DIR", str(state))
+        mp.setenv("PE_SUMMARY_WORKERS", "2")
+        mp.delenv("VALIDATOR_EXPERIMENT", raising=False)
+        # the cache warm-up after the load would run during the first benchmarks
+        mp.setenv("VALIDATOR_WARM_CACHES", "")
+        mp.chdir(state)
+        # app.py imports pe_validation as a top level module
+        mp.syspath_prepend(PACKAGE_DIR)
+        module=importlib.import_module("idtrackerai_validator_server.app")
+        logging.getLogger().setLevel(logging.WARNING)
+
+        response=module.app.test_client().post(
+            "/api/load", json={"experiment": experiment["experiment"], "wait": True}
+        )
+        assert response.status_code==200, response.get_json()
+        yield module
+
+
+@pytest.fixture(scope="session")
+def sidecar(experiment):
+    from idtrackerai_validator_server.sidecar import build_sidecar, open_sidecar
+    build_sidecar(experiment["dbfile"])
+    return open_sidecar(experiment["dbfile"], use_val="_VAL")
+
+
+@pytest.fixture(params=["sql", "sidecar"])
+def tracking_backend(request, validator, sidecar, monkeypatch):
+    """Answer the tracking and navigation queries from the .db or from its columnar sidecar"""
+    monkeypatch.setattr(validator, "SIDECAR", sidecar if request.param=="sidecar" else None)
+    return request.param
+
+
+@pytest.fixture
+def client(validator):
+    return validator.app.test_client()
+
+
+@pytest.fixture
+def get_ok(client):
+    """client.get, failing the test on any status but 200"""
+    def get(url, **kwargs):
+        response=client.get(url, **kwargs)
+        assert response.status_code==200, (url, response.status_code, response.data[:200])
+        return response
+    return get
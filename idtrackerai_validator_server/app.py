@@ -1,41 +1,69 @@
 import os
-import shutil
+import sys
 import argparse
 import re
+import json
+import copy
+import time
+import hashlib
+import uuid
+import datetime
+import contextlib
+import functools
 import traceback
-from threading import Lock
+from threading import Lock, Thread
 import logging
-from flask import Flask, jsonify, request, send_from_directory
-from flask_cors import CORS
-from flask import g
-from flask_sqlalchemy import SQLAlchemy
-import numpy as np
-import cv2
-from sqlalchemy import func, create_engine
-from sqlalchemy.orm import Session
-from flask import session
-import h5py
 from pathlib import Path
 
-
-from idtrackerai_validator_server.constants import (
-    WITH_FRAGMENTS, first_chunk, FRAMES_DIR, INCLUDE_POSE
-)
-from idtrackerai_validator_server.database import DatabaseManager
-from idtrackerai_validator_server.backend import (
-    load_experiment,
-    generate_database_filename,
-    process_frame,
-    list_experiments
-)
-from idtrackerai_validator_server.utils import load_rejections
-from flyhostel.utils import (
-    get_identities,
-    get_square_width,
-    get_square_height,    
-)
-from flyhostel.utils.pose_export import recreate_pose_file
-from pe_validation import register_pe_validation
+from idtrackerai_validator_server import startup
+from idtrackerai_validator_server.startup import lazy_import, lazy_callable
+
+with startup.phase("imports"):
+    from flask import Flask, Response, jsonify, request, send_file
+    from flask_cors import CORS
+    from flask import g
+    from flask_sqlalchemy import SQLAlchemy
+    import numpy as np
+    from sqlalchemy import func, create_engine
+    from sqlalchemy.orm import Session
+    from flask import session
+
+    from idtrackerai_validator_server.constants import (
+        WITH_FRAGMENTS, first_chunk, INCLUDE_POSE
+    )
+    from idtrackerai_validator_server.database import DatabaseManager
+    from idtrackerai_validator_server.backend import (
+        load_experiment,
+        generate_database_filename,
+        process_frame,
+        list_experiments,
+        draw_labels,
+        draw_pose,
+        identity_colors,
+        identity_labels,
+        POSE_SKELETON,
+        GREEN,
+    )
+    from idtrackerai_validator_server.catalog import (
+        list_catalog,
+        refresh_catalog_in_background,
+    )
+    from idtrackerai_validator_server.locks import ReadWriteLock
+    from idtrackerai_validator_server.frame_cache import get_frame_cache, use_shared_frame_cache, FRAME_CACHE_DIR
+    from idtrackerai_validator_server.sidecar import open_sidecar, update_sidecar, db_signature
+    from idtrackerai_validator_server import metrics, profiling, loadtest, clips, sweep, corrections
+    from idtrackerai_validator_server.metrics import timed
+    from idtrackerai_validator_server.utils import load_rejections, rejections_file
+    from idtrackerai_validator_server import timeline, fragments
+    from pe_validation import register_pe_validation, forget_pe_connections, pe_warm_up_tasks
+
+# imported on first use (or by the warm-up), see startup.py
+cv2 = lazy_import("cv2")
+h5py = lazy_import("h5py")
+get_identities = lazy_callable("flyhostel.utils", "get_identities")
+get_square_width = lazy_callable("flyhostel.utils", "get_square_width")
+get_square_height = lazy_callable("flyhostel.utils", "get_square_height")
+recreate_pose_file = lazy_callable("flyhostel.utils.pose_export", "recreate_pose_file")
 
 # Initialize logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -44,43 +72,53 @@ logging.getLogger("idtrackerai_validator_server.backend").setLevel(logging.DEBUG
 logging.getLogger("imgstore").setLevel(logging.WARNING)
 logging.getLogger("watchdog.observers").setLevel(logging.WARNING)
 
+# VALIDATOR_EXPERIMENT is loaded in the background once the server is up (see warm_up)
 SELECTED_EXPERIMENT_ = os.environ.get("VALIDATOR_EXPERIMENT", None)
 if SELECTED_EXPERIMENT_ is not None:
     if "/" not in SELECTED_EXPERIMENT_:
         tokens = SELECTED_EXPERIMENT_.split("_")
-        SELECTED_EXPERIMENT = "/".join([tokens[0], tokens[1], "_".join(tokens[2:4])])
+        PRELOAD_EXPERIMENT = "/".join([tokens[0], tokens[1], "_".join(tokens[2:4])])
     else:
-        SELECTED_EXPERIMENT = SELECTED_EXPERIMENT_
+        PRELOAD_EXPERIMENT = SELECTED_EXPERIMENT_
 else:
-    SELECTED_EXPERIMENT = None
+    PRELOAD_EXPERIMENT = None
+SELECTED_EXPERIMENT = None
 
 USE_VAL = os.environ.get("USE_VAL", None)
 if USE_VAL is not None:
     USE_VAL = USE_VAL == "True"
 
-lock = Lock()
+# Experiment switches take state_lock exclusively, every request reading the experiment
+# state shares it (see reads_experiment). cap_lock only serialises the decoding,
+# because a VideoCapture seeks and reads on a single file handle
+state_lock = ReadWriteLock()
+cap_lock = Lock()
 
-# Initialize application with CORS settings
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'FLYHOSTEL_1234'
-CORS(app)
 
-register_pe_validation(app, get_selected_experiment=lambda: SELECTED_EXPERIMENT)
+def reads_experiment(view):
+    """Run the view holding state_lock as a reader, so the experiment cannot be swapped under it"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with state_lock.read():
+            return view(*args, **kwargs)
+    return wrapper
 
-# Clean up previous frames
-if os.path.exists(FRAMES_DIR):
-    shutil.rmtree(FRAMES_DIR)
+# Initialize application with CORS settings
+with startup.phase("app"):
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'FLYHOSTEL_1234'
+    CORS(app)
+    metrics.init_app(app)
 
-# Use a placeholder URI until an experiment is loaded via POST /api/load
-if SELECTED_EXPERIMENT is not None:
-    database_file = generate_database_filename(SELECTED_EXPERIMENT)
-    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{database_file}"
-    app.config['SQLALCHEMY_BINDS'] = {SELECTED_EXPERIMENT: f"sqlite:///{database_file}"}
-else:
+    register_pe_validation(app, get_selected_experiment=lambda: SELECTED_EXPERIMENT)
+    profiling.init_app(app, get_selected_experiment=lambda: SELECTED_EXPERIMENT)
+    loadtest.init_app(app)
+
+    # Use a placeholder URI until an experiment is loaded (POST /api/load or the warm-up)
     app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:///:memory:"
     app.config['SQLALCHEMY_BINDS'] = {}
 
-db = SQLAlchemy(app)
+    db = SQLAlchemy(app)
 
 cap = None
 frame = None
@@ -90,13 +128,7 @@ CHUNKSIZE = None
 FRAMERATE = None
 IDTRACKERAI_CONFIG = None
 db_manager = None
-
-if SELECTED_EXPERIMENT is not None:
-    db_manager = DatabaseManager(app, db, with_fragments=WITH_FRAGMENTS, experiment=SELECTED_EXPERIMENT, use_val=USE_VAL)
-    print(f"Validation status: {db_manager.use_val}")
-    with app.app_context():
-        out, cap, experiment_metadata, IDTRACKERAI_CONFIG = load_experiment(SELECTED_EXPERIMENT, first_chunk, db_manager)
-        offset, CHUNKSIZE, FRAMERATE = experiment_metadata
+SIDECAR = None   # columnar copy of the tables of the .db, see sidecar.py
 # H5 file handle cache
 _h5_file_cache = {}
 _h5_cache_lock = Lock()
@@ -122,16 +154,24 @@ BODYPART_NAMES = {
     
 }
 
+def pose_file_path(fly_id_str, experiment):
+    """Folder of the pose of the fly and its H5 file"""
+    cache_key = f"{experiment}__{fly_id_str}"
+    folder=os.path.join(os.environ["FLYHOSTEL_VIDEOS"], f"{experiment}/motionmapper/{fly_id_str}/pose_raw")
+    return folder, f"{folder}/{cache_key}/{cache_key}.h5"
+
+
 def get_h5_file(fly_id_str, experiment):
     """Get or open H5 file with caching"""
     cache_key = f"{experiment}__{fly_id_str}"
     
     with _h5_cache_lock:
         if cache_key in _h5_file_cache:
+            metrics.cache_hit("pose_h5_handles")
             return _h5_file_cache[cache_key]
+        metrics.cache_hit("pose_h5_handles", hit=False)
         
-        folder=os.path.join(os.environ["FLYHOSTEL_VIDEOS"], f"{experiment}/motionmapper/{fly_id_str}/pose_raw")
-        pose_file = f"{folder}/{cache_key}/{cache_key}.h5"
+        folder, pose_file = pose_file_path(fly_id_str, experiment)
         
         if not Path(pose_file).exists():
             print(f"INFO {pose_file} not found")
@@ -243,18 +283,420 @@ def get():
     return jsonify({"message": "success"})
 
 
+@app.route("/api/startup", methods=["GET"])
+def get_startup():
+    """Timing of the startup phases and of the imports of the heavy modules"""
+    return jsonify(startup.report())
+
+
+def _flag(value):
+    if value is None:
+        return None
+    return value.lower() in ("1", "true", "yes")
+
+
 @app.route("/api/list", methods=["GET"])
 def list():
+    """
+    Experiments in the catalog.
+    Query: ?q=<substring>&number_of_animals=6&validated=1&pose=1&offset=0&limit=50
+    """
+    try:
+        return jsonify(list_catalog(
+            search=request.args.get("q"),
+            number_of_animals=request.args.get("number_of_animals", type=int),
+            validated=_flag(request.args.get("validated")),
+            pose=_flag(request.args.get("pose")),
+            offset=request.args.get("offset", 0, type=int),
+            limit=request.args.get("limit", type=int),
+        ))
+    except FileNotFoundError:
+        # first run: build the catalog in the background and serve index.txt meanwhile
+        refresh_catalog_in_background()
+    except Exception as error:
+        logger.error("Error listing experiments from the catalog: %s", error)
+
     try:
         return jsonify(list_experiments())
     except Exception as error:
         logger.error("Error listing experiments: %s", error)
         return jsonify({"experiments": [SELECTED_EXPERIMENT] if SELECTED_EXPERIMENT else []})
 
+
+@app.route("/api/list/refresh", methods=["POST"])
+def refresh_list():
+    """Rescan $FLYHOSTEL_VIDEOS in the background"""
+    started = refresh_catalog_in_background()
+    return jsonify({"message": "refreshing", "started": started}), 202
+
+# Background experiment loads. Every POST /api/load gets a load id and its own status
+# record; the previous experiment keeps serving until the new one is swapped in.
+# Stages of the cache warm-up that runs after every load (see _warm_caches), comma separated.
+# Set VALIDATOR_WARM_CACHES to an empty string to disable it
+WARM_CACHES = [
+    stage.strip() for stage in os.environ.get("VALIDATOR_WARM_CACHES", "frames,tracking,navigation,timeline,fragments,pose,pe").split(",")
+    if stage.strip()
+]
+WARM_FRAMES = int(os.environ.get("VALIDATOR_WARM_FRAMES", 30))  # first frames of first_chunk to decode
+WARM_IDLE_POLL = 0.05
+
+_load_jobs = {}          # load_id -> status dict (see _new_load_job)
+_load_jobs_lock = Lock()
+_latest_load_id = None
+MAX_LOAD_JOBS = 20
+
+
+def _new_load_job(experiment, load_id=None):
+    job = {
+        "load_id": load_id or uuid.uuid4().hex,
+        "experiment": experiment,
+        "status": "running",
+        "phase": None,
+        "phases": [],
+        "started_at": datetime.datetime.now().isoformat(),
+        "duration": None,
+        "error": None,
+        "first_frame": None,
+        "cache_warm_up": None,
+    }
+    with _load_jobs_lock:
+        _load_jobs[job["load_id"]] = job
+        # forget the oldest finished loads
+        finished = [k for k, v in _load_jobs.items() if v["status"] != "running"]
+        for load_id in finished[:max(0, len(_load_jobs) - MAX_LOAD_JOBS)]:
+            del _load_jobs[load_id]
+    return job
+
+
+@contextlib.contextmanager
+def _load_phase(job, name):
+    """Record the duration of one phase of a background load"""
+    entry = {"name": name, "status": "running", "duration": None}
+    job["phases"].append(entry)
+    job["phase"] = name
+    t0 = time.perf_counter()
+    try:
+        yield
+        entry["status"] = "done"
+    except Exception:
+        entry["status"] = "failed"
+        raise
+    finally:
+        entry["duration"] = round(time.perf_counter() - t0, 4)
+
+
+def _run_load(job, new_experiment, new_database_file):
+    """
+    Build all the state of new_experiment without touching the globals,
+    then swap it in under state_lock in one go
+    """
+    global SELECTED_EXPERIMENT, cap, frame, contours, db_manager
+    global offset, CHUNKSIZE, FRAMERATE, IDTRACKERAI_CONFIG, SIDECAR
+
+    t0 = time.perf_counter()
+    new_engine = None
+    engines_dict = None
+    previous_engine = None
+    try:
+        with _load_phase(job, "open_database"):
+            new_engine = create_engine(f"sqlite:///{new_database_file}")
+            try:
+                # METADATA, AI and STORE_INDEX are bound to the experiment key,
+                # so the new experiment can be queried while the old one is still the default bind
+                engines_dict = db._app_engines[app]
+                previous_engine = engines_dict.get(new_experiment)
+                engines_dict[new_experiment] = new_engine
+            except (AttributeError, KeyError):
+                engines_dict = None
+
+        with _load_phase(job, "database_manager"):
+            new_db_manager = DatabaseManager(
+                app, db, with_fragments=WITH_FRAGMENTS, experiment=new_experiment,
+                use_val=USE_VAL, dbfile=new_database_file
+            )
+
+        with _load_phase(job, "sidecar"):
+            new_sidecar = open_sidecar(new_database_file, new_db_manager.use_val)
+
+        with app.app_context():
+            _, new_cap, experiment_metadata, new_config = load_experiment(
+                new_experiment, first_chunk, new_db_manager,
+                phase=lambda name: _load_phase(job, name)
+            )
+        if experiment_metadata is None or experiment_metadata[0] is None:
+            raise RuntimeError(f"Failed to load experiment metadata for {new_experiment}")
+
+        with _load_phase(job, "swap"):
+            with state_lock.write():
+                if job["load_id"] != _latest_load_id:
+                    job["status"] = "superseded"
+                    logger.info("Load of %s superseded by a newer load", new_experiment)
+                    return
+
+                app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{new_database_file}"
+                app.config["SQLALCHEMY_BINDS"] = {new_experiment: f"sqlite:///{new_database_file}"}
+                if engines_dict is not None:
+                    old_engines = [eng for eng in engines_dict.values() if eng is not new_engine]
+                    engines_dict.clear()
+                    engines_dict[None] = new_engine
+                    engines_dict[new_experiment] = new_engine
+                    for eng in old_engines:
+                        eng.dispose()
+
+                SELECTED_EXPERIMENT = new_experiment
+                db_manager = new_db_manager
+                SIDECAR = new_sidecar
+                cap = new_cap
+                IDTRACKERAI_CONFIG = new_config
+                offset, CHUNKSIZE, FRAMERATE = experiment_metadata
+                frame = None
+                contours = []
+
+        job["first_frame"] = first_chunk * experiment_metadata[1]
+        job["status"] = "done"
+        logger.info("Switched to experiment %s", SELECTED_EXPERIMENT)
+        if WARM_CACHES:
+            Thread(
+                target=_warm_caches, args=(job, new_experiment),
+                name=f"warm-caches-{job['load_id']}", daemon=True
+            ).start()
+
+    except Exception as error:
+        logger.error("Error loading experiment %s: %s", new_experiment, error)
+        logger.error(traceback.format_exc())
+        job["status"] = "failed"
+        job["error"] = str(error)
+
+    finally:
+        if job["status"] != "done" and new_engine is not None:
+            if engines_dict is not None and engines_dict.get(new_experiment) is new_engine:
+                # reloading the experiment being served must leave its bind in place
+                if previous_engine is None:
+                    engines_dict.pop(new_experiment)
+                else:
+                    engines_dict[new_experiment] = previous_engine
+            new_engine.dispose()
+        job["phase"] = None
+        job["duration"] = round(time.perf_counter() - t0, 4)
+
+
+def _start_load(new_experiment, new_database_file, load_id=None):
+    """Load new_experiment in a background thread. Returns its status record and the thread"""
+    global _latest_load_id
+    job = _new_load_job(new_experiment, load_id)
+    _latest_load_id = job["load_id"]
+    thread = Thread(
+        target=_run_load, args=(job, new_experiment, new_database_file),
+        name=f"load-{job['load_id']}", daemon=True
+    )
+    thread.start()
+    return job, thread
+
+
+def _warm_frame(frame_number):
+    frame_cache = get_frame_cache()
+    if frame_cache is not None and frame_cache.get(_frame_key(SELECTED_EXPERIMENT, frame_number, "jpg")) is not None:
+        return
+    _render_frame(frame_number, IDTRACKERAI_CONFIG)
+
+
+def _warm_pose(experiment):
+    return [
+        lambda identity=identity: get_h5_file(str(identity).zfill(2), experiment)
+        for identity in get_identities(experiment)
+    ]
+
+
+# stages whose tasks take state_lock themselves, only while they read the experiment state
+_UNLOCKED_STAGES = ("timeline", "fragments")
+
+
+def _warm_up_tasks(stage, experiment, first_frame):
+    """Callables of one stage of the cache warm-up, each one small enough to not delay a live request much"""
+    flat = experiment.replace("/", "_")
+    # without the shared frame cache there is nothing to keep, opening the chunk is enough
+    frames = range(first_frame, first_frame + (WARM_FRAMES if get_frame_cache() is not None else 1))
+    if stage == "frames":
+        return [lambda frame_number=frame_number: _warm_frame(frame_number) for frame_number in frames]
+    if stage == "tracking":
+        return [lambda frame_number=frame_number: query_tracking(frame_number) for frame_number in frames]
+    if stage == "navigation":
+        # fills the page cache of the tracking database with the indexes the navigation queries walk
+        return [
+            lambda: get_ok(first_frame, "next"), lambda: get_error(first_frame, "next"),
+            lambda: get_ai(first_frame, "next"), lambda: get_ai(first_frame + 1, "previous"),
+        ]
+    if stage == "timeline":
+        return [lambda: _get_timeline(experiment)]
+    if stage == "fragments":
+        return [lambda: _get_fragment_index(experiment)]
+    if stage == "pose":
+        return _warm_pose(flat) if INCLUDE_POSE else []
+    if stage == "pe":
+        return pe_warm_up_tasks(experiment)
+    raise ValueError(f"Unknown cache warm-up stage {stage}")
+
+
+def _wait_idle():
+    """Block while live requests are being served, so the warm-up runs at lower priority"""
+    while metrics.in_flight() > 0:
+        time.sleep(WARM_IDLE_POLL)
+
+
+def _warm_caches(job, experiment):
+    """
+    Fill the caches the first requests of a session hit (decoded frames, tracking,
+    navigation, pose handles and PE bouts) after experiment was loaded by job.
+    Every task waits for the live requests to finish and the warm-up stops
+    as soon as another experiment is loaded
+    """
+    status = {"status": "running", "stages": []}
+    job["cache_warm_up"] = status
+    t0 = time.perf_counter()
+    for stage in WARM_CACHES:
+        entry = {"name": stage, "status": "running", "tasks": 0, "duration": None}
+        status["stages"].append(entry)
+        t1 = time.perf_counter()
+        try:
+            with state_lock.read():
+                tasks = []
+                if SELECTED_EXPERIMENT == experiment:
+                    with app.app_context():
+                        tasks = _warm_up_tasks(stage, experiment, job["first_frame"])
+
+            for task in tasks:
+                _wait_idle()
+                if stage in _UNLOCKED_STAGES:
+                    if SELECTED_EXPERIMENT != experiment:
+                        break
+                    task()
+                else:
+                    with state_lock.read():
+                        if SELECTED_EXPERIMENT != experiment:
+                            break
+                        with app.app_context():
+                            task()
+                entry["tasks"] += 1
+            entry["status"] = "done" if SELECTED_EXPERIMENT == experiment else "cancelled"
+        except Exception as error:
+            logger.warning("Cache warm-up %s of %s failed: %s", stage, experiment, error)
+            entry["status"] = "failed"
+        entry["duration"] = round(time.perf_counter() - t1, 4)
+        if entry["status"] == "cancelled":
+            break
+
+    if SELECTED_EXPERIMENT != experiment:
+        status["status"] = "cancelled"
+    else:
+        status["status"] = "done"
+    status["duration"] = round(time.perf_counter() - t0, 4)
+    logger.info("Cache warm-up of %s %s in %s s", experiment, status["status"], status["duration"])
+
+
+# Multi-worker mode (see production.py): the experiment selected in one worker is written
+# to a file shared by all of them, and every worker loads it into its own state
+_selection_file = None
+_selection_seen = None   # load id of the last selection this worker followed
+_selection_lock = Lock()
+SELECTION_POLL = float(os.environ.get("VALIDATOR_SELECTION_POLL", 1.0))
+
+
+def _publish_selection(experiment, load_id):
+    if _selection_file is None:
+        return
+    tmp = f"{_selection_file}.{os.getpid()}"
+    with open(tmp, "w") as filehandle:
+        json.dump({"experiment": experiment, "load_id": load_id}, filehandle)
+    os.replace(tmp, _selection_file)
+
+
+def _follow_selection():
+    """Start loading the experiment selected by another worker, if it changed"""
+    global _selection_seen
+    if _selection_file is None:
+        return
+    with _selection_lock:
+        try:
+            with open(_selection_file) as filehandle:
+                selection = json.load(filehandle)
+        except (FileNotFoundError, ValueError):
+            return
+        if selection["load_id"] == _selection_seen:
+            return
+        _selection_seen = selection["load_id"]
+
+    if selection["load_id"] in _load_jobs:
+        return
+    logger.info("Worker %s follows the selection of %s", os.getpid(), selection["experiment"])
+    _start_load(
+        selection["experiment"], generate_database_filename(selection["experiment"]),
+        load_id=selection["load_id"]
+    )
+
+
+def _watch_selection():
+    while True:
+        try:
+            _follow_selection()
+        except Exception as error:
+            logger.error("Error following the experiment selection: %s", error)
+        time.sleep(SELECTION_POLL)
+
+
+def init_worker(selection_file):
+    """
+    Called in every worker process right after it is forked. Drops the handles
+    inherited from the parent (they must not be shared between processes) and
+    starts following the experiment selected in the shared selection_file
+    """
+    global _selection_file, _selection_seen, cap, db_manager, frame, contours, SIDECAR
+    try:
+        for eng in db._app_engines[app].values():
+            eng.dispose(close=False)
+    except (AttributeError, KeyError):
+        pass
+    _h5_file_cache.clear()
+    forget_pe_connections()
+    cap = None
+    db_manager = None
+    SIDECAR = None
+    frame = None
+    contours = []
+
+    _selection_file = selection_file
+    _selection_seen = None
+    Thread(target=_watch_selection, name="selection-watcher", daemon=True).start()
+    # the experiment comes from the selection file
+    warm_up(preload=False)
+
+
+def warm_up(preload=True):
+    """
+    Import the heavy modules in the background, then load VALIDATOR_EXPERIMENT
+    (if set and preload). Called once the server is about to listen
+    """
+    def load():
+        if not preload or PRELOAD_EXPERIMENT is None:
+            return
+        with startup.phase("preload"):
+            _, thread = _start_load(PRELOAD_EXPERIMENT, generate_database_filename(PRELOAD_EXPERIMENT))
+            thread.join()
+
+    return startup.warm_up(then=load)
+
+
+@app.before_request
+def _sync_selection():
+    _follow_selection()
+
+
 @app.route("/api/load", methods=["POST"])
 def load():
-    global SELECTED_EXPERIMENT, cap, frame, contours, db_manager
-    global offset, CHUNKSIZE, FRAMERATE, IDTRACKERAI_CONFIG
+    """
+    Start loading an experiment in the background and return its load id right away.
+    Pass "wait": true to block until the experiment is loaded
+    """
+    global _selection_seen
 
     data = request.get_json()
     if not data or "experiment" not in data:
@@ -269,46 +711,41 @@ def load():
     if not os.path.exists(new_database_file):
         return jsonify({"error": f"Experiment database not found: {new_database_file}"}), 404
 
-    lock.acquire()
-    try:
-        SELECTED_EXPERIMENT = new_experiment
+    job, thread = _start_load(new_experiment, new_database_file)
+    with _selection_lock:
+        _selection_seen = job["load_id"]
+        _publish_selection(new_experiment, job["load_id"])
 
-        db.session.remove()
+    if not data.get("wait", False):
+        return jsonify({"message": "loading", "load_id": job["load_id"], "experiment": new_experiment}), 202
 
-        app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{new_database_file}"
-        app.config["SQLALCHEMY_BINDS"] = {new_experiment: f"sqlite:///{new_database_file}"}
+    thread.join()
+    if job["status"] != "done":
+        return jsonify({"error": job["error"] or job["status"], "load_id": job["load_id"]}), 500
+    return jsonify({
+        "message": "success", "load_id": job["load_id"],
+        "experiment": new_experiment, "first_frame": job["first_frame"]
+    })
 
-        try:
-            engines_dict = db._app_engines[app]
-            for eng in engines_dict.values():
-                eng.dispose()
-            engines_dict.clear()
-            new_engine = create_engine(f"sqlite:///{new_database_file}")
-            engines_dict[None] = new_engine
-            engines_dict[new_experiment] = new_engine
-        except (AttributeError, KeyError):
-            pass
-
-        db_manager = DatabaseManager(app, db, with_fragments=WITH_FRAGMENTS, experiment=SELECTED_EXPERIMENT, use_val=USE_VAL)
-
-        out, cap, experiment_metadata, IDTRACKERAI_CONFIG = load_experiment(SELECTED_EXPERIMENT, first_chunk, db_manager)
-        if experiment_metadata is None:
-            return jsonify({"error": f"Failed to load experiment metadata for {new_experiment}"}), 500
-
-        offset, CHUNKSIZE, FRAMERATE = experiment_metadata
-        frame = None
-        contours = []
-        logger.info("Switched to experiment %s", SELECTED_EXPERIMENT)
-
-    except Exception as error:
-        print(traceback.print_exc())
-
-        logger.error("Error loading experiment %s: %s", new_experiment, error)
-        return jsonify({"error": str(error)}), 500
-    finally:
-        lock.release()
 
-    return jsonify({"message": "success", "experiment": SELECTED_EXPERIMENT, "first_frame": first_chunk * CHUNKSIZE})
+@app.route("/api/load/status", methods=["GET"])
+def load_status():
+    """
+    Progress of a background load: the current phase and the duration of every phase.
+    In multi-worker mode this is the progress of the worker answering the request
+    Query: ?load_id=<id>  (defaults to the most recent load)
+    """
+    load_id = request.args.get("load_id", _latest_load_id)
+    with _load_jobs_lock:
+        job = _load_jobs.get(load_id)
+        if job is None:
+            return jsonify({"error": f"Unknown load id {load_id}"}), 404
+        status = dict(job)
+        status["phases"] = [dict(p) for p in job["phases"]]
+        if job["cache_warm_up"] is not None:
+            status["cache_warm_up"] = dict(job["cache_warm_up"], stages=[dict(s) for s in job["cache_warm_up"]["stages"]])
+    status["selected_experiment"] = SELECTED_EXPERIMENT
+    return jsonify(status)
 
 
 def row2dict(row):
@@ -318,10 +755,27 @@ def row2dict(row):
     return d
 
 
+def _sidecar():
+    """
+    The sidecar of the loaded experiment, or None to read from SQL (no sidecar, or the .db
+    changed since it was exported). Read it once per request into a local, SIDECAR can be
+    swapped by another thread
+    """
+    sidecar = SIDECAR
+    if sidecar is None or not sidecar.current():
+        return None
+    return sidecar
+
+
 @app.route('/api/frame_range', methods=['GET'])
+@reads_experiment
 def get_frame_range():
     if db_manager is None:
         return _experiment_required()
+    sidecar = _sidecar()
+    if sidecar is not None:
+        min_frame, max_frame = sidecar.frame_range()
+        return jsonify({"min_frame": min_frame, "max_frame": max_frame})
     tables = db_manager.tables
     try:
         # tables["IDENTITY"] is already IDENTITY_VAL or IDENTITY,
@@ -336,6 +790,7 @@ def get_frame_range():
         return jsonify({"message": str(error)}), 500
 
 @app.route("/api/framerate", methods=['GET'])
+@reads_experiment
 def get_framerate():
     if db_manager is None:
         return _experiment_required()
@@ -343,68 +798,306 @@ def get_framerate():
     framerate=tables["METADATA"].query.filter_by(field="framerate").first().value
     return framerate
 
-@app.route('/api/frame/<int:frame_number>', methods=['GET'])
-def get_frame(frame_number):
+def _config_key(config):
+    return hashlib.md5(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+
 
-    global cap
+def _frame_key(experiment, frame_number, *parts):
+    """
+    Key of a frame in the shared frame cache. It includes the video root, because the cache
+    is shared by every server on the machine and experiment names are only unique under a root
+    """
+    return (os.environ.get("FLYHOSTEL_VIDEOS"), experiment, frame_number, *parts)
+
+
+def _render_frame(frame_number, config):
+    """
+    Decode frame_number, encode it as JPEG and segment it with the idtrackerai config.
+    Both results are stored in the shared frame cache, only if decoding and segmentation succeeded
+
+    Returns:
+        jpeg (bytes): None if the frame could not be decoded
+        contours (list): See backend.process_frame
+    """
     global frame
     global contours
 
+    experiment = SELECTED_EXPERIMENT
+    requested = frame_number
+    succeeded = True
+
     if frame is None:
         empty_frame=np.ones((1000, 1000), np.uint8)*255
     else:
         empty_frame=np.ones_like(frame, np.uint8)*255
 
-
-    if cap is None:
-        return jsonify({'error': 'Cap could not be loaded'}), 404
-
-    lock.acquire()
     try:
         assert frame_number is not None
-        app.logger.warning(f"frame_number = {frame_number}")
-
         app.logger.debug(f"Fetching frame {frame_number}")
-        frame, (frame_number, frame_timestamp) = cap.get_image(frame_number)
+        with cap_lock, timed("decode"):
+            frame, (frame_number, frame_timestamp) = cap.get_image(frame_number)
         app.logger.debug(f"Fetching frame {frame_number} done")
 
-    except ValueError or AssertionError as error:
+    except (ValueError, AssertionError) as error:
+        succeeded = False
         frame=empty_frame.copy()
         frame_number=first_chunk*CHUNKSIZE
         frame_timestamp=0
         app.logger.error(f"Can't fetch frame {frame_number}")
         app.logger.error(error)
 
-    lock.release()
+    if frame is None:
+        return None, []
 
-    # frame=cv2.resize(frame, (1000, 1000))
-    filename=f"{frame_number}.jpg"
-    img_path = os.path.join(FRAMES_DIR, filename)
-    os.makedirs(os.path.dirname(img_path), exist_ok=True)
     try:
-        cv2.imwrite(img_path, frame, [cv2.IMWRITE_JPEG_QUALITY, 50])       
-        assert os.path.exists(img_path), f"Could not save {img_path}"
-        app.logger.debug(f"{cap._basedir} -> {img_path}")
-        contours=process_frame(frame, session.get("idtrackerai_config", IDTRACKERAI_CONFIG))
-        
+        with timed("segmentation"):
+            contours=process_frame(frame, config)
+        image=frame
     except Exception as error:
+        succeeded = False
         contours=[]
         logger.error(error)
-        cv2.imwrite(img_path, empty_frame, [cv2.IMWRITE_JPEG_QUALITY, 50])       
+        image=empty_frame
+
+    with timed("encode"):
+        jpeg = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 50])[1].tobytes()
+
+    frame_cache = get_frame_cache()
+    # a placeholder would be served by every worker until its slot is reused
+    if frame_cache is not None and succeeded:
+        frame_cache.put(_frame_key(experiment, requested, "jpg"), jpeg)
+        frame_cache.put(_frame_key(experiment, requested, "contours", _config_key(config)), json.dumps(contours).encode())
+    return jpeg, contours
+
+
+FRAME_OVERLAYS = ("identity", "contours", "pose")
+# rows of the pose dicts of absolute_pose (BODYPARTS_TO_KEEP order) joined in the skeleton
+_POSE_EDGES = [
+    (BODYPARTS_TO_KEEP.index(a), BODYPARTS_TO_KEEP.index(b))
+    for a, b in POSE_SKELETON if a in BODYPARTS_TO_KEEP and b in BODYPARTS_TO_KEEP
+]
+
+
+def _frame_contours(frame_number, image, config):
+    """Contours of the frame, from the frame cache or segmented again"""
+    frame_cache = get_frame_cache()
+    key = _frame_key(SELECTED_EXPERIMENT, frame_number, "contours", _config_key(config))
+    if frame_cache is not None:
+        hit = frame_cache.get(key)
+        if hit is not None:
+            return json.loads(hit)
+    try:
+        with timed("segmentation"):
+            frame_contours = process_frame(image, config)
+    except Exception as error:
+        logger.error(error)
+        return []
+    if frame_cache is not None:
+        frame_cache.put(key, json.dumps(frame_contours).encode())
+    return frame_contours
 
 
-    if frame is None:
+def _render_overlay(frame_number, overlays, config):
+    """
+    JPEG of the frame with the overlays drawn on it (see FRAME_OVERLAYS):
+    identity labels as backend.draw_frame, segmentation contours and pose keypoints
+
+    Returns:
+        jpeg (bytes): None if the frame could not be decoded
+    """
+    try:
+        with cap_lock, timed("decode"):
+            image, _ = cap.get_image(frame_number)
+    except (ValueError, AssertionError) as error:
+        app.logger.error(f"Can't fetch frame {frame_number}: {error}")
+        return None
+    if image is None:
+        return None
+
+    image = image.copy()
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+    with timed("overlay"):
+        if "contours" in overlays:
+            frame_contours = [np.array(contour, dtype=np.int32) for contour in _frame_contours(frame_number, image[..., 0], config)]
+            cv2.drawContours(image, frame_contours, -1, GREEN, 1)
+
+    animals = []
+    if "identity" in overlays or "pose" in overlays:
+        animals, chunksize = query_tracking(frame_number)
+    number_of_animals = int(re.search(".*/(.*)X/.*", SELECTED_EXPERIMENT).group(1))
+    identities = [animal["identity"] or 0 for animal in animals]
+    colors = identity_colors(identities, number_of_animals)
+
+    if "pose" in overlays and INCLUDE_POSE and animals:
+        experiment = SELECTED_EXPERIMENT.replace("/", "_")
+        poses = {
+            animal["identity"]: read_pose(animal["identity"], frame_number, experiment, chunksize)
+            for animal in animals if animal["identity"]
+        }
+        pose_absolute = absolute_pose(animals, poses, experiment)
+        with timed("overlay"):
+            for identity, color in zip(identities, colors):
+                pose = pose_absolute.get(str(identity))
+                if pose:
+                    points = np.array([[np.nan if v is None else v for v in xy] for xy in pose.values()], dtype=float)
+                    draw_pose(image, points, color, _POSE_EDGES)
+
+    if "identity" in overlays and animals:
+        with timed("overlay"):
+            image = draw_labels(
+                image, [animal["x"] for animal in animals], [animal["y"] for animal in animals],
+                identity_labels(identities, [animal["fragment"] for animal in animals]), colors
+            )
+
+    with timed("encode"):
+        return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 50])[1].tobytes()
+
+
+@app.route('/api/frame/<int:frame_number>', methods=['GET'])
+@reads_experiment
+def get_frame(frame_number):
+    """
+    JPEG of the frame. Query: ?overlay=identity,contours,pose draws them on the frame
+    (cached per set of overlays)
+    """
+    if cap is None:
+        return jsonify({'error': 'Cap could not be loaded'}), 404
+
+    overlay = request.args.get("overlay")
+    if overlay:
+        overlays = sorted(set(overlay.split(",")))
+        unknown = [name for name in overlays if name not in FRAME_OVERLAYS]
+        if unknown:
+            return jsonify({"error": f"Unknown overlays {unknown}, choose from {', '.join(FRAME_OVERLAYS)}"}), 400
+        return _get_overlay_frame(frame_number, overlays)
+
+    frame_cache = get_frame_cache()
+    jpeg = None
+    if frame_cache is not None:
+        jpeg = frame_cache.get(_frame_key(SELECTED_EXPERIMENT, frame_number, "jpg"))
+
+    if jpeg is None:
+        jpeg, _ = _render_frame(frame_number, session.get("idtrackerai_config", IDTRACKERAI_CONFIG))
+
+    if jpeg is None:
         return jsonify({'error': 'Frame not found'}), 404
-    else:
-        return send_from_directory(os.path.realpath(FRAMES_DIR), filename)
+    return Response(jpeg, mimetype="image/jpeg")
+
 
 
+def _get_overlay_frame(frame_number, overlays):
+    config = session.get("idtrackerai_config", IDTRACKERAI_CONFIG)
+    # the labels and pose change with the tracking, the contours with the config
+    key = _frame_key(
+        SELECTED_EXPERIMENT, frame_number, "overlay", ",".join(overlays),
+        _config_key(config) if "contours" in overlays else None,
+        os.path.getmtime(db_manager.dbfile) if db_manager is not None else None,
+    )
+    frame_cache = get_frame_cache()
+    jpeg = frame_cache.get(key) if frame_cache is not None else None
+    if jpeg is None:
+        jpeg = _render_overlay(frame_number, overlays, config)
+        if jpeg is None:
+            return jsonify({'error': 'Frame not found'}), 404
+        if frame_cache is not None:
+            frame_cache.put(key, jpeg)
+    return Response(jpeg, mimetype="image/jpeg")
+
 
 @app.route('/api/preprocess/<int:frame_number>', methods=['GET'])
+@reads_experiment
 def get_preprocess(frame_number):
+    """Contours of the frame, shared by all workers (segmented again on a cache miss)"""
+    config = session.get("idtrackerai_config", IDTRACKERAI_CONFIG)
+    frame_cache = get_frame_cache()
+    if frame_cache is not None:
+        hit = frame_cache.get(_frame_key(SELECTED_EXPERIMENT, frame_number, "contours", _config_key(config)))
+        if hit is not None:
+            return Response(b'{"contours": ' + hit + b'}', mimetype="application/json")
 
-    global contours
-    return jsonify({"contours": contours})
+    if cap is None:
+        return jsonify({"contours": contours})
+    _, frame_contours = _render_frame(frame_number, config)
+    return jsonify({"contours": frame_contours})
+
+
+@app.route('/api/segmentation/sweep', methods=['POST'])
+def post_segmentation_sweep():
+    """
+    Number of blobs in a sample of frames for every combination of intensity and area thresholds
+    Body: {"intensity": [[min, max], ...], "area": [[min, max], ...],
+           "frames": [<frame>, ...] or "sample": 10 (frames evenly spaced over the experiment)}
+    """
+    data = request.get_json(silent=True) or {}
+    # the experiment is only read to decode the frames, the sweep itself
+    # runs without state_lock so it never holds back a /api/load
+    with state_lock.read():
+        if cap is None or db_manager is None:
+            return _experiment_required()
+        config = copy.deepcopy(session.get("idtrackerai_config", IDTRACKERAI_CONFIG))
+        try:
+            settings = sweep.settings_grid(
+                data.get("intensity") or [config["_intensity"]["value"]],
+                data.get("area") or [config["_area"]["value"]],
+            )
+            if data.get("frames"):
+                frame_numbers = sorted({int(frame_number) for frame_number in data["frames"]})
+            else:
+                sample = int(data.get("sample", 10))
+                if not 0 < sample <= sweep.SWEEP_MAX_FRAMES:
+                    raise ValueError(f"sample must be between 1 and {sweep.SWEEP_MAX_FRAMES}")
+                # the range of the experiment is one indexed query, the timeline may not be built yet
+                first_frame, last_frame = timeline.frame_range(db_manager.dbfile, db_manager.use_val, _sidecar())
+                frame_numbers = sorted(set(np.linspace(first_frame, last_frame, sample).round().astype(int).tolist()))
+        except (TypeError, ValueError, OverflowError) as error:
+            return jsonify({"error": str(error)}), 400
+        if not 0 < len(frame_numbers) <= sweep.SWEEP_MAX_FRAMES:
+            return jsonify({"error": f"A sweep must have between 1 and {sweep.SWEEP_MAX_FRAMES} frames"}), 400
+
+        frames = {}
+        for frame_number in frame_numbers:
+            try:
+                with cap_lock, timed("decode"):
+                    image, _ = cap.get_image(frame_number)
+            except (ValueError, AssertionError) as error:
+                app.logger.error(f"Can't fetch frame {frame_number}: {error}")
+                continue
+            if image is not None:
+                frames[frame_number] = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if not frames:
+        return jsonify({"error": "None of the frames could be decoded"}), 404
+
+    number_of_animals = int(config["_number_of_animals"]["value"])
+    with timed("segmentation"):
+        result = sweep.run_sweep(frames, config, settings, number_of_animals)
+    result["skipped_frames"] = [frame_number for frame_number in frame_numbers if frame_number not in frames]
+    return jsonify(result)
+
+
+def _frame_cache_counts():
+    frame_cache = get_frame_cache()
+    if frame_cache is None:
+        return None
+    return frame_cache.hits, frame_cache.misses
+
+metrics.register_cache("frames", _frame_cache_counts)
+
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Metrics of this process in the Prometheus text format,
+    or as JSON with ?format=json (or Accept: application/json)
+    """
+    wants_json = request.args.get("format") == "json" or (
+        request.args.get("format") is None
+        and request.accept_mimetypes.best_match(["text/plain", "application/json"]) == "application/json"
+    )
+    if wants_json:
+        return jsonify(metrics.snapshot())
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
 
 
 def get_pose(db_manager, frame_number):
@@ -434,44 +1127,31 @@ def project_to_absolute(pose, centroids):
     return pose_abs
 
 
-@app.route('/api/tracking/<int:frame_number>', methods=['GET'])
-def get_tracking(frame_number):
-    if db_manager is None:
-        return _experiment_required()
-    
-    global SELECTED_EXPERIMENT
-    number_of_animals = int(re.search(".*/(.*)X/.*", SELECTED_EXPERIMENT).group(1))
+def query_tracking(frame_number):
+    """
+    Rows of ROI_0 in frame_number joined with their IDENTITY, sorted by identity.
+    Needs an app context
+
+    Returns:
+        out (list): one dict per animal
+        chunksize (int)
+    """
     logger.debug("Loading tracking data for %s", SELECTED_EXPERIMENT)
-    tables = db_manager.tables
- 
     out = []
-    number_of_animals_found = 0
+    chunksize = CHUNKSIZE
+    t0 = time.perf_counter()
+    phase = "sql"
+    sidecar = _sidecar()
     try:
-        chunksize = int(float(tables["METADATA"].query.filter_by(field="chunksize").all()[0].value))
- 
-        output = tables["ROI_0"].query.filter_by(frame_number=frame_number)
-        identity_table = tables["IDENTITY"].query.filter_by(frame_number=frame_number)
-         # frame_time (ms since the marked time) lives in STORE_INDEX, keyed by frame_number
-        store_row = tables["STORE_INDEX"].query.filter_by(frame_number=frame_number).first()
-        frame_time = store_row.frame_time if store_row is not None else None
-
-        for row in output.all():
-            identity = None
-            local_identity = None
-            hit = False
-            for id_row in identity_table:
-                if row.in_frame_index == id_row.in_frame_index:
-                    identity = id_row.identity
-                    local_identity = id_row.local_identity
-                    hit = True
- 
-            if not hit:
-                identity = None
- 
-            if row.modified is None:
-                modified = 0
-            else:
-                modified = row.modified
+        if sidecar is not None:
+            phase = "sidecar"
+            chunksize = sidecar.chunksize
+            rows, frame_time = sidecar.tracking(frame_number)
+        else:
+            chunksize, rows, frame_time = _query_tracking_sql(frame_number)
+
+        for row in rows:
+            modified = 0 if row["modified"] is None else row["modified"]
             
             # t = seconds since ZT0. frame_time is ms since the marked time; offset is
             # the seconds between ZT0 and that marked time.
@@ -485,28 +1165,384 @@ def get_tracking(frame_number):
                 "frame_number": frame_number,
                 "t": t,
                 "ZT": zt,
-                "x": row.x,
-                "y": row.y,
-                "in_frame_index": row.in_frame_index,
-                "fragment": getattr(row, "fragment", -1),
-                "area": row.area,
-                "identity": identity,
-                "local_identity": local_identity,
+                "x": row["x"],
+                "y": row["y"],
+                "in_frame_index": row["in_frame_index"],
+                "fragment": row.get("fragment", -1),
+                "area": row["area"],
+                "identity": row["identity"],
+                "local_identity": row["local_identity"],
                 "modified": modified,
                 "chunksize": chunksize,
             }
  
-            number_of_animals_found += 1
             out.append(data)
         
         out = sorted(out, key=lambda x: x["identity"] if x["identity"] is not None else -1)
     except Exception as error:
         app.logger.error(error)
+    metrics.observe_phase(phase, time.perf_counter() - t0)
+
+    logger.debug("Number of animals found in frame %s = %s", frame_number, len(out))
+    return out, chunksize
+
+
+def _query_tracking_sql(frame_number):
+    """
+    Rows of ROI_0 in frame_number with the identity and local identity of their IDENTITY row,
+    as in Sidecar.tracking
+
+    Returns:
+        chunksize (int)
+        rows (list): one dict per row of ROI_0
+        frame_time (int)
+    """
+    tables = db_manager.tables
+    chunksize = int(float(tables["METADATA"].query.filter_by(field="chunksize").all()[0].value))
+
+    output = tables["ROI_0"].query.filter_by(frame_number=frame_number)
+    identity_table = tables["IDENTITY"].query.filter_by(frame_number=frame_number)
+    # frame_time (ms since the marked time) lives in STORE_INDEX, keyed by frame_number
+    store_row = tables["STORE_INDEX"].query.filter_by(frame_number=frame_number).first()
+    frame_time = store_row.frame_time if store_row is not None else None
+
+    rows = []
+    for row in output.all():
+        identity = None
+        local_identity = None
+        for id_row in identity_table:
+            if row.in_frame_index == id_row.in_frame_index:
+                identity = id_row.identity
+                local_identity = id_row.local_identity
+
+        rows.append({
+            "x": row.x,
+            "y": row.y,
+            "in_frame_index": row.in_frame_index,
+            "fragment": getattr(row, "fragment", -1),
+            "area": row.area,
+            "modified": row.modified,
+            "identity": identity,
+            "local_identity": local_identity,
+        })
+    return chunksize, rows, frame_time
+
+
+def _rejected_frames(experiment):
+    """first_frame of the rejected interactions of experiment, None if there are none"""
+    try:
+        rejections, _ = load_rejections(experiment)
+        return rejections["first_frame"].values
+    except (FileNotFoundError, KeyError, OSError) as error:
+        logger.debug("No rejections for the timeline of %s: %s", experiment, error)
+        return None
+
+
+def _timeline_key():
+    try:
+        rejections_mtime = os.path.getmtime(rejections_file(SELECTED_EXPERIMENT.replace("/", "_")))
+    except OSError:
+        rejections_mtime = None
+    return (os.path.getmtime(db_manager.dbfile), rejections_mtime, db_manager.use_val)
+
+
+def _timeline_build():
+    """
+    Experiment, key and builder of the timeline of the loaded experiment (hold state_lock).
+    The builder only uses what it was given, so it can run after state_lock is released
+    """
+    experiment = SELECTED_EXPERIMENT
+    dbfile = db_manager.dbfile
+    use_val = db_manager.use_val
+    sidecar = _sidecar()
+    number_of_animals = int(re.search(".*/(.*)X/.*", experiment).group(1))
+
+    def build():
+        first_frame, last_frame = timeline.frame_range(dbfile, use_val, sidecar)
+        with timed("timeline"):
+            return timeline.build_timeline(
+                first_frame, last_frame, dbfile, use_val, number_of_animals,
+                rejections=_rejected_frames(experiment.replace("/", "_")), sidecar=sidecar
+            )
+
+    return experiment, _timeline_key(), build
+
+
+def _get_timeline(experiment=None):
+    """
+    Timeline of the loaded experiment, built on first use and cached until its .db or rejections change.
+    None if no experiment is loaded (or it is not experiment). Call it without holding state_lock
+    """
+    return _build_unlocked(experiment, _timeline_build, timeline.get_timeline)
+
+
+def _fragment_index_key():
+    return (db_signature(db_manager.dbfile), db_manager.use_val)
+
+
+def _fragment_index_build():
+    """Experiment, key and builder of the fragment index of the loaded experiment (hold state_lock)"""
+    dbfile = db_manager.dbfile
+    use_val = db_manager.use_val
+    sidecar = _sidecar()
+
+    def build():
+        with timed("fragments"):
+            return fragments.build_fragment_index(dbfile, use_val, sidecar=sidecar)
+
+    return SELECTED_EXPERIMENT, _fragment_index_key(), build
+
+
+def _get_fragment_index(experiment=None):
+    """
+    Fragment index of the loaded experiment, built on first use and cached until its .db changes.
+    None if no experiment is loaded (or it is not experiment). Call it without holding state_lock
+    """
+    return _build_unlocked(experiment, _fragment_index_build, fragments.get_fragment_index)
+
+
+def _build_unlocked(experiment, snapshot, get):
+    """
+    Take a snapshot() (experiment, key, build) of the loaded experiment under state_lock and
+    get(experiment, key, build, publish) after releasing it, so a /api/load never waits for
+    the build; the result is only cached if the experiment is still the loaded one.
+    None if no experiment is loaded, or experiment (if given) is not the loaded one
+    """
+    with state_lock.read():
+        if db_manager is None or experiment not in (None, SELECTED_EXPERIMENT):
+            return None
+        experiment, key, build = snapshot()
+    return get(experiment, key, build, publish=lambda: SELECTED_EXPERIMENT == experiment)
+
+
+@app.route('/api/timeline', methods=['GET'])
+def get_timeline():
+    """
+    Per-bin counts over the experiment of frames with identity 0 (errors), frames with
+    fewer ROIs than animals (missing), AI frames, rejections and modified rows.
+    Query: ?bins=200&start=<frame>&end=<frame>  (the whole experiment by default)
+    Not under reads_experiment: the first request builds the timeline, without holding state_lock
+    """
+    bins = request.args.get("bins", 200, type=int)
+    if bins <= 0:
+        return jsonify({"error": "bins must be positive"}), 400
+    experiment_timeline = _get_timeline()
+    if experiment_timeline is None:
+        return _experiment_required()
+    try:
+        summary = experiment_timeline.query(
+            bins, request.args.get("start", type=int), request.args.get("end", type=int)
+        )
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+    with timed("json"):
+        return jsonify(summary)
+
+
+def _after_correction(correction, signature, timeline_key):
+    """
+    Bring the caches derived from the .db up to date with a correction, only in the chunks it changed:
+    the sidecar (and so the tracking and the navigation) and the timeline
+
+    Arguments:
+        signature: db_signature of the .db before the correction
+        timeline_key: _timeline_key before the correction
+    """
+    dbfile = db_manager.dbfile
+    use_val = db_manager.use_val
+    chunks = [*range(correction["first_frame"] // CHUNKSIZE, correction["last_frame"] // CHUNKSIZE + 1)]
+    # only state_lock.write() may rebind SIDECAR, the routes reading it concurrently
+    # see a sidecar that cannot follow the .db as stale and read from SQL
+    sidecar = SIDECAR
+    if sidecar is not None:
+        with timed("sidecar_update"):
+            updated = update_sidecar(dbfile, signature, [f"ROI_0{use_val}", f"IDENTITY{use_val}"], chunks)
+        if updated:
+            sidecar.refresh(force=True)
+        else:
+            logger.warning("The sidecar of %s is out of date, reading from SQL", dbfile)
+            sidecar.stale = True
+            sidecar = None
+
+    number_of_animals = int(re.search(".*/(.*)X/.*", SELECTED_EXPERIMENT).group(1))
+    with timed("timeline"):
+        timeline.update_timeline(
+            SELECTED_EXPERIMENT, timeline_key, _timeline_key(),
+            correction["first_frame"], correction["last_frame"],
+            lambda counter: timeline.count_events(counter, dbfile, use_val, number_of_animals, sidecar=sidecar)
+        )
+    with timed("fragments"):
+        fragments.update_fragment_index(
+            SELECTED_EXPERIMENT, (signature, use_val), _fragment_index_key(),
+            correction["first_frame"], correction["last_frame"],
+            lambda first_frame, last_frame: fragments.count_fragments(
+                dbfile, use_val, sidecar=sidecar, first_frame=first_frame, last_frame=last_frame
+            )
+        )
+    return chunks
+
+
+def _apply_correction(apply):
+    """
+    Run apply(dbfile) -> correction (see corrections.py) and update the caches.
+    Returns the response of the correction routes
+    """
+    if db_manager is None:
+        return _experiment_required()
+    dbfile = db_manager.dbfile
+    with corrections.write_lock(dbfile):
+        signature = db_signature(dbfile)
+        timeline_key = _timeline_key()
+        try:
+            with timed("correction"):
+                correction = apply(dbfile)
+        except corrections.CorrectionError as error:
+            return jsonify({"error": str(error)}), error.status
+        chunks = _after_correction(correction, signature, timeline_key) if correction["rows"] else []
+    logger.info("Correction %s changed %s rows", correction["id"], correction["rows"])
+    return jsonify(dict(correction, chunks=chunks))
+
+
+def _identity_argument(data, name):
+    number_of_animals = int(re.search(".*/(.*)X/.*", SELECTED_EXPERIMENT).group(1))
+    identity = int(data[name])
+    if not 0 <= identity <= number_of_animals:
+        raise ValueError(f"{name} must be between 0 and {number_of_animals}")
+    return identity
+
+
+@app.route('/api/corrections/range', methods=['POST'])
+@reads_experiment
+def post_correction_range():
+    """
+    Give identity `to` to the animal with `identity` between start and end, in one transaction
+    Body: {"start": <frame>, "end": <frame>, "identity": <identity>, "to": <identity>,
+           "swap": false (the animal with `to` gets `identity`), "reviewer": <name>}
+    """
+    if db_manager is None:
+        return _experiment_required()
+    data = request.get_json(silent=True) or {}
+    try:
+        start, end = int(data["start"]), int(data["end"])
+        identity, to = _identity_argument(data, "identity"), _identity_argument(data, "to")
+    except (KeyError, TypeError, ValueError) as error:
+        return jsonify({"error": f"start, end, identity and to are required: {error}"}), 400
+    return _apply_correction(lambda dbfile: corrections.reassign_range(
+        dbfile, db_manager.use_val, start, end, identity, to,
+        swap=bool(data.get("swap", False)), reviewer=data.get("reviewer")
+    ))
+
+
+@app.route('/api/corrections/fragment', methods=['POST'])
+@reads_experiment
+def post_correction_fragment():
+    """
+    Give identity `to` to a whole fragment (or to its frames between start and end)
+    Body: {"fragment": <fragment>, "to": <identity>, "start": <frame>, "end": <frame>, "reviewer": <name>}
+    """
+    if db_manager is None:
+        return _experiment_required()
+    data = request.get_json(silent=True) or {}
+    try:
+        fragment = data["fragment"]
+        to = _identity_argument(data, "to")
+        start = None if data.get("start") is None else int(data["start"])
+        end = None if data.get("end") is None else int(data["end"])
+    except (KeyError, TypeError, ValueError) as error:
+        return jsonify({"error": f"fragment and to are required: {error}"}), 400
+    return _apply_correction(lambda dbfile: corrections.reassign_fragment(
+        dbfile, db_manager.use_val, fragment, to, start=start, end=end, reviewer=data.get("reviewer")
+    ))
+
+
+@app.route('/api/corrections/<int:correction_id>/undo', methods=['POST'])
+@reads_experiment
+def post_correction_undo(correction_id):
+    """Restore what a correction changed (the latest corrections of the same frames first)"""
+    return _apply_correction(lambda dbfile: corrections.undo(dbfile, correction_id))
+
+
+@app.route('/api/corrections', methods=['GET'])
+@reads_experiment
+def get_corrections():
+    """Journal of the corrections of the loaded experiment, newest first. Query: ?limit=100"""
+    if db_manager is None:
+        return _experiment_required()
+    return jsonify(corrections.list_corrections(db_manager.dbfile, request.args.get("limit", 100, type=int)))
+
+
+def read_pose(identity, frame_number, experiment, chunksize):
+    """Pose of one animal relative to its square, see get_pose_from_h5 (None if not available)"""
+    try:
+        fly_id_str=str(identity).zfill(2)
+        with timed("pose_h5"):
+            return get_pose_from_h5(
+                fly_id_str,
+                frame_number,
+                experiment,
+                chunksize
+            )
+    except Exception as e:
+        logger.error(f"Failed to load pose for identity {identity}: {e}")
+        logger.error(traceback.print_exc())
+        return None
+
+
+def absolute_pose(animals, poses, experiment):
+    """
+    Convert the pose of every animal from relative to its square to absolute coordinates
+
+    Arguments:
+
+        animals (list): tracking data of the frame, see query_tracking
+        poses (dict): identity -> pose relative to the square, see read_pose
+        experiment (str): FlyHostelN_NX_YYYY-MM-DD_HH-MM-SS
+    """
+    pose_absolute = {}
+    square_width=get_square_width(experiment)
+    square_height=get_square_height(experiment)
+
+    for animal in animals:
+        pose_relative = poses.get(animal['identity'])
+        if not pose_relative:
+            continue
+
+        # Convert from relative (centroid-relative) to absolute coordinates
+        pose_absolute_animal = {}
+        # Pose is relative to top-left of 200x200 square centered at centroid
+        # Top-left corner is at (centroid_x - 100, centroid_y - 100)
+        square_top_left_x = animal['x'] - square_width//2
+        square_top_left_y = animal['y'] - square_height//2
+        
+        for bodypart_name, (rel_x, rel_y) in pose_relative.items():
+            if rel_x is not None and rel_y is not None:
+                # The H5 coordinates are relative to centroid
+                abs_x = round(square_top_left_x  + rel_x, 2)
+                abs_y = round(square_top_left_y  + rel_y, 2)
+                pose_absolute_animal[bodypart_name] = [None if np.isnan(abs_x) else abs_x, None if np.isnan(abs_y) else abs_y]
+            else:
+                pose_absolute_animal[bodypart_name] = [None, None]
+        
+        pose_absolute[str(animal['identity'])] = pose_absolute_animal
+    return pose_absolute
+
+
+def tracking_payload(out, pose_absolute):
+    number_of_animals = int(re.search(".*/(.*)X/.*", SELECTED_EXPERIMENT).group(1))
+    return {
+        "tracking_data": out,
+        "number_of_animals": number_of_animals,
+        "pose": pose_absolute
+    }
+
+
+@app.route('/api/tracking/<int:frame_number>', methods=['GET'])
+@reads_experiment
+def get_tracking(frame_number):
+    if db_manager is None:
+        return _experiment_required()
     
-    if number_of_animals_found == 0:
-        app.logger.warning("No animals found for frame %s", frame_number)
-    else:
-        app.logger.info("Number of animals found = %s", number_of_animals_found)
+    out, chunksize = query_tracking(frame_number)
  
     # ===== NEW: FETCH POSE DATA FOR EACH ANIMAL FROM H5 FILES =====
     
@@ -517,62 +1553,24 @@ def get_tracking(frame_number):
         try:
             # Get list of fly identities
             experiment=SELECTED_EXPERIMENT.replace("/", "_")
-            square_width=get_square_width(experiment)
-            square_height=get_square_height(experiment)
-
-
             identities = get_identities(experiment)
-            identity_to_fly_id = {i: fly_id for i, fly_id in enumerate(identities)}
-           
-            for animal in out:
-                if animal['identity'] is not None and animal['identity'] in identity_to_fly_id.values():
-                    try:
-                        fly_id_str=str(animal['identity']).zfill(2)
-                        pose_relative = get_pose_from_h5(
-                            fly_id_str,
-                            frame_number,
-                            experiment,
-                            chunksize
-                        )
-                        
-                        if pose_relative:
-                            # Convert from relative (centroid-relative) to absolute coordinates
-                            pose_absolute_animal = {}
-                            # Pose is relative to top-left of 200x200 square centered at centroid
-                            # Top-left corner is at (centroid_x - 100, centroid_y - 100)
-                            square_top_left_x = animal['x'] - square_width//2
-                            square_top_left_y = animal['y'] - square_height//2
-                            
-                            for bodypart_name, (rel_x, rel_y) in pose_relative.items():
-                                if rel_x is not None and rel_y is not None:
-                                    # The H5 coordinates are relative to centroid
-                                    abs_x = round(square_top_left_x  + rel_x, 2)
-                                    abs_y = round(square_top_left_y  + rel_y, 2)
-                                    pose_absolute_animal[bodypart_name] = [None if np.isnan(abs_x) else abs_x, None if np.isnan(abs_y) else abs_y]
-                                else:
-                                    pose_absolute_animal[bodypart_name] = [None, None]
-                            
-                            pose_absolute[str(animal['identity'])] = pose_absolute_animal
-                    except Exception as e:
-                        logger.error(f"Failed to load pose for identity {animal['identity']}: {e}")
-                        logger.error(traceback.print_exc())
+            poses = {
+                animal['identity']: read_pose(animal['identity'], frame_number, experiment, chunksize)
+                for animal in out
+                if animal['identity'] is not None and animal['identity'] in identities
+            }
+            pose_absolute = absolute_pose(out, poses, experiment)
         except Exception as e:
             logger.error(f"Error in pose processing: {e}")
 
-
-     
-    data = {
-        "tracking_data": out,
-        "number_of_animals": number_of_animals,
-        "pose": pose_absolute
-    }
-
-    response=jsonify(data)
+    with timed("json"):
+        response=jsonify(tracking_payload(out, pose_absolute))
     response.headers['Content-Type'] = 'application/json; charset=utf-8'
     return response
 
 
 @app.route('/api/prev_rejection/<int:frame_number>', methods=['GET'])
+@reads_experiment
 def get_prev_rejection(frame_number):
     if db_manager is None:
         return _experiment_required()
@@ -580,6 +1578,7 @@ def get_prev_rejection(frame_number):
 
 
 @app.route('/api/next_rejection/<int:frame_number>', methods=['GET'])
+@reads_experiment
 def get_next_rejection(frame_number):
     if db_manager is None:
         return _experiment_required()
@@ -587,6 +1586,7 @@ def get_next_rejection(frame_number):
 
 
 @app.route('/api/prev_error/<int:frame_number>', methods=['GET'])
+@reads_experiment
 def get_prev_error(frame_number):
     if db_manager is None:
         return _experiment_required()
@@ -594,6 +1594,7 @@ def get_prev_error(frame_number):
 
 
 @app.route('/api/next_error/<int:frame_number>', methods=['GET'])
+@reads_experiment
 def get_next_error(frame_number):
     if db_manager is None:
         return _experiment_required()
@@ -601,6 +1602,7 @@ def get_next_error(frame_number):
 
 
 @app.route('/api/prev_ok/<int:frame_number>', methods=['GET'])
+@reads_experiment
 def get_prev_ok(frame_number):
     if db_manager is None:
         return _experiment_required()
@@ -608,12 +1610,14 @@ def get_prev_ok(frame_number):
 
 
 @app.route('/api/next_ok/<int:frame_number>', methods=['GET'])
+@reads_experiment
 def get_next_ok(frame_number):
     if db_manager is None:
         return _experiment_required()
     return get_ok(frame_number, "next")
 
 @app.route('/api/prev_ai/<int:frame_number>', methods=['GET'])
+@reads_experiment
 def get_prev_ai(frame_number):
     if db_manager is None:
         return _experiment_required()
@@ -621,18 +1625,96 @@ def get_prev_ai(frame_number):
 
 
 @app.route('/api/next_ai/<int:frame_number>', methods=['GET'])
+@reads_experiment
 def get_next_ai(frame_number):
     if db_manager is None:
         return _experiment_required()
     return get_ai(frame_number, "next")
 
+def get_fragment(frame_number, direction, edge="first_frame", selection=("all", None)):
+    """
+    Nearest fragment boundary in direction, see fragments.FragmentIndex.next.
+    The fragment routes are not under reads_experiment, the first one builds the index without holding state_lock
+    """
+    index = _get_fragment_index()
+    if index is None:
+        return _experiment_required()
+    with timed("fragments"):
+        fragment = index.next(frame_number, direction, edge=edge, selection=selection)
+    if fragment is None:
+        return jsonify({"frame_number": None, "fragment": None})
+    return jsonify({"frame_number": fragment[edge], "fragment": fragment})
+
+
+def _short_fragments():
+    max_length = request.args.get("max_length", fragments.FRAGMENT_SHORT_LENGTH, type=int)
+    return ("short", max_length)
+
+
+@app.route('/api/prev_fragment_start/<int:frame_number>', methods=['GET'])
+def get_prev_fragment_start(frame_number):
+    return get_fragment(frame_number, "previous")
+
+
+@app.route('/api/next_fragment_start/<int:frame_number>', methods=['GET'])
+def get_next_fragment_start(frame_number):
+    return get_fragment(frame_number, "next")
+
+
+@app.route('/api/prev_fragment_end/<int:frame_number>', methods=['GET'])
+def get_prev_fragment_end(frame_number):
+    return get_fragment(frame_number, "previous", edge="last_frame")
+
+
+@app.route('/api/next_fragment_end/<int:frame_number>', methods=['GET'])
+def get_next_fragment_end(frame_number):
+    return get_fragment(frame_number, "next", edge="last_frame")
+
+
+@app.route('/api/prev_short_fragment/<int:frame_number>', methods=['GET'])
+def get_prev_short_fragment(frame_number):
+    """Start of the previous fragment with at most ?max_length= frames (FRAGMENT_SHORT_LENGTH)"""
+    return get_fragment(frame_number, "previous", selection=_short_fragments())
+
+
+@app.route('/api/next_short_fragment/<int:frame_number>', methods=['GET'])
+def get_next_short_fragment(frame_number):
+    """Start of the next fragment with at most ?max_length= frames (FRAGMENT_SHORT_LENGTH)"""
+    return get_fragment(frame_number, "next", selection=_short_fragments())
+
+
+@app.route('/api/prev_fragment_conflict/<int:frame_number>', methods=['GET'])
+def get_prev_fragment_conflict(frame_number):
+    """Start of the previous fragment assigned more than one identity"""
+    return get_fragment(frame_number, "previous", selection=("conflict", None))
+
+
+@app.route('/api/next_fragment_conflict/<int:frame_number>', methods=['GET'])
+def get_next_fragment_conflict(frame_number):
+    """Start of the next fragment assigned more than one identity"""
+    return get_fragment(frame_number, "next", selection=("conflict", None))
+
+
+@app.route('/api/fragments/<int:fragment>', methods=['GET'])
+def get_fragment_info(fragment):
+    """first and last frame, length and identities of a fragment"""
+    index = _get_fragment_index()
+    if index is None:
+        return _experiment_required()
+    row = index.find(fragment)
+    if row is None:
+        return jsonify({"error": f"Fragment {fragment} not found"}), 404
+    return jsonify(row)
+
+
 @app.route('/api/pe/flies', methods=['GET'])
+@reads_experiment
 def get_flies():
     if SELECTED_EXPERIMENT is None:
         return jsonify([])
     else:
         experiment=SELECTED_EXPERIMENT.replace("/", "_")
-        logger.warning(experiment)
+        logger.debug(experiment)
         identities=get_identities(experiment)
         flies = [
             f"{experiment}__{str(identity).zfill(2)}"
@@ -642,6 +1724,66 @@ def get_flies():
 
 
 
+@app.route('/api/clips', methods=['POST'])
+@reads_experiment
+def post_clip():
+    """
+    Queue the rendering of an annotated clip of the loaded experiment
+    Body: {"start": <frame>, "end": <frame>, "pose": false, "fps": <framerate>}
+    """
+    if db_manager is None:
+        return _experiment_required()
+    data = request.get_json(silent=True) or {}
+    try:
+        start, end = int(data["start"]), int(data["end"])
+        fps = float(data.get("fps") or FRAMERATE)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "start and end (frame numbers) are required"}), 400
+    if end < start or end - start + 1 > clips.CLIP_MAX_FRAMES:
+        return jsonify({"error": f"A clip must have between 1 and {clips.CLIP_MAX_FRAMES} frames"}), 400
+
+    experiment = SELECTED_EXPERIMENT.replace("/", "_")
+    pose_files = {}
+    square = None
+    if data.get("pose", False):
+        for identity in get_identities(experiment):
+            _, path = pose_file_path(str(identity).zfill(2), experiment)
+            if os.path.exists(path):
+                pose_files[int(identity)] = path
+        square = (get_square_width(experiment), get_square_height(experiment))
+
+    job = clips.submit_clip(
+        SELECTED_EXPERIMENT, start, end, CHUNKSIZE,
+        dbfile=db_manager.dbfile, use_val=db_manager.use_val,
+        store_path=os.path.join(os.environ["FLYHOSTEL_VIDEOS"], SELECTED_EXPERIMENT, "metadata.yaml"),
+        number_of_animals=int(re.search(".*/(.*)X/.*", SELECTED_EXPERIMENT).group(1)),
+        fps=fps, pose_files=pose_files, square=square,
+    )
+    return jsonify(dict(job, url=f"/api/clips/{job['clip_id']}/video")), 202
+
+
+@app.route('/api/clips', methods=['GET'])
+def get_clips():
+    """Clips rendered or being rendered by this process"""
+    return jsonify(clips.list_clips())
+
+
+@app.route('/api/clips/<clip_id>', methods=['GET'])
+def get_clip(clip_id):
+    status = clips.clip_status(clip_id)
+    if status is None:
+        return jsonify({"error": f"Unknown clip {clip_id}"}), 404
+    return jsonify(status)
+
+
+@app.route('/api/clips/<clip_id>/video', methods=['GET'])
+def get_clip_video(clip_id):
+    path = clips.clip_path(clip_id)
+    if not re.fullmatch("[0-9a-f]+", clip_id) or not os.path.exists(path):
+        return jsonify({"error": f"Clip {clip_id} is not rendered", "status": clips.clip_status(clip_id)}), 404
+    return send_file(os.path.abspath(path), mimetype="video/mp4", conditional=True, max_age=24*3600)
+
+
 @app.route('/shutdown', methods=['POST'])
 def shutdown():
     shutdown_server()
@@ -700,7 +1842,13 @@ def get_first_non_zero_frame(sql_session: Session, frame_number: int, direction=
     return result.frame_number if result else None
 
 def get_ok(frame_number, direction):
-    frame_number= get_first_non_zero_frame(db.session, frame_number, direction)
+    sidecar = _sidecar()
+    if sidecar is not None:
+        with timed("sidecar"):
+            frame_number = sidecar.next_ok(frame_number, direction)
+        return jsonify({"frame_number": frame_number})
+    with timed("sql"):
+        frame_number= get_first_non_zero_frame(db.session, frame_number, direction)
     logger.debug("get_ok %s", frame_number)
     return jsonify({"frame_number": frame_number})
 
@@ -741,14 +1889,21 @@ def get_rejection(frame_number, direction):
 def get_error(frame_number, direction):
 
     global SELECTED_EXPERIMENT
+    sidecar = _sidecar()
+    if sidecar is not None:
+        with timed("sidecar"):
+            frame_number = sidecar.next_error(frame_number, direction)
+        return jsonify({"frame_number": frame_number})
     tables = db_manager.tables
 
     if direction=="next":
         query=tables["IDENTITY"].query.filter(tables["IDENTITY"].frame_number>frame_number, tables["IDENTITY"].identity==0)
-        hit=query.first()
+        with timed("sql"):
+            hit=query.first()
     elif direction=="previous":
         query=tables["IDENTITY"].query.filter(tables["IDENTITY"].frame_number<frame_number, tables["IDENTITY"].identity==0)
-        hit=query.order_by(-tables["IDENTITY"].id).first()
+        with timed("sql"):
+            hit=query.order_by(-tables["IDENTITY"].id).first()
     else:
         raise Exception(f"direction must be either next or previous. direction={direction}")
 
@@ -762,14 +1917,21 @@ def get_error(frame_number, direction):
 
 def get_ai(frame_number, direction):
     global SELECTED_EXPERIMENT
+    sidecar = _sidecar()
+    if sidecar is not None:
+        with timed("sidecar"):
+            frame_number, ai = sidecar.next_ai(frame_number, direction)
+        return jsonify({"frame_number": frame_number, "ai": ai})
     tables = db_manager.tables
 
     if direction=="next":
         query=tables["AI"].query.filter(tables["AI"].frame_number>frame_number)
-        hit=query.order_by(tables["AI"].frame_number).first()
+        with timed("sql"):
+            hit=query.order_by(tables["AI"].frame_number).first()
     elif direction=="previous":
         query=tables["AI"].query.filter(tables["AI"].frame_number<frame_number)
-        hit=query.order_by(-tables["AI"].frame_number).first()
+        with timed("sql"):
+            hit=query.order_by(-tables["AI"].frame_number).first()
     else:
         raise Exception(f"direction must be either next or previous. direction={direction}")
 
@@ -788,10 +1950,45 @@ def get_parser():
     ap=argparse.ArgumentParser()
     ap.add_argument("--port", default=5000, type=int)
     ap.add_argument("--host",default="0.0.0.0")
+    ap.add_argument(
+        "--workers", default=None, type=int,
+        help="Serve with this many worker processes (gunicorn) instead of the development server"
+    )
+    ap.add_argument("--threads", default=None, type=int, help="Threads per worker with --workers")
+    ap.add_argument(
+        "--asgi", action="store_true",
+        help="Serve the ASGI front end (see asgi.py) with uvicorn instead of the development server"
+    )
     return ap
 
 if __name__ == "__main__":
 
     ap=get_parser()
     args=ap.parse_args()
-    app.run(port=args.port, host=args.host, debug=True)  # or set debug=False for production
\ No newline at end of file
+    if args.asgi:
+        from idtrackerai_validator_server import asgi
+        warm_up()
+        asgi.run(asgi.ValidatorASGI(sys.modules[__name__]), args.host, args.port)
+    elif args.workers is None:
+        # with the reloader, the server runs in a child process (WERKZEUG_RUN_MAIN is set there)
+        if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+            warm_up()
+        app.run(port=args.port, host=args.host, debug=True)  # or set debug=False for production
+    else:
+        from idtrackerai_validator_server import production
+        if args.workers > 1:
+            use_shared_frame_cache()
+        selection_file = os.path.join(FRAME_CACHE_DIR, f"idtrackerai_validator_selection_{args.port}.json")
+        if os.path.exists(selection_file):
+            os.remove(selection_file)
+        # the master neither loads the experiment nor imports the heavy modules, the workers do
+        if PRELOAD_EXPERIMENT is not None:
+            _selection_file = selection_file
+            _publish_selection(PRELOAD_EXPERIMENT, uuid.uuid4().hex)
+            _selection_file = None
+
+        production.run(
+            app, args.host, args.port, workers=args.workers,
+            threads=args.threads or production.VALIDATOR_THREADS,
+            post_fork=lambda: init_worker(selection_file),
+        )
@@ -0,0 +1,214 @@
+"""
+ASGI front end of the validator (python app.py --asgi)
+
+Most of the time of a request is spent waiting on blocking I/O (SQLite, pose H5 files,
+feathers, mp4 decoding). Here that work runs in a thread pool while the event loop
+keeps accepting requests:
+
+* /api/tracking/<frame_number> is served natively: the tracking query and the pose
+  reads of every fly are dispatched to the pool at once and awaited together.
+* Every other route (frames, navigation, PE) runs the Flask view in the pool.
+  Streaming responses are pulled from the pool one chunk at a time, so a slow or
+  idle client holds no thread while it is not being sent data.
+
+uvicorn is an optional dependency: pip install .[asgi]
+"""
+import io
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from idtrackerai_validator_server import metrics
+
+logger=logging.getLogger(__name__)
+
+ASGI_THREADS=int(os.environ.get("ASGI_THREADS", 32))
+
+_TRACKING_RE=re.compile(r"/api/tracking/(\d+)")
+
+
+def _wsgi_environ(scope, body):
+    """WSGI environ of an ASGI http scope (PEP 3333)"""
+    server=scope.get("server") or ("localhost", 80)
+    client=scope.get("client") or ("", 0)
+    environ={
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("ascii"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name=name.decode("latin1").upper().replace("-", "_")
+        value=value.decode("latin1")
+        if name=="CONTENT_TYPE" or name=="CONTENT_LENGTH":
+            key=name
+        else:
+            key=f"HTTP_{name}"
+        environ[key]=f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class ValidatorASGI:
+    """
+    ASGI application wrapping the validator module (the module of the Flask app, so
+    the live experiment state is read from it on every request)
+    """
+
+    def __init__(self, validator, threads=ASGI_THREADS):
+        self.validator=validator
+        self.executor=ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi")
+        # the reads of a request holding state_lock run here, never in self.executor: its
+        # threads can all be waiting for state_lock behind a load, which waits for that request
+        self.locked_executor=ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi-locked")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"]=="lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"]!="http":
+            return
+
+        match=_TRACKING_RE.fullmatch(scope["path"])
+        if match and scope["method"]=="GET":
+            await self.tracking(int(match.group(1)), scope, send)
+        else:
+            await self.wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message=await receive()
+            if message["type"]=="lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"]=="lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                self.locked_executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def run(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def run_locked(self, func, *args):
+        """Run func in the pool of the requests holding state_lock (it must not take state_lock)"""
+        return asyncio.get_running_loop().run_in_executor(self.locked_executor, func, *args)
+
+    def _in_app_context(self, func, *args):
+        with self.validator.app.app_context():
+            return func(*args)
+
+    async def _send_json(self, send, data, status=200):
+        body=data if isinstance(data, bytes) else json.dumps(data).encode()
+        await send({
+            "type": "http.response.start", "status": status,
+            "headers": [
+                (b"content-type", b"application/json; charset=utf-8"),
+                (b"content-length", str(len(body)).encode()),
+                (b"access-control-allow-origin", b"*"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def tracking(self, frame_number, scope, send):
+        """Same response as app.get_tracking, with the pose of every fly read concurrently"""
+        v=self.validator
+        t0=time.perf_counter()
+        metrics.request_started()
+        try:
+            status=await self._tracking(v, frame_number, scope, send)
+        finally:
+            metrics.request_finished()
+        metrics.observe_request("/api/tracking/<int:frame_number>", "GET", status, time.perf_counter()-t0)
+
+    async def _tracking(self, v, frame_number, scope, send):
+        # like app.reads_experiment: the experiment cannot be swapped while we read it
+        await self.run(v.state_lock.acquire_read)
+        try:
+            if v.db_manager is None:
+                await self._send_json(send, {"error": "No experiment loaded. POST to /api/load first."}, 503)
+                return 503
+
+            query=parse_qs(scope["query_string"].decode())
+            include_pose=v.INCLUDE_POSE and query.get("pose", ["1"])[0]!="0"
+            experiment=v.SELECTED_EXPERIMENT.replace("/", "_")
+            identities=await self.run_locked(v.get_identities, experiment) if include_pose else []
+
+            results=await asyncio.gather(
+                self.run_locked(self._in_app_context, v.query_tracking, frame_number),
+                *[self.run_locked(v.read_pose, identity, frame_number, experiment, v.CHUNKSIZE)
+                  for identity in identities]
+            )
+            out, _=results[0]
+            pose_absolute={}
+            if include_pose:
+                try:
+                    pose_absolute=v.absolute_pose(out, dict(zip(identities, results[1:])), experiment)
+                except Exception as error:
+                    logger.error(f"Error in pose processing: {error}")
+            payload=v.tracking_payload(out, pose_absolute)
+        finally:
+            v.state_lock.release_read()
+        with metrics.timed("json"):
+            body=json.dumps(payload).encode()
+        await self._send_json(send, body)
+        return 200
+
+    async def wsgi(self, scope, receive, send):
+        """Run the Flask app in the pool, streaming its response chunk by chunk"""
+        body=b""
+        more=True
+        while more:
+            message=await receive()
+            body+=message.get("body", b"")
+            more=message.get("more_body", False)
+
+        environ=_wsgi_environ(scope, body)
+        started={}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"]=int(status.split(" ", 1)[0])
+            started["headers"]=[(k.lower().encode("latin1"), v.encode("latin1")) for k, v in headers]
+            return lambda data: None
+
+        iterable=await self.run(self.validator.app.wsgi_app, environ, start_response)
+        iterator=iter(iterable)
+        sentinel=object()
+        try:
+            chunk=await self.run(next, iterator, sentinel)
+            await send({
+                "type": "http.response.start",
+                "status": started["status"], "headers": started["headers"],
+            })
+            while chunk is not sentinel:
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                chunk=await self.run(next, iterator, sentinel)
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(iterable, "close"):
+                await self.run(iterable.close)
+
+
+def run(application, host, port):
+    try:
+        import uvicorn
+    except ImportError as error:
+        raise ImportError("ASGI mode needs uvicorn. Install it with pip install .[asgi]") from error
+    uvicorn.run(application, host=host, port=port, log_level="info")
@@ -8,16 +8,21 @@ import logging
 import sqlite3
 import math
 import re
+import contextlib
+import functools
 from pathlib import Path
 
 import webcolors
-import cv2
 import numpy as np
-import pandas as pd
-from imgstore.interface import VideoCapture
 
-from idtrackerai.utils.py_utils import get_spaced_colors_util
-from idtrackerai.animals_detection.segmentation import _process_frame
+from idtrackerai_validator_server.startup import lazy_import, lazy_callable
+
+# imported on first use, see startup.py
+cv2=lazy_import("cv2")
+pd=lazy_import("pandas")
+VideoCapture=lazy_callable("imgstore.interface", "VideoCapture")
+get_spaced_colors_util=lazy_callable("idtrackerai.utils.py_utils", "get_spaced_colors_util")
+_process_frame=lazy_callable("idtrackerai.animals_detection.segmentation", "_process_frame")
 
 logger=logging.getLogger(__name__)
 
@@ -25,6 +30,8 @@ RED=webcolors.name_to_rgb("red")[::-1]
 GREEN=webcolors.name_to_rgb("green")[::-1]
 BLACK=webcolors.name_to_rgb("black")[::-1]
 DEFAULT_REFERENCE_HOUR=13
+# bodyparts joined in the pose skeleton, indices of the pose H5 files (see app.BODYPART_NAMES)
+POSE_SKELETON=((9, 0), (9, 1), (1, 2), (1, 3), (1, 4), (1, 5), (1, 6), (1, 7), (1, 8), (1, 10), (1, 11))
 
 
 def process_config(config):
@@ -48,6 +55,13 @@ def process_config(config):
     return user_defined_parameters
 
 
+def roi_mask(shape, rois):
+    """uint8 mask of the frame, 255 inside the first ROI of the idtrackerai config"""
+    mask = np.zeros(shape, np.uint8)
+    roi_contour = np.array(eval(rois[0][0])).reshape((-1, 1, 2))
+    return cv2.drawContours(mask, [roi_contour], -1, 255, -1)
+
+
 def process_frame(frame, config):
     """
     Generate the contours that idtrackerai would obtain using the passed config
@@ -62,11 +76,8 @@ def process_frame(frame, config):
     """
     config=process_config(config)
 
-    roi_mask = np.zeros_like(frame)
-    roi_contour = np.array(eval(config["rois"][0][0])).reshape((-1, 1, 2))
-    roi_mask = cv2.drawContours(roi_mask, [roi_contour], -1, 255, -1)
-    config["mask"]=roi_mask
-    # cv2.imwrite("mask.png", roi_mask)
+    config["mask"]=roi_mask(frame.shape, config["rois"])
+    # cv2.imwrite("mask.png", config["mask"])
     config["resolution_reduction"]=1.0
 
     (
@@ -90,13 +101,33 @@ def process_frame(frame, config):
 
 
 
+@functools.lru_cache(maxsize=64)
+def spaced_colors(number_of_animals):
+    """
+    Color of every identity, as an array of BGR tuples indexed by identity
+    (row 0, identity 0 and unknown identities, is black)
+    """
+    colors=get_spaced_colors_util(number_of_animals, black=False)
+    palette=np.zeros((number_of_animals+1, 3), dtype=np.int64)
+    palette[1:]=np.array([tuple(color)[:3] for color in colors])
+    palette.flags.writeable=False
+    return palette
+
+
+@functools.lru_cache(maxsize=4096)
+def text_size(text, fontScale=1, thickness=2, fontFace=None):
+    """cv2.getTextSize, which only depends on the text and the font"""
+    fontFace=cv2.FONT_HERSHEY_SIMPLEX if fontFace is None else fontFace
+    return cv2.getTextSize(text, fontFace, fontScale, thickness)[0]
+
+
 def annotate_text(frame, color, text, org, fontScale=1):
 
     fontScale = 1
     thickness = 2
     fontFace = cv2.FONT_HERSHEY_SIMPLEX
 
-    textSize = cv2.getTextSize(text, fontFace, fontScale, thickness)[0]
+    textSize = text_size(text, fontScale, thickness, fontFace)
 
     # Calculate the box in which the text will be placed (x, y, w, h)
     text_box = (org[0], org[1] - textSize[1], textSize[0], textSize[1])
@@ -156,30 +187,65 @@ def draw_frame(frame, tracking_data, number_of_animals, blobs=None, field="ident
         tracking_data (pd.DataFrame): Contains
             x, y, fragment, and whatever field is set to
     """
-    colors=get_spaced_colors_util(number_of_animals, black=False)
+    identities=tracking_data[field].to_numpy().astype(np.int64)
+    fragments=pd.to_numeric(tracking_data["fragment"], errors="coerce").to_numpy()
+    return draw_labels(
+        frame, tracking_data["x"].to_numpy(), tracking_data["y"].to_numpy(),
+        identity_labels(identities, fragments), identity_colors(identities, number_of_animals)
+    )
 
-    for i, row in tracking_data.iterrows():
-        org=(int(row["x"]), int(row["y"]))
-        identity=int(row[field])
-        try:
-            fragment=int(row["fragment"])
-        except ValueError:
-            fragment="NaN"
-
-        if identity<=0:
-            color=(0, 0, 0)
-        else:
-            color=colors[identity-1]
-    
+
+def _fragment_label(fragment):
+    try:
+        return str(int(float(fragment)))
+    except (TypeError, ValueError):
+        return "NaN"
+
+
+def identity_labels(identities, fragments):
+    """'<identity> (<fragment>)' of every animal, as draw_frame writes them"""
+    return [
+        f"{identity} ({_fragment_label(fragment)})"
+        for identity, fragment in zip(np.asarray(identities).tolist(), np.asarray(fragments).tolist())
+    ]
+
+
+def identity_colors(identities, number_of_animals):
+    """BGR color of every identity (black for identities <= 0 or above number_of_animals)"""
+    identities=np.asarray(identities, dtype=np.int64)
+    identities=np.where((identities > 0) & (identities <= number_of_animals), identities, 0)
+    return spaced_colors(number_of_animals)[identities]
+
+
+def draw_labels(frame, x, y, labels, colors, fontScale=1, thickness=2):
+    """Write labels[i] at (x[i], y[i]) in colors[i]"""
+    for org_x, org_y, label, color in zip(
+        np.asarray(x).astype(np.int64).tolist(), np.asarray(y).astype(np.int64).tolist(),
+        labels, np.asarray(colors).tolist()
+    ):
         frame=cv2.putText(
-            frame, text=f"{identity} ({fragment})",
-            org=org,
+            frame, text=label, org=(org_x, org_y),
             fontFace=cv2.FONT_HERSHEY_SIMPLEX,
-            thickness=2,
-            color=color,
-            fontScale=1,
+            thickness=thickness, color=tuple(color), fontScale=fontScale,
         )
-    
+    return frame
+
+
+def draw_pose(frame, points, color, edges=()):
+    """
+    Draw the keypoints of one animal and the lines of edges between them
+
+    Arguments:
+        points (np.ndarray): (bodyparts, 2) absolute coordinates, NaN if missing
+        edges (list): pairs of rows of points to join
+    """
+    color=tuple(np.asarray(color).tolist())
+    missing=np.isnan(points).any(axis=1)
+    for a, b in edges:
+        if not (missing[a] or missing[b]):
+            cv2.line(frame, tuple(points[a].astype(int).tolist()), tuple(points[b].astype(int).tolist()), color, 1)
+    for point in points[~missing].astype(int).tolist():
+        cv2.circle(frame, tuple(point), 2, color, -1)
     return frame
 
 
@@ -247,7 +313,24 @@ def load_flyhostel_metadata(basedir_suffix, db_manager):
 
     return metadata
 
-def load_experiment(basedir_suffix, chunk, db_manager):
+@contextlib.contextmanager
+def _no_phase(name):
+    yield
+
+
+def load_experiment(basedir_suffix, chunk, db_manager, phase=None):
+    """
+    Open the video store and read the metadata of an experiment
+
+    Arguments:
+
+        basedir_suffix (str): FlyHostelN/NX/YYYY-MM-DD_HH-MM-SS
+        chunk (int): chunk the VideoCapture starts on
+        db_manager (DatabaseManager): manager bound to the experiment's .db
+        phase (callable): optional, called with the name of every loading step.
+            It must return a context manager wrapping that step (used to report progress)
+    """
+    phase=phase or _no_phase
 
     basedir = os.path.join(os.environ["FLYHOSTEL_VIDEOS"], basedir_suffix)
     if not os.path.exists(basedir):
@@ -255,12 +338,14 @@ def load_experiment(basedir_suffix, chunk, db_manager):
         return {"message": f"{basedir} does not exist"}, None, None, None
 
     # load idtrackerai_config
-    idtrackerai_config=load_idtrackerai_config(basedir)
+    with phase("idtrackerai_config"):
+        idtrackerai_config=load_idtrackerai_config(basedir)
 
     # load videocapture object
     store_path = os.path.join(basedir, "metadata.yaml")
     logger.debug("Initializing %s - chunk %s", store_path, chunk)
-    cap = VideoCapture(store_path, chunk)  # Replace with your video file
+    with phase("video_capture"):
+        cap = VideoCapture(store_path, chunk)  # Replace with your video file
 
     if cap is None:
         logger.error(f"Could not load VideoCapture {store_path}")
@@ -268,10 +353,12 @@ def load_experiment(basedir_suffix, chunk, db_manager):
     else:
         try:
 
-            metadata=load_flyhostel_metadata(basedir_suffix, db_manager)
+            with phase("metadata"):
+                metadata=load_flyhostel_metadata(basedir_suffix, db_manager)
             chunksize=metadata[1]
             frame_number = chunksize * chunk
-            frame, (frame_number, frame_timestamp) = cap.get_image(frame_number)
+            with phase("probe_frame"):
+                frame, (frame_number, frame_timestamp) = cap.get_image(frame_number)
         except Exception as error:
             logger.error(error)
             logger.error("Cannot load %s", basedir_suffix)
@@ -0,0 +1,322 @@
+"""
+Persisted catalog of the experiments available under $FLYHOSTEL_VIDEOS
+
+The catalog is a small sqlite file (by default $FLYHOSTEL_VIDEOS/validator_catalog.db)
+with one row per experiment. It is refreshed incrementally: the mtime of every
+directory of the FlyHostelN/NX/FOLDER tree is remembered, so unchanged directories
+are not listed again, and an experiment is only inspected again when its folder
+or its .db changed. Listing is then a single indexed query.
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import logging
+import datetime
+from threading import Lock, Thread
+
+logger=logging.getLogger(__name__)
+
+CATALOG_DB=os.environ.get("CATALOG_DB", None)
+# a /api/list older than this (seconds) triggers a background refresh
+CATALOG_MAX_AGE=float(os.environ.get("CATALOG_MAX_AGE", 300))
+
+# rows written by an older version are inspected again
+CATALOG_VERSION=2
+
+GROUPSIZE_RE=re.compile(r"(\d+)X")
+DB_RE=re.compile(r"FlyHostel.*\.db")
+
+_refresh_lock=Lock()
+_last_refresh=None
+
+
+def get_catalog_file(root=None):
+    if CATALOG_DB is not None:
+        return CATALOG_DB
+    return os.path.join(root or os.environ["FLYHOSTEL_VIDEOS"], "validator_catalog.db")
+
+
+def _connect(catalog_file):
+    conn=sqlite3.connect(catalog_file, timeout=30)
+    conn.row_factory=sqlite3.Row
+    # keep the default rollback journal: WAL is not safe on network file systems
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS experiments (
+            experiment        TEXT    PRIMARY KEY,
+            folder            TEXT    NOT NULL,
+            dbfile            TEXT    NOT NULL,
+            size              INTEGER,
+            db_mtime          REAL,
+            folder_mtime      REAL,
+            number_of_animals INTEGER,
+            chunk_count       INTEGER,
+            validated         INTEGER,
+            pose              INTEGER,
+            updated_at        TEXT
+        )""")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS directories (
+            path     TEXT PRIMARY KEY,
+            mtime    REAL NOT NULL,
+            children TEXT NOT NULL
+        )""")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_state (
+            field TEXT PRIMARY KEY,
+            value TEXT
+        )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS experiments_animals ON experiments (number_of_animals)")
+    conn.execute("CREATE INDEX IF NOT EXISTS experiments_folder ON experiments (folder)")
+    return conn
+
+
+def _get_state(conn, field):
+    row=conn.execute("SELECT value FROM catalog_state WHERE field=?", (field,)).fetchone()
+    return None if row is None else row["value"]
+
+
+def _set_state(conn, field, value):
+    conn.execute("INSERT OR REPLACE INTO catalog_state (field, value) VALUES (?,?)", (field, str(value)))
+
+
+def _subdirectories(conn, path, seen_dirs):
+    """
+    Names of the subdirectories of path, listed again only if its mtime changed
+    """
+    mtime=os.stat(path).st_mtime
+    seen_dirs.add(path)
+    row=conn.execute("SELECT mtime, children FROM directories WHERE path=?", (path,)).fetchone()
+    if row is not None and row["mtime"]==mtime:
+        return json.loads(row["children"])
+
+    with os.scandir(path) as it:
+        children=sorted(entry.name for entry in it if entry.is_dir(follow_symlinks=True))
+    conn.execute(
+        "INSERT OR REPLACE INTO directories (path, mtime, children) VALUES (?,?,?)",
+        (path, mtime, json.dumps(children))
+    )
+    return children
+
+
+def _is_validated(dbfile):
+    """True if the tracking database has _VAL tables (written by the human validation)"""
+    try:
+        with sqlite3.connect(f"file:{dbfile}?mode=ro", uri=True, timeout=5) as conn:
+            hit=conn.execute(
+                r"SELECT 1 FROM sqlite_master WHERE type='table' AND name LIKE '%\_VAL' ESCAPE '\' LIMIT 1"
+            ).fetchone()
+    except sqlite3.Error as error:
+        logger.warning("Cannot inspect %s: %s", dbfile, error)
+        return None
+    return hit is not None
+
+
+def _inspect_folder(folder, groupsize):
+    """
+    Catalog rows of the experiments saved in folder, one per FlyHostel .db (like index.txt)
+    """
+    dbfiles=[]
+    chunk_count=0
+    pose=False
+    with os.scandir(folder) as it:
+        for entry in it:
+            if entry.name.endswith(".mp4"):
+                chunk_count+=1
+            elif entry.name=="motionmapper" and entry.is_dir():
+                pose=True
+            elif entry.name!="index.db" and DB_RE.fullmatch(entry.name):
+                dbfiles.append(entry.path)
+
+    folder_mtime=os.stat(folder).st_mtime
+    match=GROUPSIZE_RE.fullmatch(groupsize)
+    rows=[]
+    for dbfile in sorted(dbfiles):
+        stat=os.stat(dbfile)
+        validated=_is_validated(dbfile)
+        rows.append({
+            "experiment": os.path.basename(dbfile).replace(".db", ""),
+            "folder": folder,
+            "dbfile": dbfile,
+            "size": stat.st_size,
+            "db_mtime": stat.st_mtime,
+            "folder_mtime": folder_mtime,
+            "number_of_animals": int(match.group(1)) if match else None,
+            "chunk_count": chunk_count,
+            "validated": None if validated is None else int(validated),
+            "pose": int(pose),
+            "updated_at": datetime.datetime.now().isoformat(),
+        })
+    return rows
+
+
+def _is_fresh(rows, folder):
+    """True if neither the experiment folder nor its .db files changed since rows were written"""
+    try:
+        if os.stat(folder).st_mtime!=rows[0]["folder_mtime"]:
+            return False
+        for row in rows:
+            stat=os.stat(row["dbfile"])
+            if stat.st_size!=row["size"] or stat.st_mtime!=row["db_mtime"]:
+                return False
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def refresh_catalog(root=None):
+    """
+    Bring the catalog up to date with $FLYHOSTEL_VIDEOS/FlyHostelN/NX/FOLDER
+
+    Returns:
+        stats (dict): number of experiments in the catalog, and how many were
+        inspected (new or changed) and removed in this refresh
+    """
+    global _last_refresh
+    root=root or os.environ["FLYHOSTEL_VIDEOS"]
+    t0=time.perf_counter()
+
+    conn=_connect(get_catalog_file(root))
+    try:
+        known={}
+        if _get_state(conn, "version")==str(CATALOG_VERSION):
+            for row in conn.execute("SELECT * FROM experiments"):
+                known.setdefault(row["folder"], []).append(row)
+        seen_dirs=set()
+        seen_folders=set()
+        inspected=0
+
+        with conn:
+            for flyhostel in _subdirectories(conn, root, seen_dirs):
+                if not flyhostel.startswith("FlyHostel"):
+                    continue
+                flyhostel_dir=os.path.join(root, flyhostel)
+                for groupsize in _subdirectories(conn, flyhostel_dir, seen_dirs):
+                    groupsize_dir=os.path.join(flyhostel_dir, groupsize)
+                    for name in _subdirectories(conn, groupsize_dir, seen_dirs):
+                        folder=os.path.join(groupsize_dir, name)
+                        seen_folders.add(folder)
+                        if folder in known and _is_fresh(known[folder], folder):
+                            continue
+
+                        inspected+=1
+                        try:
+                            rows=_inspect_folder(folder, groupsize)
+                        except OSError as error:
+                            logger.warning("Cannot inspect %s: %s", folder, error)
+                            continue
+                        conn.execute("DELETE FROM experiments WHERE folder=?", (folder,))
+                        for row in rows:
+                            conn.execute(
+                                f"INSERT OR REPLACE INTO experiments ({','.join(row)}) "
+                                f"VALUES ({','.join('?'*len(row))})",
+                                tuple(row.values())
+                            )
+
+            # every folder of an older catalog version was inspected again
+            removed=[
+                row["folder"] for row in conn.execute("SELECT DISTINCT folder FROM experiments")
+                if row["folder"] not in seen_folders
+            ]
+            conn.executemany("DELETE FROM experiments WHERE folder=?", [(f,) for f in removed])
+            stale_dirs=[
+                row["path"] for row in conn.execute("SELECT path FROM directories")
+                if row["path"] not in seen_dirs
+            ]
+            conn.executemany("DELETE FROM directories WHERE path=?", [(p,) for p in stale_dirs])
+            # committed with the scan: until then list_catalog falls back to index.txt
+            _set_state(conn, "version", CATALOG_VERSION)
+            _set_state(conn, "refreshed_at", datetime.datetime.now().isoformat())
+
+        total=conn.execute("SELECT COUNT(*) FROM experiments").fetchone()[0]
+    finally:
+        conn.close()
+
+    _last_refresh=time.time()
+    stats={
+        "experiments": total, "inspected": inspected, "removed": len(removed),
+        "duration": round(time.perf_counter()-t0, 3),
+    }
+    logger.info("Experiment catalog refreshed: %s", stats)
+    return stats
+
+
+def refresh_catalog_in_background(root=None):
+    """
+    Start a refresh in a daemon thread, unless one is already running
+
+    Returns:
+        started (bool)
+    """
+    if not _refresh_lock.acquire(blocking=False):
+        return False
+
+    def target():
+        try:
+            refresh_catalog(root)
+        except Exception as error:
+            logger.error("Error refreshing experiment catalog: %s", error)
+        finally:
+            _refresh_lock.release()
+
+    Thread(target=target, name="catalog-refresh", daemon=True).start()
+    return True
+
+
+def is_refreshing():
+    return _refresh_lock.locked()
+
+
+def list_catalog(root=None, search=None, number_of_animals=None, validated=None, pose=None, offset=0, limit=None):
+    """
+    Experiments in the catalog matching the filters, sorted by name
+
+    Raises FileNotFoundError until a first refresh of the catalog has completed
+
+    Returns:
+        out (dict): experiments (list of names, like backend.list_experiments),
+        items (catalog rows of the requested page) and total (matches before paging)
+    """
+    catalog_file=get_catalog_file(root)
+    if not os.path.exists(catalog_file):
+        raise FileNotFoundError(catalog_file)
+
+    if _last_refresh is None or time.time()-_last_refresh > CATALOG_MAX_AGE:
+        refresh_catalog_in_background(root)
+
+    where=[]
+    params=[]
+    if search:
+        where.append("experiment LIKE ?")
+        params.append(f"%{search}%")
+    if number_of_animals is not None:
+        where.append("number_of_animals=?")
+        params.append(int(number_of_animals))
+    if validated is not None:
+        where.append("validated=?")
+        params.append(int(validated))
+    if pose is not None:
+        where.append("pose=?")
+        params.append(int(pose))
+    where_sql=f"WHERE {' AND '.join(where)}" if where else ""
+
+    conn=_connect(catalog_file)
+    try:
+        if _get_state(conn, "refreshed_at") is None:
+            raise FileNotFoundError(f"{catalog_file} has not been built yet")
+        total=conn.execute(f"SELECT COUNT(*) FROM experiments {where_sql}", params).fetchone()[0]
+        rows=conn.execute(
+            f"SELECT * FROM experiments {where_sql} ORDER BY experiment LIMIT ? OFFSET ?",
+            params + [-1 if limit is None else int(limit), int(offset)]
+        ).fetchall()
+    finally:
+        conn.close()
+
+    items=[dict(row) for row in rows]
+    return {
+        "experiments": [item["experiment"] for item in items],
+        "items": items,
+        "total": total,
+        "refreshing": is_refreshing(),
+    }
@@ -0,0 +1,325 @@
+"""
+Annotated review clips
+
+POST /api/clips {"start": <frame>, "end": <frame>} renders the frames in between as an mp4
+with the identity and fragment of every animal, the QC banners of backend.annotate_frame and,
+with "pose": true, the pose skeleton. The range is split at chunk boundaries and the segments
+are rendered in a process pool (CLIP_WORKERS): every worker reads the overlays of its segment
+with a single range query and draws them from arrays, then the segments are joined
+(with ffmpeg if it is installed, by copying the frames otherwise).
+
+Clips are saved in CLIPS_DIR as <clip_id>.mp4. The id is derived from the experiment,
+the range and the options, so a clip that was already rendered is served right away
+and can be shared by its URL.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import sqlite3
+import logging
+import datetime
+import threading
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from idtrackerai_validator_server.backend import (
+    annotate_frame, draw_labels, draw_pose, identity_colors, identity_labels, POSE_SKELETON,
+)
+from idtrackerai_validator_server.startup import lazy_import, lazy_callable
+
+cv2=lazy_import("cv2")
+h5py=lazy_import("h5py")
+VideoCapture=lazy_callable("imgstore.interface", "VideoCapture")
+
+logger=logging.getLogger(__name__)
+
+CLIPS_DIR=os.environ.get("CLIPS_DIR", "clips")
+CLIP_WORKERS=int(os.environ.get("CLIP_WORKERS", min(4, os.cpu_count() or 1)))
+CLIP_MAX_FRAMES=int(os.environ.get("CLIP_MAX_FRAMES", 9000))
+MAX_CLIP_JOBS=50
+
+POSE_BODYPARTS=sorted({bodypart for edge in POSE_SKELETON for bodypart in edge})
+
+_jobs={}   # clip_id -> status dict
+_jobs_lock=threading.Lock()
+_pool=None
+_pool_lock=threading.Lock()
+
+
+def clip_id(experiment, start, end, options, db_mtime):
+    key=json.dumps([experiment, start, end, options, db_mtime], sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def clip_path(clip_id):
+    return os.path.join(CLIPS_DIR, f"{clip_id}.mp4")
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the server process is multi-threaded
+            _pool=ProcessPoolExecutor(max_workers=CLIP_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def load_overlays(dbfile, use_val, start, end):
+    """
+    Tracking of the frames between start and end (both included) as arrays sorted by frame_number
+
+    Returns:
+        overlays (dict): frame_number, x, y, identity, fragment (one entry per ROI),
+            ai (frames listed in AI)
+    """
+    with sqlite3.connect(f"file:{dbfile}?mode=ro", uri=True) as conn:
+        rows=conn.execute(f"""
+            SELECT r.frame_number, r.x, r.y, COALESCE(i.identity, 0), r.fragment
+            FROM ROI_0{use_val} r LEFT JOIN IDENTITY{use_val} i
+            ON i.frame_number = r.frame_number AND i.in_frame_index = r.in_frame_index
+            WHERE r.frame_number BETWEEN ? AND ?
+            ORDER BY r.frame_number, r.in_frame_index""", (start, end)).fetchall()
+        ai=[row[0] for row in conn.execute(
+            "SELECT frame_number FROM AI WHERE frame_number BETWEEN ? AND ?", (start, end))]
+
+    columns=list(zip(*rows)) or [(), (), (), (), ()]
+    fragment=np.array([np.nan if f is None or f=="" else float(f) for f in columns[4]])
+    return {
+        "frame_number": np.array(columns[0], dtype=np.int64),
+        "x": np.array(columns[1], dtype=np.int64),
+        "y": np.array(columns[2], dtype=np.int64),
+        "identity": np.array(columns[3], dtype=np.int64),
+        "fragment": fragment,
+        "ai": np.array(sorted(ai), dtype=np.int64),
+    }
+
+
+def load_pose(pose_files, start, end, chunksize):
+    """
+    Pose of every identity between start and end, relative to its square
+
+    Returns:
+        pose (dict): identity -> array (frames, len(POSE_BODYPARTS), 2), NaN where missing
+    """
+    pose={}
+    for identity, path in pose_files.items():
+        try:
+            with h5py.File(path, "r") as h5:
+                first_chunk=int(os.path.basename(h5["files"][0].decode()).split(".")[0])
+                offset=first_chunk*chunksize
+                tracks=h5["tracks"]
+                i0, i1=max(start-offset, 0), min(end-offset+1, tracks.shape[3])
+                values=np.full((end-start+1, len(POSE_BODYPARTS), 2), np.nan)
+                if i1 > i0:
+                    # (2, bodyparts, frames) -> (frames, bodyparts, 2)
+                    xy=tracks[0, :, :, i0:i1][:, POSE_BODYPARTS, :]
+                    values[i0+offset-start:i1+offset-start]=np.transpose(xy, (2, 1, 0))
+                pose[identity]=values
+        except Exception as error:
+            logger.warning("Cannot read the pose of %s from %s: %s", identity, path, error)
+    return pose
+
+
+def _draw_pose(frame, pose, square, identities, x, y, index, colors):
+    edges=[(POSE_BODYPARTS.index(a), POSE_BODYPARTS.index(b)) for a, b in POSE_SKELETON]
+    for identity, cx, cy, color in zip(identities.tolist(), x.tolist(), y.tolist(), colors.tolist()):
+        values=pose.get(identity)
+        if values is None:
+            continue
+        draw_pose(frame, values[index]+(cx-square[0]//2, cy-square[1]//2), color, edges)
+
+
+def render_segment(task):
+    """
+    Render the frames task["start"]-task["end"] (one chunk at most) to task["output"].
+    Runs in the worker processes
+
+    Returns:
+        frames (int): number of frames written
+    """
+    start, end=task["start"], task["end"]
+    overlays=load_overlays(task["dbfile"], task["use_val"], start, end)
+    pose=load_pose(task["pose_files"], start, end, task["chunksize"]) if task["pose_files"] else {}
+    number_of_animals=task["number_of_animals"]
+
+    frames=overlays["frame_number"]
+    bounds=np.searchsorted(frames, np.arange(start, end+2))
+    has_error=np.zeros(end-start+1, dtype=bool)
+    has_error[frames[overlays["identity"]==0]-start]=True
+    is_ai=np.zeros(end-start+1, dtype=bool)
+    is_ai[overlays["ai"]-start]=True
+    labels=identity_labels(overlays["identity"], overlays["fragment"])
+    colors=identity_colors(overlays["identity"], number_of_animals)
+
+    cap=VideoCapture(task["store_path"], start//task["chunksize"])
+    writer=None
+    written=0
+    try:
+        for index, frame_number in enumerate(range(start, end+1)):
+            image, _=cap.get_image(frame_number)
+            if image is None:
+                continue
+            if image.ndim==2:
+                image=cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+            if writer is None:
+                writer=cv2.VideoWriter(
+                    task["output"], cv2.VideoWriter_fourcc(*"mp4v"), task["fps"], (image.shape[1], image.shape[0])
+                )
+            i0, i1=bounds[index], bounds[index+1]
+            if pose:
+                _draw_pose(
+                    image, pose, task["square"], overlays["identity"][i0:i1],
+                    overlays["x"][i0:i1], overlays["y"][i0:i1], index, colors[i0:i1]
+                )
+            image=draw_labels(image, overlays["x"][i0:i1], overlays["y"][i0:i1], labels[i0:i1], colors[i0:i1])
+            image=annotate_frame(image, {
+                "yolov7_qc": not is_ai[index],
+                "inter_qc": not has_error[index],
+                "chunk": frame_number//task["chunksize"],
+                "frame_number": frame_number,
+            })
+            writer.write(image)
+            written+=1
+    finally:
+        if writer is not None:
+            writer.release()
+    return written
+
+
+def _join(segments, output, fps):
+    """Concatenate the mp4 segments into output"""
+    segments=[segment for segment in segments if os.path.exists(segment)]
+    ffmpeg=shutil.which("ffmpeg")
+    if ffmpeg is not None:
+        listing=f"{output}.txt"
+        with open(listing, "w") as filehandle:
+            filehandle.writelines(f"file '{os.path.abspath(segment)}'\n" for segment in segments)
+        try:
+            subprocess.run(
+                [ffmpeg, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", listing, "-c", "copy", output],
+                check=True
+            )
+            return
+        except subprocess.CalledProcessError as error:
+            logger.warning("ffmpeg could not join the segments of %s (%s), copying the frames", output, error)
+        finally:
+            os.remove(listing)
+
+    writer=None
+    try:
+        for segment in segments:
+            reader=cv2.VideoCapture(segment)
+            while True:
+                ret, image=reader.read()
+                if not ret:
+                    break
+                if writer is None:
+                    writer=cv2.VideoWriter(
+                        output, cv2.VideoWriter_fourcc(*"mp4v"), fps, (image.shape[1], image.shape[0])
+                    )
+                writer.write(image)
+            reader.release()
+    finally:
+        if writer is not None:
+            writer.release()
+
+
+def _run_clip(job, tasks):
+    t0=time.perf_counter()
+    output=clip_path(job["clip_id"])
+    workdir=f"{output}.parts-{os.getpid()}"
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        for i, task in enumerate(tasks):
+            task["output"]=os.path.join(workdir, f"{i:05d}.mp4")
+        futures=[_get_pool().submit(render_segment, task) for task in tasks]
+        for future in futures:
+            job["frames_done"]+=future.result()
+
+        tmp=f"{output}.tmp-{os.getpid()}.mp4"
+        if len(tasks)==1:
+            os.replace(tasks[0]["output"], tmp)
+        else:
+            job["status"]="joining"
+            _join([task["output"] for task in tasks], tmp, tasks[0]["fps"])
+        os.replace(tmp, output)
+        job["status"]="done"
+        logger.info("Rendered clip %s (%s frames) in %.1f s", output, job["frames_done"], time.perf_counter()-t0)
+    except Exception as error:
+        logger.error("Error rendering clip %s: %s", job["clip_id"], error)
+        job["status"]="failed"
+        job["error"]=str(error)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        job["duration"]=round(time.perf_counter()-t0, 4)
+
+
+def submit_clip(experiment, start, end, chunksize, **task):
+    """
+    Queue the rendering of the frames start-end of experiment, unless it was already rendered.
+    task holds the fields of render_segment shared by all the segments
+
+    Returns:
+        job (dict): status of the clip, see clip_status
+    """
+    options={k: task[k] for k in ("fps", "use_val")}
+    options["pose"]=bool(task.get("pose_files"))
+    cid=clip_id(experiment, start, end, options, os.path.getmtime(task["dbfile"]))
+
+    with _jobs_lock:
+        job=_jobs.get(cid)
+        if job is not None and job["status"]!="failed":
+            return job
+        job={
+            "clip_id": cid,
+            "experiment": experiment,
+            "start": start,
+            "end": end,
+            "pose": options["pose"],
+            "status": "done" if os.path.exists(clip_path(cid)) else "queued",
+            "frames": end-start+1,
+            "frames_done": 0,
+            "created_at": datetime.datetime.now().isoformat(),
+            "duration": None,
+            "error": None,
+        }
+        _jobs[cid]=job
+        finished=[k for k, v in _jobs.items() if v["status"] in ("done", "failed")]
+        for k in finished[:max(0, len(_jobs)-MAX_CLIP_JOBS)]:
+            del _jobs[k]
+    if job["status"]=="done":
+        job["frames_done"]=job["frames"]
+        return job
+
+    os.makedirs(CLIPS_DIR, exist_ok=True)
+    # one segment per chunk, so every worker opens a single chunk of the store
+    tasks=[]
+    segment_start=start
+    while segment_start <= end:
+        segment_end=min(end, (segment_start//chunksize+1)*chunksize-1)
+        tasks.append(dict(task, start=segment_start, end=segment_end, chunksize=chunksize))
+        segment_start=segment_end+1
+    job["status"]="rendering"
+    threading.Thread(target=_run_clip, args=(job, tasks), name=f"clip-{cid}", daemon=True).start()
+    return job
+
+
+def clip_status(cid):
+    """Status of a clip of this process, or of a clip another worker rendered to CLIPS_DIR"""
+    with _jobs_lock:
+        job=_jobs.get(cid)
+        if job is not None:
+            return dict(job)
+    if os.path.exists(clip_path(cid)):
+        return {"clip_id": cid, "status": "done"}
+    return None
+
+
+def list_clips():
+    with _jobs_lock:
+        return [dict(job) for job in _jobs.values()]
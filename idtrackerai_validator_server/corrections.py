@@ -0,0 +1,282 @@
+"""
+Identity corrections of the tracking database
+
+The validator can reassign the identity of an animal in a range of frames, or of a whole
+fragment, directly in IDENTITY (IDENTITY_VAL if the experiment is validated). Every
+correction is applied in a single transaction with bulk UPDATE ... WHERE frame_number BETWEEN
+statements, and journaled in the database itself so it can be undone:
+
+    CORRECTIONS       one row per correction (what, who, when, frames, rows, undone_at)
+    CORRECTIONS_ROWS  the IDENTITY rows it changed, with their identity and the
+                      modified field of their ROI_0 row before and after
+
+The modified field of the ROI_0 rows of a correction is set to its id.
+Corrections are undone in the reverse order they were made (a correction cannot be
+undone while a later correction of overlapping frames is still applied).
+Set VALIDATOR_READ_ONLY=1 to disable the corrections.
+"""
+import os
+import json
+import fcntl
+import sqlite3
+import logging
+import datetime
+import threading
+import contextlib
+
+logger=logging.getLogger(__name__)
+
+VALIDATOR_READ_ONLY=os.environ.get("VALIDATOR_READ_ONLY", "0").lower() in ("1", "true", "yes")
+
+_lock=threading.Lock()
+
+_JOURNAL="""
+    CREATE TABLE IF NOT EXISTS CORRECTIONS (
+        id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind        TEXT    NOT NULL,
+        params      TEXT    NOT NULL,
+        use_val     TEXT    NOT NULL,
+        first_frame INTEGER,
+        last_frame  INTEGER,
+        rows        INTEGER NOT NULL DEFAULT 0,
+        reviewer    TEXT,
+        created_at  TEXT    NOT NULL,
+        undone_at   TEXT
+    );
+    CREATE TABLE IF NOT EXISTS CORRECTIONS_ROWS (
+        correction   INTEGER NOT NULL,
+        row_id       INTEGER NOT NULL,
+        frame_number INTEGER NOT NULL,
+        in_frame_index INTEGER,
+        old_identity INTEGER,
+        new_identity INTEGER,
+        old_modified TEXT
+    );
+    CREATE INDEX IF NOT EXISTS CORRECTIONS_ROWS_correction ON CORRECTIONS_ROWS (correction);
+"""
+_COLUMNS=("id", "kind", "params", "use_val", "first_frame", "last_frame", "rows", "reviewer", "created_at", "undone_at")
+
+
+class CorrectionError(Exception):
+    """A correction that cannot be applied or undone (status is the HTTP status to answer with)"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status=status
+
+
+@contextlib.contextmanager
+def _transaction(dbfile):
+    """
+    Connection to dbfile inside an immediate transaction, so no other process writes in between.
+    Committed when the block ends, rolled back if it raises
+    """
+    if VALIDATOR_READ_ONLY:
+        raise CorrectionError("The server is read only (VALIDATOR_READ_ONLY)", 403)
+    conn=sqlite3.connect(dbfile, timeout=30, isolation_level=None)
+    conn.row_factory=sqlite3.Row
+    try:
+        conn.execute("PRAGMA busy_timeout=30000")
+        conn.executescript(_JOURNAL)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+@contextlib.contextmanager
+def write_lock(dbfile):
+    """
+    Serialise the corrections of dbfile across threads and processes, from before the
+    write until the caches derived from the .db (the sidecar) are updated
+    """
+    with _lock, open(f"{dbfile}.lock", "w") as filehandle:
+        fcntl.flock(filehandle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(filehandle, fcntl.LOCK_UN)
+
+
+def _now():
+    return datetime.datetime.utcnow().isoformat()
+
+
+def _fragment(value):
+    """fragment as stored in ROI_0 (text), from a number or a string"""
+    try:
+        return str(int(float(value)))
+    except (TypeError, ValueError):
+        raise CorrectionError(f"Invalid fragment {value!r}")
+
+
+def _record(conn, use_val, kind, params, reviewer, where, parameters, new_identity):
+    """
+    Journal and apply one correction
+
+    Arguments:
+        where (str): condition on the IDENTITY rows (alias i) to correct
+        parameters (tuple): parameters of where
+        new_identity (tuple): SQL expression of the new identity of a row (on i.identity) and its parameters
+    Returns:
+        correction (dict): the row of CORRECTIONS
+    """
+    identity_table=f"IDENTITY{use_val}"
+    roi_table=f"ROI_0{use_val}"
+    cursor=conn.execute(
+        "INSERT INTO CORRECTIONS (kind, params, use_val, reviewer, created_at) VALUES (?, ?, ?, ?, ?)",
+        (kind, json.dumps(params, sort_keys=True), use_val, reviewer, _now())
+    )
+    correction=cursor.lastrowid
+    expression, expression_parameters=new_identity
+
+    conn.execute(f"""
+        INSERT INTO CORRECTIONS_ROWS
+        (correction, row_id, frame_number, in_frame_index, old_identity, new_identity, old_modified)
+        SELECT ?, i.rowid, i.frame_number, i.in_frame_index, i.identity, {expression}, r.modified
+        FROM {identity_table} i LEFT JOIN {roi_table} r
+        ON r.frame_number = i.frame_number AND r.in_frame_index = i.in_frame_index
+        WHERE {where} AND i.identity IS NOT {expression}""",
+        (correction, *expression_parameters, *parameters, *expression_parameters)
+    )
+    rows, first_frame, last_frame=conn.execute(
+        "SELECT COUNT(*), MIN(frame_number), MAX(frame_number) FROM CORRECTIONS_ROWS WHERE correction = ?",
+        (correction, )
+    ).fetchone()
+    if rows:
+        conn.execute(f"""
+            UPDATE {identity_table} SET identity = j.new_identity
+            FROM CORRECTIONS_ROWS j
+            WHERE {identity_table}.frame_number BETWEEN ? AND ?
+            AND j.correction = ? AND j.row_id = {identity_table}.rowid""",
+            (first_frame, last_frame, correction)
+        )
+        conn.execute(f"""
+            UPDATE {roi_table} SET modified = ?
+            WHERE frame_number BETWEEN ? AND ?
+            AND (frame_number, in_frame_index) IN (
+                SELECT frame_number, in_frame_index FROM CORRECTIONS_ROWS WHERE correction = ?
+            )""",
+            (str(correction), first_frame, last_frame, correction)
+        )
+    conn.execute(
+        "UPDATE CORRECTIONS SET rows = ?, first_frame = ?, last_frame = ? WHERE id = ?",
+        (rows, first_frame, last_frame, correction)
+    )
+    return _get(conn, correction)
+
+
+def _get(conn, correction):
+    row=conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM CORRECTIONS WHERE id = ?", (correction, )).fetchone()
+    if row is None:
+        return None
+    out=dict(zip(_COLUMNS, row))
+    out["params"]=json.loads(out["params"])
+    return out
+
+
+def _identity_expression(identity, to, swap):
+    """New identity of the rows with identity (and to, if swap)"""
+    if swap:
+        return "CASE i.identity WHEN ? THEN ? WHEN ? THEN ? ELSE i.identity END", (identity, to, to, identity)
+    return "?", (to, )
+
+
+def reassign_range(dbfile, use_val, start, end, identity, to, swap=False, reviewer=None):
+    """
+    Give identity `to` to the animal with `identity` between start and end (both included).
+    With swap, the animal with `to` gets `identity` at the same time
+    """
+    if end < start:
+        raise CorrectionError(f"Empty range {start}-{end}")
+    if identity == to:
+        raise CorrectionError("identity and to are the same")
+    identities=(identity, to) if swap else (identity, )
+    params={"start": start, "end": end, "identity": identity, "to": to, "swap": swap}
+    with _transaction(dbfile) as conn:
+        return _record(
+            conn, use_val, "range", params, reviewer,
+            f"i.frame_number BETWEEN ? AND ? AND i.identity IN ({', '.join('?'*len(identities))})",
+            (start, end, *identities),
+            _identity_expression(identity, to, swap),
+        )
+
+
+def reassign_fragment(dbfile, use_val, fragment, to, start=None, end=None, reviewer=None):
+    """Give identity `to` to every row of fragment (between start and end, if given)"""
+    fragment=_fragment(fragment)
+    roi_table=f"ROI_0{use_val}"
+    with _transaction(dbfile) as conn:
+        first_frame, last_frame=conn.execute(
+            f"SELECT MIN(frame_number), MAX(frame_number) FROM {roi_table} WHERE fragment = ?", (fragment, )
+        ).fetchone()
+        if first_frame is None:
+            raise CorrectionError(f"Fragment {fragment} not found", 404)
+        if start is not None:
+            first_frame=max(first_frame, start)
+        if end is not None:
+            last_frame=min(last_frame, end)
+        params={"fragment": fragment, "to": to, "start": first_frame, "end": last_frame}
+        return _record(
+            conn, use_val, "fragment", params, reviewer,
+            f"""i.frame_number BETWEEN ? AND ? AND (i.frame_number, i.in_frame_index) IN (
+                SELECT frame_number, in_frame_index FROM {roi_table}
+                WHERE frame_number BETWEEN ? AND ? AND fragment = ?
+            )""",
+            (first_frame, last_frame, first_frame, last_frame, fragment),
+            _identity_expression(None, to, False),
+        )
+
+
+def undo(dbfile, correction):
+    """Restore the identities and modified fields a correction changed"""
+    with _transaction(dbfile) as conn:
+        applied=_get(conn, correction)
+        if applied is None:
+            raise CorrectionError(f"Unknown correction {correction}", 404)
+        if applied["undone_at"] is not None:
+            raise CorrectionError(f"Correction {correction} was already undone", 409)
+        later=conn.execute("""
+            SELECT MIN(id) FROM CORRECTIONS
+            WHERE id > ? AND undone_at IS NULL AND use_val = ? AND rows > 0
+            AND first_frame <= ? AND last_frame >= ?""",
+            (correction, applied["use_val"], applied["last_frame"], applied["first_frame"])
+        ).fetchone()[0]
+        if later is not None:
+            raise CorrectionError(f"Undo correction {later} first, it changed the same frames", 409)
+
+        identity_table=f"IDENTITY{applied['use_val']}"
+        roi_table=f"ROI_0{applied['use_val']}"
+        if applied["rows"]:
+            conn.execute(f"""
+                UPDATE {identity_table} SET identity = j.old_identity
+                FROM CORRECTIONS_ROWS j
+                WHERE {identity_table}.frame_number BETWEEN ? AND ?
+                AND j.correction = ? AND j.row_id = {identity_table}.rowid""",
+                (applied["first_frame"], applied["last_frame"], correction)
+            )
+            conn.execute(f"""
+                UPDATE {roi_table} SET modified = j.old_modified
+                FROM CORRECTIONS_ROWS j
+                WHERE {roi_table}.frame_number BETWEEN ? AND ?
+                AND j.correction = ? AND j.frame_number = {roi_table}.frame_number
+                AND j.in_frame_index = {roi_table}.in_frame_index""",
+                (applied["first_frame"], applied["last_frame"], correction)
+            )
+        conn.execute("UPDATE CORRECTIONS SET undone_at = ? WHERE id = ?", (_now(), correction))
+        return _get(conn, correction)
+
+
+def list_corrections(dbfile, limit=100):
+    """Latest corrections of dbfile, newest first"""
+    with sqlite3.connect(f"file:{dbfile}?mode=ro", uri=True) as conn:
+        present=conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='CORRECTIONS'").fetchone()
+        if present is None:
+            return []
+        ids=[row[0] for row in conn.execute("SELECT id FROM CORRECTIONS ORDER BY id DESC LIMIT ?", (limit, ))]
+        return [_get(conn, correction) for correction in ids]
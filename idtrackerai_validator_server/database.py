@@ -1,10 +1,10 @@
 import logging
 import numpy as np
-from flyhostel.data.human_validation.utils import check_if_validated
-from flyhostel.utils import (
-    get_identities
-)
 from idtrackerai_validator_server.constants import INCLUDE_POSE, POSE_NAME
+from idtrackerai_validator_server.startup import lazy_callable
+
+check_if_validated=lazy_callable("flyhostel.data.human_validation.utils", "check_if_validated")
+get_identities=lazy_callable("flyhostel.utils", "get_identities")
 logger = logging.getLogger(__name__)
 
 
@@ -35,11 +35,13 @@ def pose_arr_to_dict(ds):
 
 
 class DatabaseManager:
-    def __init__(self, app, db, experiment, with_fragments=True, use_val=None):
+    def __init__(self, app, db, experiment, with_fragments=True, use_val=None, dbfile=None):
         self.app = app
         self.db = db
         self.with_fragments = with_fragments
-        self.dbfile = app.config['SQLALCHEMY_DATABASE_URI'].replace("sqlite:///", "")
+        # dbfile lets a manager be built for an experiment that is not bound yet
+        # (background loads), otherwise the app's current database is used
+        self.dbfile = dbfile or app.config['SQLALCHEMY_DATABASE_URI'].replace("sqlite:///", "")
         print(f"Opening {self.dbfile}")
         if use_val is None:
             self.use_val = check_if_validated(self.dbfile)
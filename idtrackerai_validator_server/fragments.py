@@ -0,0 +1,275 @@
+"""
+Fragment index of an experiment for the fragment navigation routes
+
+For every fragment of ROI_0 the index keeps, as arrays,
+    fragment:   fragment number
+    first_frame, last_frame
+    length:     rows of the fragment (frames it was tracked in)
+    identities: distinct identities (0 included) its rows were assigned in IDENTITY
+    identity:   the largest of them (the identity of the fragment, when identities is 1)
+built with a single grouped query (or from the columnar sidecar, see sidecar.py).
+The next/previous fragment start or end, short fragment or fragment with conflicting
+identities is a binary search over the first or last frames of the fragments, sorted once.
+The index is cached per experiment until its .db changes; the corrections made through
+the server count again only the fragments of the frames they changed.
+"""
+import os
+import sqlite3
+import logging
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+logger=logging.getLogger(__name__)
+
+FRAGMENT_SHORT_LENGTH=int(os.environ.get("FRAGMENT_SHORT_LENGTH", 10))
+COLUMNS=("fragment", "first_frame", "last_frame", "length", "identities", "identity")
+_MAX_SELECTIONS=32
+
+_INDEXES={}    # experiment -> (key, FragmentIndex)
+_BUILDING={}   # experiment -> (key, Future of the FragmentIndex being built)
+_lock=threading.Lock()
+
+
+class FragmentIndex:
+    """Fragments of an experiment, see the module docstring"""
+
+    def __init__(self, columns):
+        order=np.argsort(columns["fragment"], kind="stable")
+        self.columns={name: np.asarray(columns[name], dtype=np.int64)[order] for name in COLUMNS}
+        self._selections={}   # (edge, selection) -> (sorted frames, rows)
+        self._selections_lock=threading.Lock()
+
+    def __len__(self):
+        return len(self.columns["fragment"])
+
+    def row(self, index):
+        return {name: int(self.columns[name][index]) for name in COLUMNS}
+
+    def find(self, fragment):
+        """Row of fragment, or None"""
+        index=np.searchsorted(self.columns["fragment"], fragment)
+        if index < len(self) and self.columns["fragment"][index]==fragment:
+            return self.row(index)
+        return None
+
+    def _selection(self, edge, selection):
+        """first_frame or last_frame (edge) of the fragments in selection, sorted, and their rows"""
+        key=(edge, selection)
+        with self._selections_lock:
+            hit=self._selections.get(key)
+        if hit is not None:
+            return hit
+        kind, value=selection
+        if kind=="all":
+            mask=np.ones(len(self), dtype=bool)
+        elif kind=="short":
+            mask=self.columns["length"] <= value
+        elif kind=="conflict":
+            mask=self.columns["identities"] > 1
+        else:
+            raise ValueError(f"Unknown selection {kind}")
+        rows=np.flatnonzero(mask)
+        frames=self.columns[edge][rows]
+        order=np.argsort(frames, kind="stable")
+        hit=(frames[order], rows[order])
+        with self._selections_lock:
+            if len(self._selections) >= _MAX_SELECTIONS:
+                self._selections.clear()
+            self._selections[key]=hit
+        return hit
+
+    def next(self, frame_number, direction, edge="first_frame", selection=("all", None)):
+        """
+        Fragment of selection whose edge is the nearest one after (direction="next")
+        or before (direction="previous") frame_number
+
+        Arguments:
+            edge (str): first_frame or last_frame
+            selection (tuple): ("all", None), ("short", max_length) or ("conflict", None)
+        Returns:
+            fragment (dict): row of the fragment, None if there is none
+        """
+        frames, rows=self._selection(edge, selection)
+        if direction=="next":
+            index=np.searchsorted(frames, frame_number, side="right")
+        elif direction=="previous":
+            index=np.searchsorted(frames, frame_number, side="left")-1
+        else:
+            raise Exception(f"direction must be either next or previous. direction={direction}")
+        if index < 0 or index >= len(frames):
+            return None
+        return self.row(rows[index])
+
+    def update(self, start, end, count):
+        """
+        Count again the fragments with frames between start and end
+
+        Arguments:
+            count (callable): (first_frame, last_frame) -> columns of the fragments in those frames
+        Returns:
+            index (FragmentIndex): a new index, this one is left as it is
+        """
+        affected=(self.columns["first_frame"] <= end) & (self.columns["last_frame"] >= start)
+        if not affected.any():
+            return self
+        # every affected fragment lies entirely between first_frame and last_frame
+        first_frame=min(start, int(self.columns["first_frame"][affected].min()))
+        last_frame=max(end, int(self.columns["last_frame"][affected].max()))
+        counted=count(first_frame, last_frame)
+        fragments=np.asarray(counted["fragment"], dtype=np.int64)
+        keep=np.isin(fragments, self.columns["fragment"][affected])
+
+        columns={name: self.columns[name][~affected] for name in COLUMNS}
+        for name in COLUMNS:
+            columns[name]=np.r_[columns[name], np.asarray(counted[name], dtype=np.int64)[keep]]
+        return FragmentIndex(columns)
+
+
+def _count_sql(dbfile, use_val, first_frame=None, last_frame=None):
+    between=""
+    parameters=()
+    if first_frame is not None:
+        between="AND r.frame_number BETWEEN ? AND ?"
+        parameters=(first_frame, last_frame)
+    with sqlite3.connect(f"file:{dbfile}?mode=ro", uri=True) as conn:
+        rows=conn.execute(f"""
+            SELECT CAST(r.fragment AS INTEGER), MIN(r.frame_number), MAX(r.frame_number), COUNT(*),
+            COUNT(DISTINCT i.identity), COALESCE(MAX(i.identity), 0)
+            FROM ROI_0{use_val} r LEFT JOIN IDENTITY{use_val} i
+            ON i.frame_number = r.frame_number AND i.in_frame_index = r.in_frame_index
+            WHERE r.fragment IS NOT NULL AND r.fragment != '' {between}
+            GROUP BY CAST(r.fragment AS INTEGER)""", parameters).fetchall()
+    values=list(zip(*rows)) or [()]*len(COLUMNS)
+    return {name: np.array(column, dtype=np.int64) for name, column in zip(COLUMNS, values)}
+
+
+def _fragment_numbers(values):
+    """fragment column (text) as int64, and the mask of the rows that have one"""
+    if values.dtype!=object:
+        return values.astype(np.int64), np.ones(len(values), dtype=bool)
+    valid=np.array([value is not None and value!="" for value in values], dtype=bool)
+    return values[valid].astype(float).astype(np.int64), valid
+
+
+def _count_sidecar(sidecar, first_frame=None, last_frame=None):
+    fragments, frames, identities=[], [], []
+    for chunk in sidecar.chunks("ROI_0"):
+        if first_frame is not None and not first_frame//sidecar.chunksize <= chunk <= last_frame//sidecar.chunksize:
+            continue
+        rois=sidecar.read_chunk("ROI_0", chunk)
+        identity_rows=sidecar.read_chunk("IDENTITY", chunk)
+        fragment, valid=_fragment_numbers(rois["fragment"])
+        frame_number=rois["frame_number"][valid].astype(np.int64)
+        in_frame_index=rois["in_frame_index"][valid].astype(np.int64)
+
+        # identity of every ROI: the IDENTITY row with the same frame_number and in_frame_index (-1 if none)
+        identity=np.full(len(fragment), -1, dtype=np.int64)
+        if identity_rows is not None and len(identity_rows["frame_number"]):
+            values=identity_rows["identity"]
+            known=np.array([value is not None for value in values], dtype=bool) if values.dtype==object else np.ones(len(values), dtype=bool)
+            keys=identity_rows["frame_number"][known].astype(np.int64)*65536+identity_rows["in_frame_index"][known].astype(np.int64)
+            order=np.argsort(keys, kind="stable")
+            keys=keys[order]
+            values=values[known].astype(np.int64)[order]
+            wanted=frame_number*65536+in_frame_index
+            position=np.minimum(np.searchsorted(keys, wanted), max(len(keys)-1, 0))
+            found=(len(keys) > 0) & (keys[position]==wanted)
+            identity[found]=values[position[found]]
+
+        if first_frame is not None:
+            inside=(frame_number >= first_frame) & (frame_number <= last_frame)
+            fragment, frame_number, identity=fragment[inside], frame_number[inside], identity[inside]
+        fragments.append(fragment)
+        frames.append(frame_number)
+        identities.append(identity)
+
+    if not fragments:
+        return {name: np.array([], dtype=np.int64) for name in COLUMNS}
+    fragment=np.concatenate(fragments)
+    frame_number=np.concatenate(frames)
+    identity=np.concatenate(identities)
+
+    numbers, inverse=np.unique(fragment, return_inverse=True)
+    first=np.full(len(numbers), np.iinfo(np.int64).max)
+    last=np.full(len(numbers), np.iinfo(np.int64).min)
+    np.minimum.at(first, inverse, frame_number)
+    np.maximum.at(last, inverse, frame_number)
+    # distinct identities per fragment (COUNT(DISTINCT) skips the ROIs without one)
+    pairs=np.unique(np.c_[inverse[identity >= 0], identity[identity >= 0]], axis=0)
+    distinct=np.bincount(pairs[:, 0], minlength=len(numbers)) if len(pairs) else np.zeros(len(numbers), dtype=np.int64)
+    largest=np.zeros(len(numbers), dtype=np.int64)
+    if len(pairs):
+        np.maximum.at(largest, pairs[:, 0], pairs[:, 1])
+    return {
+        "fragment": numbers,
+        "first_frame": first,
+        "last_frame": last,
+        "length": np.bincount(inverse, minlength=len(numbers)),
+        "identities": distinct,
+        "identity": largest,
+    }
+
+
+def count_fragments(dbfile, use_val, sidecar=None, first_frame=None, last_frame=None):
+    """
+    Columns of the fragment index (see the module docstring), counting only the rows
+    between first_frame and last_frame if given
+    """
+    if sidecar is not None:
+        return _count_sidecar(sidecar, first_frame, last_frame)
+    return _count_sql(dbfile, use_val, first_frame, last_frame)
+
+
+def build_fragment_index(dbfile, use_val, sidecar=None):
+    return FragmentIndex(count_fragments(dbfile, use_val, sidecar))
+
+
+def get_fragment_index(experiment, key, build, publish=None):
+    """
+    The cached fragment index of experiment, built again with build() when key changed.
+    The new index is only cached if publish() is True (the experiment is still the loaded one).
+    _lock is not held during the build, the requests for the same index wait for it
+    """
+    with _lock:
+        hit=_INDEXES.get(experiment)
+        if hit and hit[0]==key:
+            return hit[1]
+        # the key holds the signature of the .db, a dict
+        pending=_BUILDING.get(experiment)
+        building=pending is None or pending[0]!=key
+        if building:
+            pending=_BUILDING[experiment]=(key, Future())
+    if not building:
+        return pending[1].result()
+
+    logger.info("Building the fragment index of %s", experiment)
+    try:
+        index=build()
+    except BaseException as error:
+        with _lock:
+            if _BUILDING.get(experiment) is pending:
+                del _BUILDING[experiment]
+        pending[1].set_exception(error)
+        raise
+    with _lock:
+        if _BUILDING.get(experiment) is pending:
+            del _BUILDING[experiment]
+        if publish is None or publish():
+            _INDEXES[experiment]=(key, index)
+    pending[1].set_result(index)
+    return index
+
+
+def update_fragment_index(experiment, key, new_key, start, end, count):
+    """
+    Count again the fragments between start and end of the cached index of experiment,
+    if it is the one for key, and keep it for new_key (see FragmentIndex.update)
+    """
+    with _lock:
+        hit=_INDEXES.get(experiment)
+        if not hit or hit[0]!=key:
+            return False
+        _INDEXES[experiment]=(new_key, hit[1].update(start, end, count))
+        return True
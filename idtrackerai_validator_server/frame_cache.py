@@ -0,0 +1,194 @@
+"""
+Cache of encoded frames, shared by all the workers of the server
+
+Frames are kept JPEG-encoded (with the contours segmented from them). A server with
+one process keeps them in a LocalFrameCache in its own memory. With several workers
+(app.py --workers N, N > 1, or FRAME_CACHE_SHARED=1) they are kept in a file
+mapped in memory, by default under /dev/shm, so a frame decoded by one worker
+is served from memory by all the others. The file is split in FRAME_CACHE_SLOTS
+slots of FRAME_CACHE_SLOT_BYTES and every key maps to one slot (a newer entry
+evicts an older one). Decoded frames are not shared: they are ~50x bigger than
+the JPEG and are only needed to produce it.
+
+Every slot starts with a header: the digest of its key, a sequence number and the
+length of the value. Writers make the sequence number odd while they write and
+readers discard a value whose sequence number changed while they copied it,
+so readers never take a lock.
+"""
+import os
+import mmap
+import fcntl
+import struct
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger=logging.getLogger(__name__)
+
+FRAME_CACHE_SLOTS=int(os.environ.get("FRAME_CACHE_SLOTS", 512))
+FRAME_CACHE_SLOT_BYTES=int(os.environ.get("FRAME_CACHE_SLOT_BYTES", 512*1024))
+# use the cache in FRAME_CACHE_DIR even with a single process (see use_shared_frame_cache)
+FRAME_CACHE_SHARED=os.environ.get("FRAME_CACHE_SHARED", "0").lower() in ("1", "true", "yes")
+FRAME_CACHE_DIR=os.environ.get(
+    "FRAME_CACHE_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+)
+
+_HEADER=struct.Struct("<16sQQ")   # key digest, sequence number, value length
+_SEQ=struct.Struct("<Q")
+_SEQ_OFFSET=16
+
+
+def _digest(key):
+    return hashlib.blake2b(repr(key).encode(), digest_size=16).digest()
+
+
+class SharedFrameCache:
+    """
+    Fixed-size key -> bytes cache in a memory-mapped file, safe to use from
+    several threads and processes at once
+    """
+
+    def __init__(self, path, slots=FRAME_CACHE_SLOTS, slot_bytes=FRAME_CACHE_SLOT_BYTES):
+        self.path=path
+        self.slots=slots
+        self.slot_bytes=slot_bytes
+        self.hits=0
+        self.misses=0
+        size=slots*slot_bytes
+        self._fd=os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                # allocate the pages now: a sparse file on a full tmpfs raises SIGBUS when written through the map
+                os.posix_fallocate(self._fd, 0, size)
+            self._map=mmap.mmap(self._fd, size)
+        except OSError:
+            os.close(self._fd)
+            raise
+        # fcntl locks only exclude other processes
+        self._write_lock=threading.Lock()
+
+    def _offset(self, digest):
+        return int.from_bytes(digest[:8], "little") % self.slots * self.slot_bytes
+
+    def get(self, key):
+        """Value stored under key, or None"""
+        digest=_digest(key)
+        offset=self._offset(digest)
+        stored, seq, length=_HEADER.unpack_from(self._map, offset)
+        if seq & 1 or stored != digest or length > self.slot_bytes - _HEADER.size:
+            self.misses+=1
+            return None
+        start=offset+_HEADER.size
+        value=self._map[start:start+length]
+        if _SEQ.unpack_from(self._map, offset+_SEQ_OFFSET)[0] != seq:
+            # overwritten while we were reading it
+            self.misses+=1
+            return None
+        self.hits+=1
+        return value
+
+    def put(self, key, value):
+        """
+        Store value under key. Returns False (and stores nothing) if the value does
+        not fit in a slot or another worker is writing the same slot right now
+        """
+        if len(value) > self.slot_bytes - _HEADER.size:
+            return False
+        digest=_digest(key)
+        offset=self._offset(digest)
+        with self._write_lock:
+            try:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, self.slot_bytes, offset, os.SEEK_SET)
+            except OSError:
+                return False
+            try:
+                seq=_SEQ.unpack_from(self._map, offset+_SEQ_OFFSET)[0] | 1
+                _SEQ.pack_into(self._map, offset+_SEQ_OFFSET, seq)
+                start=offset+_HEADER.size
+                self._map[start:start+len(value)]=value
+                _HEADER.pack_into(self._map, offset, digest, seq, len(value))
+                # published only once the key, length and value are all in place
+                _SEQ.pack_into(self._map, offset+_SEQ_OFFSET, seq+1)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.slot_bytes, offset, os.SEEK_SET)
+        return True
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class LocalFrameCache:
+    """Key -> bytes cache of one process with the interface of SharedFrameCache, least recently used first out"""
+
+    def __init__(self, slots=FRAME_CACHE_SLOTS, slot_bytes=FRAME_CACHE_SLOT_BYTES):
+        self.slots=slots
+        self.slot_bytes=slot_bytes
+        self.hits=0
+        self.misses=0
+        self._values=OrderedDict()
+        self._lock=threading.Lock()
+
+    def get(self, key):
+        """Value stored under key, or None"""
+        with self._lock:
+            value=self._values.get(key)
+            if value is None:
+                self.misses+=1
+                return None
+            self._values.move_to_end(key)
+            self.hits+=1
+        return value
+
+    def put(self, key, value):
+        """Store value under key. Returns False (and stores nothing) if the value does not fit in a slot"""
+        if len(value) > self.slot_bytes - _HEADER.size:
+            return False
+        with self._lock:
+            self._values[key]=bytes(value)
+            self._values.move_to_end(key)
+            while len(self._values) > self.slots:
+                self._values.popitem(last=False)
+        return True
+
+    def close(self):
+        self._values.clear()
+
+
+_cache=None
+_cache_pid=None
+
+
+def use_shared_frame_cache(shared=True):
+    """Keep the frames in FRAME_CACHE_DIR, shared with the processes forked after this call"""
+    global FRAME_CACHE_SHARED, _cache
+    FRAME_CACHE_SHARED=shared
+    _cache=None
+
+
+def get_frame_cache():
+    """
+    This process' frame cache, or None if FRAME_CACHE_SLOTS is 0: a SharedFrameCache
+    if FRAME_CACHE_SHARED, a LocalFrameCache otherwise (or if the file cannot be allocated).
+    Handles are reopened after a fork so every worker has its own locks
+    """
+    global _cache, _cache_pid
+    if FRAME_CACHE_SLOTS <= 0:
+        return None
+    if _cache is None or _cache_pid != os.getpid():
+        _cache=None
+        if FRAME_CACHE_SHARED:
+            path=os.path.join(
+                FRAME_CACHE_DIR,
+                f"idtrackerai_validator_frames_{FRAME_CACHE_SLOTS}x{FRAME_CACHE_SLOT_BYTES}"
+            )
+            try:
+                _cache=SharedFrameCache(path)
+            except OSError as error:
+                logger.warning("Cannot open the shared frame cache %s, caching frames per worker: %s", path, error)
+        if _cache is None:
+            _cache=LocalFrameCache()
+        _cache_pid=os.getpid()
+    return _cache
@@ -0,0 +1,458 @@
+"""
+Record validator sessions and replay them against a running server
+
+Recording: start the server with VALIDATOR_ACCESS_LOG=access.ndjson and every request
+is appended to that file (time, client, method, path, status, duration and the JSON
+body of POSTs). The access logs of the development server and of gunicorn
+(--access-logfile, common log format) can be replayed too, without their POSTs.
+
+Sessions can also be generated for an experiment (for example a synthetic one, see
+synthetic.py) with a realistic mix of scrubbing, playing, error jumps, pose toggling
+and PE review:
+
+    python -m idtrackerai_validator_server.loadtest synth FlyHostel1/3X/2023-01-01_10-00-00 \\
+        --frames 50000-51999 --fly FlyHostel1_3X_2023-01-01_10-00-00__01 -o sessions.ndjson
+
+Replay: every virtual validator replays one recorded session at a time (the requests of
+one client, with their think times), concurrency validators at once:
+
+    python -m idtrackerai_validator_server.loadtest replay sessions.ndjson \\
+        --url http://localhost:5000 --concurrency 1,2,4,8,16 --duration 60 --slo-p95 250
+
+and the p50/p95/p99 latency and throughput of every route is reported for every
+concurrency level.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import datetime
+import threading
+import http.client
+from urllib.parse import urlsplit, urlencode
+
+import numpy as np
+
+logger=logging.getLogger(__name__)
+
+VALIDATOR_ACCESS_LOG=os.environ.get("VALIDATOR_ACCESS_LOG", None)
+
+_CLF_RE=re.compile(r'^(\S+) \S+ \S+ \[([^\]]+)\] "(\S+) (\S+) [^"]*" (\d{3})')
+_CLF_TIME_FORMATS=("%d/%b/%Y:%H:%M:%S %z", "%d/%b/%Y %H:%M:%S")
+_NUMBER_RE=re.compile(r"/\d+(?=/|$)")
+
+
+def init_app(app):
+    """Append every request of app to VALIDATOR_ACCESS_LOG, if it is set"""
+    if VALIDATOR_ACCESS_LOG is None:
+        return
+
+    from flask import g, request
+
+    lock=threading.Lock()
+    log=open(VALIDATOR_ACCESS_LOG, "a", buffering=1)
+    logger.info("Recording the requests in %s", VALIDATOR_ACCESS_LOG)
+
+    @app.before_request
+    def _record_start():
+        g.access_t0=time.time()
+
+    @app.after_request
+    def _record_request(response):
+        t0=g.pop("access_t0", None)
+        if t0 is None or request.path=="/api/metrics":
+            return response
+        record={
+            "t": round(t0, 4),
+            "client": request.headers.get("X-Validator-Session", request.remote_addr),
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "status": response.status_code,
+            "duration": round(time.time()-t0, 5),
+        }
+        if request.method=="POST" and request.is_json:
+            record["body"]=request.get_json(silent=True)
+        with lock:
+            log.write(json.dumps(record) + "\n")
+        return response
+
+
+def route_of(path):
+    """Route of a request path, with the numbers of the path replaced (/api/frame/123 -> /api/frame/<n>)"""
+    return _NUMBER_RE.sub("/<n>", path.split("?", 1)[0])
+
+
+def _parse_clf_time(value):
+    for fmt in _CLF_TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            continue
+    return None
+
+
+def read_log(path):
+    """
+    Requests of an access log, sorted by time
+
+    Returns:
+        records (list): dicts with t, client, method, path and body (POSTs of ndjson logs only)
+    """
+    records=[]
+    skipped=0
+    with open(path) as filehandle:
+        for line in filehandle:
+            line=line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                records.append(json.loads(line))
+                continue
+            match=_CLF_RE.search(line)
+            if match is None:
+                continue
+            client, timestamp, method, target, status=match.groups()
+            t=_parse_clf_time(timestamp)
+            if t is None or method!="GET":
+                # the body of a POST is not in the log
+                skipped+=1
+                continue
+            records.append({"t": t, "client": client, "method": method, "path": target, "status": int(status)})
+    if skipped:
+        logger.warning("Skipped %s requests of %s that cannot be replayed", skipped, path)
+    records.sort(key=lambda record: record["t"])
+    return records
+
+
+def split_sessions(records, gap=300):
+    """
+    Split the requests in sessions: the requests of one client, cut where it was idle more than gap seconds
+
+    Returns:
+        sessions (list): lists of (think time before the request, method, path, body)
+    """
+    by_client={}
+    for record in records:
+        by_client.setdefault(record.get("client"), []).append(record)
+
+    sessions=[]
+    for requests in by_client.values():
+        session=[]
+        last=None
+        for record in requests:
+            if last is not None and record["t"]-last > gap:
+                sessions.append(session)
+                session=[]
+            think=0.0 if last is None or not session else record["t"]-last
+            session.append((think, record["method"], record["path"], record.get("body")))
+            last=record["t"]
+        if session:
+            sessions.append(session)
+    return [session for session in sessions if session]
+
+
+def synthesize_sessions(experiment, first_frame, last_frame, flies=(), n_sessions=20, length=200,
+                        framerate=15, pose_share=0.5, seed=0):
+    """
+    Sessions with the mix of a validator at work: scrubbing the timeline, playing,
+    jumping to the next/previous error, AI mark or OK frame, toggling the pose and,
+    if flies are given, reviewing PE bouts
+
+    Arguments:
+
+        framerate (int): frames per second requested while playing
+        pose_share (float): fraction of the tracking requests with the pose
+
+    Returns:
+        records (list): like read_log, one client per session
+    """
+    rng=random.Random(seed)
+    records=[]
+    for session in range(n_sessions):
+        t=0.0
+        n=0
+        frame=rng.randint(first_frame, last_frame)
+        pose=rng.random() < pose_share
+
+        def add(think, path, method="GET", body=None):
+            nonlocal t, n
+            t+=think
+            n+=1
+            record={"t": t, "client": f"synthetic-{session}", "method": method, "path": path}
+            if body is not None:
+                record["body"]=body
+            records.append(record)
+
+        def show(think):
+            add(think, f"/api/frame/{frame}")
+            add(0, f"/api/tracking/{frame}?pose={int(pose)}")
+
+        add(0, "/api/frame_range")
+        add(0, "/api/framerate")
+        show(0)
+        while n < length:
+            action=rng.choices(
+                ["scrub", "play", "jump", "step", "pose", "pe"],
+                weights=[3, 2, 3, 3, 0.5, 2 if flies else 0]
+            )[0]
+            if action=="scrub":
+                for _ in range(rng.randint(3, 15)):
+                    frame=min(max(frame+rng.randint(-2000, 2000), first_frame), last_frame)
+                    show(rng.uniform(0.05, 0.3))
+            elif action=="play":
+                for _ in range(rng.randint(framerate, 5*framerate)):
+                    frame=min(frame+1, last_frame)
+                    show(1/framerate)
+            elif action=="jump":
+                route=rng.choice(["next_error", "prev_error", "next_ai", "prev_ai", "next_ok", "prev_ok"])
+                add(rng.uniform(0.5, 3), f"/api/{route}/{frame}")
+                frame=min(max(frame+rng.randint(-500, 500), first_frame), last_frame)
+                show(0.05)
+            elif action=="step":
+                for _ in range(rng.randint(1, 10)):
+                    frame=min(max(frame+rng.choice([-1, 1]), first_frame), last_frame)
+                    show(rng.uniform(0.2, 1))
+            elif action=="pose":
+                pose=not pose
+                show(rng.uniform(0.5, 2))
+            else:
+                fly=rng.choice(list(flies))
+                add(rng.uniform(1, 3), "/api/pe/bouts?" + urlencode({"fly": fly, "limit": 50}))
+                add(0, "/api/pe/audit?" + urlencode({"fly": fly}))
+                for _ in range(rng.randint(1, 8)):
+                    start=rng.randint(first_frame, last_frame)
+                    add(rng.uniform(2, 8), "/api/pe/trace?" + urlencode({"fly": fly, "burst_id": rng.randint(0, 20)}))
+                    add(0, "/api/pe/annotate", "POST", {
+                        "fly": fly, "start_frame": start, "end_frame": start+rng.randint(5, 100),
+                        "verdict": rng.choice(["pe", "pe", "groom", "other", "unsure"]),
+                        "reviewer": f"synthetic-{session}",
+                    })
+    # an experiment switch is not part of a validator's routine, loaded once by replay
+    records.insert(0, {"t": -1.0, "client": "setup", "method": "POST", "path": "/api/load",
+                       "body": {"experiment": experiment, "wait": True}})
+    return records
+
+
+class _Client:
+    """Keep-alive HTTP connection of one virtual validator"""
+
+    def __init__(self, url, timeout):
+        parts=urlsplit(url)
+        self.host=parts.hostname
+        self.port=parts.port or 80
+        self.timeout=timeout
+        self.connection=None
+
+    def request(self, method, path, body=None):
+        headers={}
+        payload=None
+        if body is not None:
+            payload=json.dumps(body).encode()
+            headers["Content-Type"]="application/json"
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection=http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.connection.request(method, path, body=payload, headers=headers)
+                response=self.connection.getresponse()
+                response.read()
+                return response.status
+            except (http.client.HTTPException, ConnectionError):
+                # the server closed the kept-alive connection, retry on a new one once
+                self.connection.close()
+                self.connection=None
+                if attempt:
+                    raise
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+
+def replay(url, sessions, concurrency, duration=None, speed=1.0, max_think=5.0, timeout=60, seed=0):
+    """
+    Replay sessions with concurrency virtual validators
+
+    Every validator replays whole sessions (starting at a random one) until duration
+    seconds have passed, or once through all the sessions if duration is None
+
+    Arguments:
+
+        speed (float): think times are divided by speed (0 replays without pauses)
+        max_think (float): think times are capped to this many seconds
+
+    Returns:
+        samples (list): (route, status, latency) of every request
+        elapsed (float): seconds the replay lasted
+    """
+    samples=[]
+    lock=threading.Lock()
+    deadline=None if duration is None else time.perf_counter()+duration
+    order=list(range(len(sessions)))
+    random.Random(seed).shuffle(order)
+
+    def validator(index):
+        client=_Client(url, timeout)
+        local=[]
+        position=index
+        try:
+            while True:
+                if deadline is None and position >= len(order):
+                    break
+                session=sessions[order[position % len(order)]]
+                position+=concurrency
+                for think, method, path, body in session:
+                    if speed > 0 and think > 0:
+                        time.sleep(min(think, max_think)/speed)
+                    if deadline is not None and time.perf_counter() > deadline:
+                        return
+                    t0=time.perf_counter()
+                    try:
+                        status=client.request(method, path, body)
+                    except (OSError, http.client.HTTPException) as error:
+                        logger.debug("%s %s failed: %s", method, path, error)
+                        status=0
+                    local.append((route_of(path), status, time.perf_counter()-t0))
+        finally:
+            client.close()
+            with lock:
+                samples.extend(local)
+
+    t0=time.perf_counter()
+    threads=[threading.Thread(target=validator, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter()-t0
+
+
+def summarise(samples, elapsed):
+    """Count, errors, throughput and latency percentiles (ms) of every route and of all of them"""
+    def stats(latencies, errors):
+        latencies=np.array(latencies)*1000
+        p50, p95, p99=np.percentile(latencies, [50, 95, 99]) if len(latencies) else (np.nan,)*3
+        return {
+            "count": len(latencies),
+            "errors": errors,
+            "rps": round(len(latencies)/elapsed, 2) if elapsed else None,
+            "mean": round(float(latencies.mean()), 2) if len(latencies) else None,
+            "p50": round(float(p50), 2), "p95": round(float(p95), 2), "p99": round(float(p99), 2),
+        }
+
+    routes={}
+    for route, status, latency in samples:
+        routes.setdefault(route, ([], [0]))
+        routes[route][0].append(latency)
+        if status==0 or status >= 500:
+            routes[route][1][0]+=1
+
+    out={route: stats(latencies, errors[0]) for route, (latencies, errors) in sorted(routes.items())}
+    out["ALL"]=stats(
+        [latency for _, _, latency in samples],
+        sum(errors[0] for _, errors in routes.values())
+    )
+    return out
+
+
+def format_summary(summary):
+    lines=[f"{'route':<40}{'count':>8}{'errors':>8}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}"]
+    for route, row in summary.items():
+        lines.append(
+            f"{route:<40}{row['count']:>8}{row['errors']:>8}{row['rps']:>9}"
+            f"{row['p50']:>9}{row['p95']:>9}{row['p99']:>9}"
+        )
+    return "\n".join(lines)
+
+
+def get_parser():
+    ap=argparse.ArgumentParser(description="Record, generate and replay validator sessions")
+    subparsers=ap.add_subparsers(dest="command", required=True)
+
+    synth=subparsers.add_parser("synth", help="Generate sessions for an experiment")
+    synth.add_argument("experiment", help="FlyHostelN/NX/YYYY-MM-DD_HH-MM-SS")
+    synth.add_argument("--frames", required=True, help="first-last frame of the experiment")
+    synth.add_argument("--fly", action="append", default=[], help="Fly reviewed in the PE sessions (repeat)")
+    synth.add_argument("--sessions", default=20, type=int)
+    synth.add_argument("--length", default=200, type=int, help="Requests per session")
+    synth.add_argument("--seed", default=0, type=int)
+    synth.add_argument("-o", "--output", required=True)
+
+    run=subparsers.add_parser("replay", help="Replay a log against a running server")
+    run.add_argument("log", help="ndjson log (VALIDATOR_ACCESS_LOG or synth) or common log format")
+    run.add_argument("--url", default="http://localhost:5000")
+    run.add_argument("--concurrency", default="1", help="Comma separated numbers of validators, run in turn")
+    run.add_argument("--duration", default=None, type=float, help="Seconds per concurrency level")
+    run.add_argument("--speed", default=1.0, type=float, help="Think time divisor, 0 for no think time")
+    run.add_argument("--max-think", default=5.0, type=float)
+    run.add_argument("--gap", default=300, type=float, help="Idle seconds that end a recorded session")
+    run.add_argument("--experiment", default=None, help="Load this experiment before replaying")
+    run.add_argument("--slo-p95", default=None, type=float, help="p95 (ms) a concurrency level must meet")
+    run.add_argument("--json", default=None, help="Save the summaries to this file")
+    return ap
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    args=get_parser().parse_args()
+
+    if args.command=="synth":
+        first, last=(int(value) for value in args.frames.split("-"))
+        records=synthesize_sessions(
+            args.experiment, first, last, flies=args.fly,
+            n_sessions=args.sessions, length=args.length, seed=args.seed
+        )
+        with open(args.output, "w") as filehandle:
+            for record in records:
+                filehandle.write(json.dumps(record) + "\n")
+        print(f"{len(records)} requests written to {args.output}")
+        return
+
+    records=read_log(args.log)
+    experiment=args.experiment
+    replayable=[]
+    for record in records:
+        if record["path"].startswith("/api/load") and record["method"]=="POST":
+            # switching experiments is global to the server, it is done once before replaying
+            experiment=experiment or (record.get("body") or {}).get("experiment")
+            continue
+        replayable.append(record)
+    sessions=split_sessions(replayable, gap=args.gap)
+    if not sessions:
+        sys.exit(f"No requests to replay in {args.log}")
+
+    if experiment is not None:
+        client=_Client(args.url, timeout=600)
+        status=client.request("POST", "/api/load", {"experiment": experiment, "wait": True})
+        client.close()
+        if status!=200:
+            sys.exit(f"Cannot load {experiment}: HTTP {status}")
+
+    print(f"{len(sessions)} sessions, {sum(len(s) for s in sessions)} requests")
+    summaries={}
+    supported=None
+    for concurrency in (int(value) for value in args.concurrency.split(",")):
+        samples, elapsed=replay(
+            args.url, sessions, concurrency, duration=args.duration,
+            speed=args.speed, max_think=args.max_think
+        )
+        summary=summarise(samples, elapsed)
+        summaries[concurrency]=summary
+        print(f"\n{concurrency} validators, {elapsed:.1f} s")
+        print(format_summary(summary))
+        if args.slo_p95 is not None and summary["ALL"]["p95"] <= args.slo_p95 and summary["ALL"]["errors"]==0:
+            supported=concurrency
+
+    if args.slo_p95 is not None:
+        print(f"\nMost validators with p95 <= {args.slo_p95} ms and no errors: {supported}")
+    if args.json:
+        with open(args.json, "w") as filehandle:
+            json.dump(summaries, filehandle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Locks shared by the request handlers of the validator
+"""
+import threading
+import contextlib
+
+
+class ReadWriteLock:
+    """
+    Any number of readers or a single writer.
+
+    A waiting writer blocks new readers, so a steady stream of reads
+    cannot starve it. Not reentrant: a reader must not acquire it again.
+    Ownership is not tracked, so it can be released from another thread.
+    """
+
+    def __init__(self):
+        self._cond=threading.Condition(threading.Lock())
+        self._readers=0
+        self._writer=False
+        self._writers_waiting=0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers+=1
+
+    def release_read(self):
+        with self._cond:
+            self._readers-=1
+            if self._readers==0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._writers_waiting+=1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting-=1
+            self._writer=True
+
+    def release_write(self):
+        with self._cond:
+            self._writer=False
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
@@ -1,5 +1,6 @@
-import subprocess
+import os
 import shlex
+import argparse
 import pathlib
 import os.path
 import sys
@@ -12,12 +13,50 @@ def main():
     cmd=f"""
         {python_bin} {executable}  --host "{os.environ.get('CVAT_HOST', 3000)}" --port {os.environ.get('BACKEND_PORT', 5000)}
     """
+    if "VALIDATOR_WORKERS" in os.environ:
+        # multi-worker mode, see production.py
+        cmd+=f" --workers {os.environ['VALIDATOR_WORKERS']}"
     print(cmd)
  
     cmd=shlex.split(cmd)
 
-    p=subprocess.Popen(cmd)
-    p.communicate()
+    # replace this process with the server, one interpreter less to start and to forward signals through
+    os.execv(python_bin, cmd)
+
+
+def build_cache(experiments, force=False):
+    """Build the columnar sidecar of the .db of every experiment, see sidecar.py"""
+    from idtrackerai_validator_server.backend import generate_database_filename
+    from idtrackerai_validator_server.sidecar import build_sidecar
+
+    for experiment in experiments:
+        if experiment.endswith(".db"):
+            dbfile=experiment
+        else:
+            if "/" not in experiment:
+                tokens=experiment.split("_")
+                experiment="/".join([tokens[0], tokens[1], "_".join(tokens[2:4])])
+            dbfile=generate_database_filename(experiment)
+        print(build_sidecar(dbfile, force=force))
+
+
+def cli():
+    ap=argparse.ArgumentParser(prog="idtrackerai-validator-server")
+    commands=ap.add_subparsers(dest="command", required=True)
+    commands.add_parser("start", help="Start the backend, same as start-idtrackerai-validator-server")
+    build=commands.add_parser(
+        "build-cache", help="Export the tracking tables of experiments to a columnar sidecar read by the server"
+    )
+    build.add_argument("experiments", nargs="+", help="FlyHostelN_NX_YYYY-MM-DD_HH-MM-SS or path to its .db")
+    build.add_argument("--force", action="store_true", help="Build it even if it is up to date")
+    args=ap.parse_args()
+
+    if args.command=="start":
+        main()
+    elif args.command=="build-cache":
+        import logging
+        logging.basicConfig(level=logging.INFO)
+        build_cache(args.experiments, force=args.force)
 
 
 if __name__ == "__main__":
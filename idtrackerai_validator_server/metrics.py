@@ -0,0 +1,246 @@
+"""
+Built-in instrumentation of the validator, served at /api/metrics
+
+* latency of every route (histogram per route template, method and status)
+* latency of the sub-phases of a request (decode, encode, segmentation, sql,
+  pose_h5, json, ...), recorded with timed()
+* hits and misses of the caches
+* requests in flight
+
+Recording a sample is a dict lookup and a few additions under a lock, so the
+metrics stay on in production. They are kept per process: with --workers every
+worker reports its own (the pid is part of the JSON output).
+"""
+import os
+import time
+import bisect
+import contextlib
+import threading
+
+# upper bounds (seconds) of the latency buckets, the last one is +Inf
+BUCKETS=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock=threading.Lock()
+_started_at=time.time()
+
+
+class Histogram:
+    """Latency samples counted in BUCKETS, plus their count and sum"""
+
+    __slots__=("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts=[0]*(len(BUCKETS)+1)
+        self.count=0
+        self.sum=0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)]+=1
+        self.count+=1
+        self.sum+=seconds
+
+    def cumulative(self):
+        out=[]
+        total=0
+        for count in self.counts:
+            total+=count
+            out.append(total)
+        return out
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (None if empty)"""
+        if self.count==0:
+            return None
+        rank=q*self.count
+        for bound, total in zip(BUCKETS + (float("inf"),), self.cumulative()):
+            if total >= rank:
+                return bound
+
+
+_requests={}    # (route, method, status) -> Histogram
+_phases={}      # phase -> Histogram
+_caches={}      # cache -> [hits, misses]
+_collectors={}  # cache -> callable returning (hits, misses), for caches keeping their own counts
+_in_flight=0
+
+
+def request_started():
+    global _in_flight
+    with _lock:
+        _in_flight+=1
+
+
+def request_finished():
+    global _in_flight
+    with _lock:
+        _in_flight-=1
+
+
+def in_flight():
+    """Number of requests being served by this process"""
+    return _in_flight
+
+
+def observe_request(route, method, status, seconds):
+    key=(route, method, int(status))
+    with _lock:
+        histogram=_requests.get(key)
+        if histogram is None:
+            histogram=_requests[key]=Histogram()
+        histogram.observe(seconds)
+
+
+def observe_phase(phase, seconds):
+    with _lock:
+        histogram=_phases.get(phase)
+        if histogram is None:
+            histogram=_phases[phase]=Histogram()
+        histogram.observe(seconds)
+
+
+@contextlib.contextmanager
+def timed(phase):
+    """Record the time spent in the block as a sample of phase"""
+    t0=time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_phase(phase, time.perf_counter()-t0)
+
+
+def cache_hit(cache, hit=True):
+    """Count a hit (or a miss, with hit=False) of cache"""
+    with _lock:
+        counts=_caches.get(cache)
+        if counts is None:
+            counts=_caches[cache]=[0, 0]
+        counts[0 if hit else 1]+=1
+
+
+def register_cache(cache, collector):
+    """Report the hits and misses returned by collector() as those of cache"""
+    _collectors[cache]=collector
+
+
+def _cache_counts():
+    with _lock:
+        out={cache: tuple(counts) for cache, counts in _caches.items()}
+    for cache, collector in _collectors.items():
+        try:
+            counts=collector()
+        except Exception:
+            continue
+        if counts is not None:
+            out[cache]=tuple(counts)
+    return out
+
+
+def init_app(app):
+    """Time every request of app and count the requests in flight"""
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_t0=time.perf_counter()
+        request_started()
+
+    @app.after_request
+    def _observe_request(response):
+        t0=g.pop("metrics_t0", None)
+        if t0 is not None:
+            route=request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+            observe_request(route, request.method, response.status_code, time.perf_counter()-t0)
+        return response
+
+    @app.teardown_request
+    def _end_request(error=None):
+        request_finished()
+
+
+def snapshot():
+    """All the metrics of this process as a dict, for the JSON output"""
+    def summary(histogram):
+        return {
+            "count": histogram.count,
+            "sum": round(histogram.sum, 6),
+            "mean": round(histogram.sum/histogram.count, 6) if histogram.count else None,
+            "p50": histogram.quantile(0.5),
+            "p90": histogram.quantile(0.9),
+            "p99": histogram.quantile(0.99),
+            "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], histogram.cumulative())),
+        }
+
+    with _lock:
+        requests=[
+            {"route": route, "method": method, "status": status, **summary(histogram)}
+            for (route, method, status), histogram in sorted(_requests.items())
+        ]
+        phases={phase: summary(histogram) for phase, histogram in sorted(_phases.items())}
+        in_flight=_in_flight
+
+    caches={}
+    for cache, (hits, misses) in sorted(_cache_counts().items()):
+        total=hits+misses
+        caches[cache]={"hits": hits, "misses": misses, "ratio": round(hits/total, 4) if total else None}
+
+    return {
+        "pid": os.getpid(),
+        "uptime": round(time.time()-_started_at, 3),
+        "in_flight": in_flight,
+        "requests": requests,
+        "phases": phases,
+        "caches": caches,
+    }
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{name}="{escape(value)}"' for name, value in labels.items())
+
+
+def _histogram_lines(name, histogram, labels):
+    prefix=f"{labels}," if labels else ""
+    for bound, total in zip([str(b) for b in BUCKETS] + ["+Inf"], histogram.cumulative()):
+        yield f'{name}_bucket{{{prefix}le="{bound}"}} {total}'
+    yield f"{name}_sum{{{labels}}} {histogram.sum}"
+    yield f"{name}_count{{{labels}}} {histogram.count}"
+
+
+def render_prometheus():
+    """All the metrics of this process in the Prometheus text exposition format (0.0.4)"""
+    lines=[]
+    with _lock:
+        lines+=[
+            "# HELP validator_request_duration_seconds Latency of the requests by route",
+            "# TYPE validator_request_duration_seconds histogram",
+        ]
+        for (route, method, status), histogram in sorted(_requests.items()):
+            lines+=_histogram_lines(
+                "validator_request_duration_seconds", histogram,
+                _labels(route=route, method=method, status=status)
+            )
+        lines+=[
+            "# HELP validator_phase_duration_seconds Time spent in the phases of a request",
+            "# TYPE validator_phase_duration_seconds histogram",
+        ]
+        for phase, histogram in sorted(_phases.items()):
+            lines+=_histogram_lines("validator_phase_duration_seconds", histogram, _labels(phase=phase))
+        lines+=[
+            "# HELP validator_requests_in_flight Requests being served",
+            "# TYPE validator_requests_in_flight gauge",
+            f"validator_requests_in_flight {_in_flight}",
+        ]
+
+    counts=sorted(_cache_counts().items())
+    lines+=[
+        "# HELP validator_cache_hits_total Cache hits",
+        "# TYPE validator_cache_hits_total counter",
+    ]
+    lines+=[f"validator_cache_hits_total{{{_labels(cache=cache)}}} {hits}" for cache, (hits, _) in counts]
+    lines+=[
+        "# HELP validator_cache_misses_total Cache misses",
+        "# TYPE validator_cache_misses_total counter",
+    ]
+    lines+=[f"validator_cache_misses_total{{{_labels(cache=cache)}}} {misses}" for cache, (_, misses) in counts]
+    return "\n".join(lines) + "\n"
@@ -14,17 +14,36 @@ INTEGRATION (see the chat message):
   3. set PE_BOUTS_DIR / PE_MEDIA_DIR / PE_DB below (or via env)
 """
 import os
+import io
+import csv
+import json
 import logging
 import sqlite3
 import datetime
-import pandas as pd
-from flask import jsonify, request, send_from_directory
-
-from flyhostel.utils import (
-    get_basedir,
-    get_chunksize,
-    get_framerate
-)
+import contextlib
+import mimetypes
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from flask import Response, jsonify, request
+from werkzeug.datastructures import ContentRange
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
+
+from idtrackerai_validator_server import metrics
+from idtrackerai_validator_server.metrics import timed
+from idtrackerai_validator_server.startup import lazy_import, lazy_callable
+
+# imported on first use, see startup.py
+pd = lazy_import("pandas")
+pa = lazy_import("pyarrow")
+pa_feather = lazy_import("pyarrow.feather")
+get_basedir = lazy_callable("flyhostel.utils", "get_basedir")
+get_chunksize = lazy_callable("flyhostel.utils", "get_chunksize")
+get_framerate = lazy_callable("flyhostel.utils", "get_framerate")
+get_identities = lazy_callable("flyhostel.utils", "get_identities")
 
 logger=logging.getLogger(__name__)
 
@@ -35,31 +54,383 @@ PE_DB          = os.environ.get("PE_DB", "pe_annotations.db")      # separate fr
 
 AUDIT_CSV = os.environ.get("PE_AUDIT_CSV", "audit.csv")
 
-import os
-_TRACE_CACHE = {}   # fly -> (mtime, DataFrame)
+# flies whose traces and bouts are kept in memory, least recently used first out
+PE_CACHE_FLIES = int(os.environ.get("PE_CACHE_FLIES", 16))
+_fly_cache_lock = threading.Lock()
+
+
+def _fly_cache_get(cache, fly):
+    with _fly_cache_lock:
+        hit = cache.get(fly)
+        if hit is not None:
+            cache.move_to_end(fly)
+    return hit
+
+
+def _fly_cache_put(cache, fly, value):
+    with _fly_cache_lock:
+        cache[fly] = value
+        cache.move_to_end(fly)
+        while len(cache) > PE_CACHE_FLIES:
+            cache.popitem(last=False)
+
+
+_TRACE_COLUMNS = ("burst_id", "frame_number", "dist_mm", "prob_conf",
+                  "bout_uid", "bout_in_burst", "is_peak")
+_TRACE_CACHE = OrderedDict()   # fly -> (mtime, TraceStore)
+
+
+class TraceStore:
+    """
+    Traces of one fly sorted by (burst_id, frame_number), as one numpy array per column,
+    with the [start, stop) rows of every burst so a burst is a slice of the arrays
+    """
+
+    def __init__(self, df):
+        df = df[df["burst_id"].notna()]
+        burst = df["burst_id"].to_numpy().astype(np.int64)
+        frame_number = df["frame_number"].to_numpy().astype(np.int64)
+        order = np.lexsort((frame_number, burst))
+
+        self.columns = {"burst_id": burst[order], "frame_number": frame_number[order]}
+        for column in ("dist_mm", "prob_conf", "bout_uid", "bout_in_burst"):
+            self.columns[column] = df[column].to_numpy(dtype=np.float64, na_value=np.nan)[order]
+        self.columns["is_peak"] = df["is_peak"].to_numpy(dtype=bool, na_value=False)[order]
+
+        burst = self.columns["burst_id"]
+        starts = np.flatnonzero(np.r_[True, burst[1:] != burst[:-1]]) if len(burst) else np.array([], int)
+        stops = np.r_[starts[1:], len(burst)]
+        self.index = {int(b): (int(start), int(stop)) for b, start, stop in zip(burst[starts], starts, stops)}
+
+    def burst(self, burst_id):
+        """Columns of one burst, or None if the burst is not in the traces"""
+        hit = self.index.get(burst_id)
+        if hit is None:
+            return None
+        start, stop = hit
+        return {column: values[start:stop] for column, values in self.columns.items()}
+
 
 def _load_traces_cached(traces_file, fly):
     mtime = os.path.getmtime(traces_file)
-    hit = _TRACE_CACHE.get(fly)
+    hit = _fly_cache_get(_TRACE_CACHE, fly)
+    metrics.cache_hit("pe_traces", bool(hit and hit[0] == mtime))
     if hit and hit[0] == mtime:
         return hit[1]
-    df = pd.read_feather(traces_file)
-    _TRACE_CACHE[fly] = (mtime, df)
+    df = pa_feather.read_table(traces_file, columns=list(_TRACE_COLUMNS), memory_map=True).to_pandas()
+    store = TraceStore(df)
+    _fly_cache_put(_TRACE_CACHE, fly, (mtime, store))
+    return store
+
+
+def _nullable(values, decimals=None, cast=float):
+    """values as a list for JSON, with None where they are NaN"""
+    missing = np.isnan(values)
+    if decimals is not None:
+        values = np.round(values, decimals)
+    if cast is int:
+        values = np.where(missing, 0, values).astype(np.int64)
+    out = values.tolist()
+    for i in np.flatnonzero(missing):
+        out[i] = None
+    return out
+
+
+def _spans_and_gaps(t_s, bout_in_burst):
+    """
+    Start, end and duration of every bout of a burst, sorted by start, and the gaps between them
+    """
+    valid = ~np.isnan(bout_in_burst)
+    bouts = bout_in_burst[valid]
+    if bouts.size == 0:
+        return [], []
+    t = t_s[valid]
+    order = np.argsort(bouts, kind="stable")
+    bouts, t = bouts[order], t[order]
+    starts = np.flatnonzero(np.r_[True, bouts[1:] != bouts[:-1]])
+    t0 = np.minimum.reduceat(t, starts)
+    t1 = np.maximum.reduceat(t, starts)
+    bouts = bouts[starts]
+
+    order = np.argsort(t0, kind="stable")
+    bouts, t0, t1 = bouts[order], t0[order], t1[order]
+    spans = [{"bout_in_burst": int(b), "t0": float(a), "t1": float(z), "dur": float(z - a)}
+             for b, a, z in zip(bouts, t0, t1)]
+    gaps = [{"g0": float(a), "g1": float(z), "gap": float(z - a)}
+            for a, z in zip(t1[:-1], t0[1:])]
+    return spans, gaps
+
+
+_AUDIT_CACHE = {}   # audit csv -> (mtime, {fly: sorted array of burst_id})
+
+
+def _load_audit_cached(audit_csv):
+    mtime = os.path.getmtime(audit_csv)
+    hit = _AUDIT_CACHE.get(audit_csv)
+    metrics.cache_hit("pe_audit", bool(hit and hit[0] == mtime))
+    if hit and hit[0] == mtime:
+        return hit[1]
+    logger.info("Reading %s", audit_csv)
+    a = pd.read_csv(audit_csv, usecols=["fly", "burst_id"])
+    audit = {fly: np.unique(group.to_numpy(dtype=np.int64))
+             for fly, group in a.groupby("fly")["burst_id"]}
+    _AUDIT_CACHE[audit_csv] = (mtime, audit)
+    return audit
+
+
+# columns of the _pe_bouts.feather served by /api/pe/bouts (the rest is never read)
+_BOUT_COLUMNS = ("burst_id", "bout_uid", "start_fn", "end_fn", "n_in_burst", "is_solitary",
+                 "pe_score", "dur_s", "label", "label_reason")
+_BOUTS_CACHE = OrderedDict()   # fly -> (mtime, chunksize, DataFrame sorted and with the derived columns)
+
+
+def _read_bouts(feather):
+    """Read only _BOUT_COLUMNS of a bouts feather, memory-mapping the file"""
+    try:
+        with pa.memory_map(feather) as source:
+            names = pa.ipc.open_file(source).schema.names
+        columns = [c for c in _BOUT_COLUMNS if c in names]
+    except pa.ArrowInvalid:
+        # feather v1 files are not Arrow IPC files, read all their columns
+        columns = None
+    return pa_feather.read_table(feather, columns=columns, memory_map=True).to_pandas()
+
+
+def _load_bouts_cached(feather, fly, chunksize):
+    mtime = os.path.getmtime(feather)
+    hit = _fly_cache_get(_BOUTS_CACHE, fly)
+    metrics.cache_hit("pe_bouts", bool(hit and hit[0] == mtime and hit[1] == chunksize))
+    if hit and hit[0] == mtime and hit[1] == chunksize:
+        return hit[2]
+
+    df = _read_bouts(feather)
+    # keep burst grouping intact
+    df = df.sort_values(["burst_id", "start_fn"], kind="stable").reset_index(drop=True)
+    df["start_fidx"] = df["start_fn"] % chunksize
+    df["end_fidx"]   = df["end_fn"]   % chunksize
+    df["is_pe"]      = (df["label"] == "pe")          # annotatable vs display-only
+    _fly_cache_put(_BOUTS_CACHE, fly, (mtime, chunksize, df))
     return df
 
+
+def _bout_filters(args):
+    """
+    Server-side filters of /api/pe/bouts, parsed from the query.
+    Query: ?label=pe,groom&min_score=0.2&max_score=0.8&burst_id=2639
+    Raises ValueError if a number is not valid
+    """
+    filters = {}
+    if args.get("label"):
+        filters["label"] = args["label"].split(",")
+    for name, cast in (("min_score", float), ("max_score", float), ("burst_id", int)):
+        value = args.get(name)
+        if value is None or value == "":
+            continue
+        try:
+            filters[name] = cast(value)
+        except ValueError:
+            raise ValueError(f"{name} must be {'a number' if cast is float else 'an integer'}, not {value!r}")
+    return filters
+
+
+def _filter_bouts(df, filters):
+    """The bouts of df matching filters (see _bout_filters)"""
+    mask = np.ones(len(df), dtype=bool)
+    if "label" in filters:
+        mask &= df["label"].isin(filters["label"]).values
+    if "min_score" in filters and "pe_score" in df.columns:
+        mask &= (df["pe_score"] >= filters["min_score"]).values
+    if "max_score" in filters and "pe_score" in df.columns:
+        mask &= (df["pe_score"] <= filters["max_score"]).values
+    if "burst_id" in filters:
+        mask &= (df["burst_id"] == filters["burst_id"]).values
+    if mask.all():
+        return df
+    return df[mask]
+
+
 def _media_dir(experiment):
     # parent of both plots/ and videos/, so a request for "videos/xxx.mp4" or
-    # "plots/xxx.png" resolves as a subpath. send_from_directory blocks ../ escapes.
+    # "plots/xxx.png" resolves as a subpath. safe_join in pe_media blocks ../ escapes.
     return os.path.join(get_basedir(experiment.replace("/", "_")),
                         "flyhostel", "proboscis_extensions")
 
 
+# burst videos and plots are never rewritten in place, let browsers keep them
+PE_MEDIA_MAX_AGE = int(os.environ.get("PE_MEDIA_MAX_AGE", 7*24*3600))
+_MEDIA_SUBDIRS = ("videos", "plots")
+_MEDIA_ROOT_CACHE = {}   # experiment -> realpath of its _media_dir
+_MEDIA_INDEX_CACHE = {}  # experiment -> (mtimes of _MEDIA_SUBDIRS, {subdir: sorted stems})
+_MEDIA_BLOCKSIZE = 256 * 1024
+
+
+def _media_root(experiment):
+    root = _MEDIA_ROOT_CACHE.get(experiment)
+    if root is None:
+        root = os.path.realpath(_media_dir(experiment))
+        _MEDIA_ROOT_CACHE[experiment] = root
+    return root
+
+
+def _media_index(experiment):
+    """Stems of the files available in each of _MEDIA_SUBDIRS, listed again when a folder changes"""
+    root = _media_root(experiment)
+    mtimes = []
+    for subdir in _MEDIA_SUBDIRS:
+        try:
+            mtimes.append(os.stat(os.path.join(root, subdir)).st_mtime_ns)
+        except FileNotFoundError:
+            mtimes.append(None)
+    mtimes = tuple(mtimes)
+
+    hit = _MEDIA_INDEX_CACHE.get(experiment)
+    if hit and hit[0] == mtimes:
+        return hit[1]
+
+    index = {}
+    for subdir, mtime in zip(_MEDIA_SUBDIRS, mtimes):
+        stems = []
+        if mtime is not None:
+            with os.scandir(os.path.join(root, subdir)) as it:
+                stems = sorted(os.path.splitext(e.name)[0] for e in it if e.is_file())
+        index[subdir] = stems
+    _MEDIA_INDEX_CACHE[experiment] = (mtimes, index)
+    return index
+
+
+def _read_range(path, start, length):
+    # the file is opened on the first block, so a body that is never iterated leaks nothing
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            block = f.read(min(_MEDIA_BLOCKSIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+def _send_media(path):
+    """
+    Serve a media file with a strong ETag, Last-Modified and Cache-Control,
+    answering conditional requests with 304 and single byte ranges with 206.
+    The body is handed to the server's wsgi.file_wrapper when it has one, which
+    (e.g. under gunicorn) sends the range with zero-copy sendfile
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = f"{size:x}-{stat.st_mtime_ns:x}"
+    last_modified = datetime.datetime.fromtimestamp(int(stat.st_mtime), datetime.timezone.utc)
+
+    resp = Response(mimetype=mimetypes.guess_type(path)[0] or "application/octet-stream")
+    resp.set_etag(etag)
+    resp.last_modified = last_modified
+    resp.headers["Cache-Control"] = f"public, max-age={PE_MEDIA_MAX_AGE}, immutable"
+    resp.accept_ranges = "bytes"
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        resp.status_code = 304
+        return resp
+
+    start, stop = 0, size
+    rng = request.range
+    if_range = request.if_range
+    if_range_ok = (
+        (if_range.etag is None and if_range.date is None)
+        or if_range.etag == etag
+        # an If-Range date matches only if it is the Last-Modified sent (RFC 9110 13.1.5), to the second
+        or (if_range.date is not None and if_range.date.replace(microsecond=0) == last_modified)
+    )
+    # multi-range requests get the whole file, which is allowed and rare for media
+    if rng is not None and if_range_ok and len(rng.ranges) == 1:
+        bounds = rng.range_for_length(size)
+        if bounds is None:
+            resp.status_code = 416
+            resp.headers["Content-Range"] = f"bytes */{size}"
+            return resp
+        start, stop = bounds
+        resp.status_code = 206
+        resp.content_range = ContentRange("bytes", start, stop, size)
+
+    length = stop - start
+    resp.content_length = length
+    resp.direct_passthrough = True
+    if request.method == "HEAD":
+        resp.response = []
+        return resp
+    file_wrapper = request.environ.get("wsgi.file_wrapper")
+    if file_wrapper is not None:
+        # servers honour Content-Length (and the current file offset) with their wrapper,
+        # and close it (and so the file) when the response ends, sent or not
+        f = open(path, "rb")
+        f.seek(start)
+        resp.response = file_wrapper(f, _MEDIA_BLOCKSIZE)
+    else:
+        resp.response = _read_range(path, start, length)
+    return resp
+
+
 _VERDICTS = ("pe", "feed", "groom", "walk", "other", "merge", "unsure")
 
 
+PE_DB_POOL_SIZE = int(os.environ.get("PE_DB_POOL_SIZE", 4))
+_pool = []           # idle connections to _pool_path
+_pool_path = None
+_pool_lock = threading.Lock()
+
+
+def _connect():
+    # handed from thread to thread by the pool, never used by two at once
+    c = sqlite3.connect(PE_DB, timeout=30, check_same_thread=False)
+    c.row_factory = sqlite3.Row
+    c.execute("PRAGMA journal_mode=WAL")
+    # durable across application crashes; a power loss can only drop the last commits
+    c.execute("PRAGMA synchronous=NORMAL")
+    c.execute("PRAGMA busy_timeout=30000")
+    return c
+
+
+@contextlib.contextmanager
+def _db():
+    """
+    A connection to PE_DB in WAL mode (readers never block the writer and vice versa),
+    inside a transaction committed when the block ends. At most PE_DB_POOL_SIZE idle
+    connections are kept open for the next requests, the rest are closed
+    """
+    global _pool_path
+    with _pool_lock:
+        if _pool_path != PE_DB:
+            for idle in _pool:
+                idle.close()
+            _pool.clear()
+            _pool_path = PE_DB
+        path = _pool_path
+        c = _pool.pop() if _pool else None
+    if c is None:
+        c = _connect()
+    try:
+        with c:
+            yield c
+    except BaseException:
+        c.close()
+        raise
+    with _pool_lock:
+        if path == _pool_path and len(_pool) < PE_DB_POOL_SIZE:
+            _pool.append(c)
+            c = None
+    if c is not None:
+        c.close()
+
+
+def forget_pe_connections():
+    """Drop (without closing) the connections inherited from a parent process after a fork"""
+    global _pool, _pool_path, _pool_lock
+    _pool, _pool_path, _pool_lock = [], None, threading.Lock()
+
+
 def _init_db():
     verdict_list = ",".join(f"'{v}'" for v in _VERDICTS)
-    with sqlite3.connect(PE_DB) as c:
+    with _db() as c:
         c.execute(f"""
             CREATE TABLE IF NOT EXISTS pe_annotations (
                 experiment  TEXT    NOT NULL,
@@ -74,6 +445,290 @@ def _init_db():
                 reviewed_at TEXT    NOT NULL,
                 PRIMARY KEY (experiment, identity, start_frame, end_frame)
             )""")
+        # the per-fly verdict lookup of pe_bouts is served by the primary key
+        c.execute("DROP INDEX IF EXISTS pe_annotations_fly")
+        # incremental exports (?since=) with and without the experiment filter
+        c.execute("""
+            CREATE INDEX IF NOT EXISTS pe_annotations_reviewed
+            ON pe_annotations (experiment, reviewed_at)""")
+        c.execute("""
+            CREATE INDEX IF NOT EXISTS pe_annotations_reviewed_all
+            ON pe_annotations (reviewed_at)""")
+
+
+_UPSERT = """
+    INSERT INTO pe_annotations
+    (experiment, identity, start_frame, end_frame, burst_id, bout_uid,
+    verdict, pe_score, reviewer, reviewed_at)
+    VALUES (?,?,?,?,?,?,?,?,?,?)
+    ON CONFLICT(experiment, identity, start_frame, end_frame)
+    DO UPDATE SET verdict=excluded.verdict, pe_score=excluded.pe_score,
+                reviewer=excluded.reviewer, reviewed_at=excluded.reviewed_at
+"""
+_DELETE = ("DELETE FROM pe_annotations "
+           "WHERE experiment=? AND identity=? AND start_frame=? AND end_frame=?")
+_NEED = ("fly", "start_frame", "end_frame", "verdict")
+
+
+def _annotation_row(exp, d, reviewed_at):
+    """
+    Parameters of _UPSERT (or of _DELETE if the verdict is None) for one annotation.
+    Raises ValueError if the annotation is incomplete or the verdict is unknown
+    """
+    if not all(k in d for k in _NEED):
+        raise ValueError(f"need {_NEED}")
+    identity = int(d["fly"].rsplit("__", 1)[1])   # only the identity from fly
+    key = (exp, identity, int(d["start_frame"]), int(d["end_frame"]))   # ← exp, not flat
+    verdict = d["verdict"]
+    if verdict is None:
+        return None, key
+    if verdict not in _VERDICTS:
+        raise ValueError(f"verdict must be one of {_VERDICTS}")
+    return key + (d.get("burst_id"), d.get("bout_uid"), verdict, d.get("pe_score"),
+                  d.get("reviewer", "anon"), reviewed_at), None
+
+
+EXPORT_BATCH = int(os.environ.get("PE_EXPORT_BATCH", 5000))
+_EXPORT_COLUMNS = ("experiment", "identity", "start_frame", "end_frame", "burst_id", "bout_uid",
+                   "verdict", "pe_score", "reviewer", "reviewed_at")
+_EXPORT_MIMETYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def _export_batches(experiment=None, since=None):
+    """
+    Annotations sorted by reviewed_at, in lists of at most EXPORT_BATCH tuples.
+    Uses its own read-only connection so a slow client never holds a pooled one
+    """
+    where, params = [], []
+    if experiment is not None:
+        where.append("experiment=?")
+        params.append(experiment)
+    if since is not None:
+        where.append("reviewed_at>?")
+        params.append(since)
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+    # the generator can be resumed from a different thread for every chunk (e.g. asgi.py)
+    c = sqlite3.connect(f"file:{PE_DB}?mode=ro", uri=True, timeout=30, check_same_thread=False)
+    try:
+        cursor = c.execute(
+            f"SELECT {','.join(_EXPORT_COLUMNS)} FROM pe_annotations {where_sql} ORDER BY reviewed_at",
+            params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH)
+            if not rows:
+                break
+            yield rows
+    finally:
+        c.close()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands over what was written to it since the last take()"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        out = b"".join(self._chunks)
+        self._chunks = []
+        return out
+
+
+def _export_json(batches):
+    yield "["
+    first = True
+    for rows in batches:
+        body = ",".join(json.dumps(dict(zip(_EXPORT_COLUMNS, r))) for r in rows)
+        yield body if first else "," + body
+        first = False
+    yield "]"
+
+
+def _export_ndjson(batches):
+    for rows in batches:
+        yield "".join(json.dumps(dict(zip(_EXPORT_COLUMNS, r))) + "\n" for r in rows)
+
+
+def _export_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(_EXPORT_COLUMNS)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _export_parquet(batches):
+    import pyarrow.parquet as pq
+    schema = pa.schema([
+        ("experiment", pa.string()), ("identity", pa.int64()),
+        ("start_frame", pa.int64()), ("end_frame", pa.int64()),
+        ("burst_id", pa.int64()), ("bout_uid", pa.float64()),
+        ("verdict", pa.string()), ("pe_score", pa.float64()),
+        ("reviewer", pa.string()), ("reviewed_at", pa.string()),
+    ])
+    sink = _ChunkSink()
+    # one row group per batch, flushed to the client as soon as it is written
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for rows in batches:
+            columns = [[r[i] for r in rows] for i in range(len(_EXPORT_COLUMNS))]
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(col, type=field.type) for col, field in zip(columns, schema)], schema=schema))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+_EXPORTERS = {
+    "json": _export_json,
+    "ndjson": _export_ndjson,
+    "csv": _export_csv,
+    "parquet": _export_parquet,
+}
+
+
+PE_SUMMARY_WORKERS = int(os.environ.get("PE_SUMMARY_WORKERS", os.cpu_count() or 1))
+_SCORE_BINS = np.linspace(0, 1, 11)
+_SUMMARY_CACHE = {}   # experiment -> (key of feather mtimes and annotation state, summary)
+_summary_pool = None
+_summary_lock = threading.Lock()
+
+
+def _bouts_feather(fly):
+    experiment = fly.split("__")[0]
+    pe_bouts_dir = f"{get_basedir(experiment)}/flyhostel/proboscis_extensions/pe_bouts"
+    return os.path.join(pe_bouts_dir, f"{fly}_pe_bouts.feather")
+
+
+def _summarise_bouts(feather):
+    """
+    Bout counts and pe_score distribution of one _pe_bouts.feather.
+    Runs in the worker processes of /api/pe/summary
+    """
+    table = pa_feather.read_table(feather, columns=["label", "pe_score"], memory_map=True)
+    label = table.column("label").to_numpy(zero_copy_only=False).astype(str)
+    score = table.column("pe_score").to_numpy(zero_copy_only=False).astype(np.float64)
+    score = score[~np.isnan(score)]
+
+    labels, counts = np.unique(label, return_counts=True)
+    if score.size:
+        quantiles = np.quantile(score, [0, .25, .5, .75, 1]).round(4).tolist()
+    else:
+        quantiles = [None] * 5
+    histogram, _ = np.histogram(np.clip(score, 0, 1), bins=_SCORE_BINS)
+    return {
+        "total_bouts": int(len(label)),
+        "pe_bouts": int((label == "pe").sum()),
+        "labels": {str(k): int(v) for k, v in zip(labels, counts)},
+        "score_quantiles": dict(zip(("min", "q25", "median", "q75", "max"), quantiles)),
+        "score_histogram": histogram.tolist(),
+    }
+
+
+def _get_summary_pool():
+    global _summary_pool
+    with _summary_lock:
+        if _summary_pool is None:
+            # spawn, not fork: the server process is multi-threaded
+            _summary_pool = ProcessPoolExecutor(
+                max_workers=PE_SUMMARY_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _summary_pool
+
+
+def _annotations_state(c, experiment):
+    """Changes whenever a verdict of the experiment is added, updated or deleted"""
+    return tuple(c.execute(
+        "SELECT COUNT(*), MAX(reviewed_at) FROM pe_annotations WHERE experiment=?",
+        (experiment,)).fetchone())
+
+
+def _pe_summary(experiment, flies):
+    """
+    Bout counts, score distributions and verdict counts of every fly of the experiment.
+    The feathers are read in a process pool and the verdicts counted with one grouped query
+    """
+    feathers = {fly: _bouts_feather(fly) for fly in flies}
+    mtimes = tuple(
+        (fly, os.path.getmtime(f) if os.path.exists(f) else None) for fly, f in feathers.items())
+
+    with _db() as c:
+        key = (mtimes, _annotations_state(c, experiment))
+        hit = _SUMMARY_CACHE.get(experiment)
+        if hit and hit[0] == key:
+            return hit[1]
+        reviewed = {}
+        for r in c.execute(
+                "SELECT identity, verdict, COUNT(*) AS n FROM pe_annotations "
+                "WHERE experiment=? GROUP BY identity, verdict", (experiment,)):
+            reviewed.setdefault(r["identity"], {})[r["verdict"]] = r["n"]
+
+    available = [fly for fly, mtime in mtimes if mtime is not None]
+    summaries = dict(zip(available, _get_summary_pool().map(
+        _summarise_bouts, [feathers[fly] for fly in available])))
+
+    out = []
+    for fly in flies:
+        identity = int(fly.rsplit("__", 1)[1])
+        row = {"fly": fly, "identity": identity, "has_bouts": fly in summaries}
+        row.update(summaries.get(fly, {"total_bouts": 0, "pe_bouts": 0, "labels": {}}))
+        row["reviewed"] = reviewed.get(identity, {})
+        row["reviewed_total"] = sum(row["reviewed"].values())
+        out.append(row)
+
+    summary = {
+        "experiment": experiment,
+        "score_bins": _SCORE_BINS.round(4).tolist(),
+        "flies": out,
+        "totals": {
+            "total_bouts": sum(r["total_bouts"] for r in out),
+            "pe_bouts": sum(r["pe_bouts"] for r in out),
+            "reviewed_total": sum(r["reviewed_total"] for r in out),
+        },
+    }
+    _SUMMARY_CACHE[experiment] = (key, summary)
+    return summary
+
+
+def pe_warm_up_tasks(experiment):
+    """
+    Callables reading the PE bout tables of every fly of experiment,
+    the audit csv and the media index into their caches (see the cache warm-up in app.py)
+    """
+    flat = experiment.replace("/", "_")
+    chunksize = get_chunksize(flat)
+    tasks = []
+    for identity in get_identities(flat):
+        fly = _fly_id(experiment, identity)
+        feather = _bouts_feather(fly)
+        if os.path.exists(feather):
+            tasks.append(lambda feather=feather, fly=fly: _load_bouts_cached(feather, fly, chunksize))
+    if os.path.exists(AUDIT_CSV):
+        tasks.append(lambda: _load_audit_cached(AUDIT_CSV))
+    tasks.append(lambda: _media_index(experiment))
+    return tasks
 
 
 def _fly_id(experiment, identity):
@@ -98,7 +753,9 @@ def register_pe_validation(app, get_selected_experiment):
     @app.route("/api/pe/bouts", methods=["GET"])
     def pe_bouts():
         """PE-labelled bouts for a fly, joined with any existing verdict.
-        Query: ?identity=1  (experiment comes from the loaded session)."""
+        Query: ?fly=<fly>&offset=0&limit=200 plus the filters of _bout_filters
+        (experiment comes from the loaded session). The number of bouts matching
+        the filters, before paging, is returned in the X-Total-Count header."""
         exp, err = _experiment_or_400()
         if err:
             return err
@@ -107,26 +764,23 @@ def register_pe_validation(app, get_selected_experiment):
 
         experiment, identity = fly.split("__")
         identity = int(identity)
-
-        basedir=get_basedir(experiment)
-        pe_bouts_dir=f"{basedir}/flyhostel/proboscis_extensions/pe_bouts"
+        try:
+            filters = _bout_filters(request.args)
+        except ValueError as error:
+            return jsonify({"error": str(error)}), 400
 
         chunksize=get_chunksize(exp.replace("/", "_"))
-        feather = os.path.join(pe_bouts_dir, f"{fly}_pe_bouts.feather")
+        feather = _bouts_feather(fly)
         if not os.path.exists(feather):
             return jsonify({"error": f"no bouts feather for {fly}"}), 404
 
-        df = pd.read_feather(feather)
-        # bursts that contain at least one PE bout
-        # pe_bursts = set(df.loc[df["label"] == "pe", "burst_id"].unique())
-        # df = df[df["burst_id"].isin(pe_bursts)].copy()
-
-        # low score first among the PE ones; keep burst grouping intact
-        df = df.sort_values(["burst_id", "start_fn"])
-
-        df["start_fidx"] = df["start_fn"] % chunksize
-        df["end_fidx"]   = df["end_fn"]   % chunksize
-        df["is_pe"]      = (df["label"] == "pe")          # annotatable vs display-only
+        df = _filter_bouts(_load_bouts_cached(feather, fly, chunksize), filters)
+        total = len(df)
+        offset = request.args.get("offset", 0, type=int)
+        limit = request.args.get("limit", type=int)
+        if offset < 0 or (limit is not None and limit < 0):
+            return jsonify({"error": "offset and limit must not be negative"}), 400
+        df = df.iloc[offset:None if limit is None else offset + limit]
 
         cols = [c for c in ("burst_id", "bout_uid", "start_fn", "end_fn",
                             "start_fidx", "end_fidx", "n_in_burst", "is_solitary",
@@ -135,8 +789,7 @@ def register_pe_validation(app, get_selected_experiment):
         bouts = df[cols].to_dict("records")
 
         # attach existing verdicts
-        with sqlite3.connect(PE_DB) as c:
-            c.row_factory = sqlite3.Row
+        with _db() as c:
             seen = {(r["start_frame"], r["end_frame"]): r["verdict"]
                     for r in c.execute(
                         "SELECT start_frame,end_frame,verdict FROM pe_annotations "
@@ -148,7 +801,21 @@ def register_pe_validation(app, get_selected_experiment):
             b["verdict"] = seen.get((int(b["start_fn"]), int(b["end_fn"])))
             b["trace_stem"] = f"{fly}_burst_{int(b['burst_id'])}"                       # -> plots/{...}.png
             b["media_stem"] = f"{fly}_burst_{int(b['burst_id'])}_bout_{int(b['bout_uid'])}"
-        return jsonify(bouts)
+        response = jsonify(bouts)
+        response.headers["X-Total-Count"] = str(total)
+        response.headers["Access-Control-Expose-Headers"] = "X-Total-Count"
+        return response
+
+    @app.route("/api/pe/summary", methods=["GET"])
+    def pe_summary():
+        """Review progress of every fly of the loaded experiment: total and PE-labelled
+        bouts, pe_score distribution and number of verdicts of each kind."""
+        exp, err = _experiment_or_400()
+        if err:
+            return err
+        flat = exp.replace("/", "_")
+        flies = [_fly_id(exp, identity) for identity in get_identities(flat)]
+        return jsonify(_pe_summary(exp, flies))
 
     @app.route("/api/pe/annotate", methods=["POST"])
     def pe_annotate():
@@ -156,69 +823,105 @@ def register_pe_validation(app, get_selected_experiment):
         if err:
             return err
         d = request.get_json(force=True)
-        need = ("fly", "start_frame", "end_frame", "verdict")
-        if not all(k in d for k in need):
-            return jsonify({"error": f"need {need}"}), 400
-        
-        verdict=d["verdict"]
-        identity = int(d["fly"].rsplit("__", 1)[1])   # only the identity from fly
-
-        if verdict is None:
-            with sqlite3.connect(PE_DB) as c:
-                c.execute(
-                    "DELETE FROM pe_annotations "
-                    "WHERE experiment=? AND identity=? AND start_frame=? AND end_frame=?",
-                    (exp, identity, int(d["start_frame"]), int(d["end_frame"])))
-            return jsonify({"ok": True, "deleted": True})
-    
-        if verdict not in _VERDICTS:
-            return jsonify({"error": f"verdict must be one of {_VERDICTS}"}), 400
-
-        with sqlite3.connect(PE_DB) as c:
-            c.execute("""
-                INSERT INTO pe_annotations
-                (experiment, identity, start_frame, end_frame, burst_id, bout_uid,
-                verdict, pe_score, reviewer, reviewed_at)
-                VALUES (?,?,?,?,?,?,?,?,?,?)
-                ON CONFLICT(experiment, identity, start_frame, end_frame)
-                DO UPDATE SET verdict=excluded.verdict, pe_score=excluded.pe_score,
-                            reviewer=excluded.reviewer, reviewed_at=excluded.reviewed_at
-            """, (exp, identity, int(d["start_frame"]), int(d["end_frame"]),   # ← exp, not flat
-                d.get("burst_id"), d.get("bout_uid"), verdict, d.get("pe_score"),
-                d.get("reviewer", "anon"), datetime.datetime.utcnow().isoformat()))
+        try:
+            row, deleted = _annotation_row(exp, d, datetime.datetime.utcnow().isoformat())
+        except (ValueError, TypeError, AttributeError, IndexError) as error:
+            return jsonify({"error": str(error)}), 400
+
+        with _db() as c:
+            if row is None:
+                c.execute(_DELETE, deleted)
+                return jsonify({"ok": True, "deleted": True})
+            c.execute(_UPSERT, row)
         return jsonify({"ok": True})
 
+    @app.route("/api/pe/annotate_batch", methods=["POST"])
+    def pe_annotate_batch():
+        """Upsert (or delete, with verdict null) many verdicts in one transaction.
+        Body: {"annotations": [{fly, start_frame, end_frame, verdict, ...}, ...]}
+        When a bout appears more than once the last annotation wins.
+        Nothing is written if any annotation is invalid."""
+        exp, err = _experiment_or_400()
+        if err:
+            return err
+        d = request.get_json(force=True)
+        annotations = d.get("annotations") if isinstance(d, dict) else None
+        if not isinstance(annotations, (list, tuple)):
+            return jsonify({"error": "need annotations"}), 400
+
+        reviewed_at = datetime.datetime.utcnow().isoformat()
+        # the last annotation of a bout wins, whether it sets or deletes the verdict
+        latest = {}
+        for i, a in enumerate(annotations):
+            try:
+                row, deleted = _annotation_row(exp, a, reviewed_at)
+            except (ValueError, TypeError, AttributeError, IndexError) as error:
+                return jsonify({"error": f"annotation {i}: {error}"}), 400
+            key = deleted if row is None else row[:4]
+            latest[key] = row
+        rows = [row for row in latest.values() if row is not None]
+        deletes = [key for key, row in latest.items() if row is None]
+
+        with _db() as c:
+            c.executemany(_DELETE, deletes)
+            c.executemany(_UPSERT, rows)
+        return jsonify({"ok": True, "upserted": len(rows), "deleted": len(deletes)})
+
     @app.route("/api/pe/media/<path:filename>", methods=["GET"])
     def pe_media(filename):
         exp, err = _experiment_or_400()
         if err:
             return err
-        resp = send_from_directory(os.path.realpath(_media_dir(exp)), filename)
+        path = safe_join(_media_root(exp), filename)
+        if path is None or not os.path.isfile(path):
+            return jsonify({"error": f"{filename} not found"}), 404
+        resp = _send_media(path)
         # explicit CORS so a cross-origin <video crossorigin> can taint-free-draw to canvas
         resp.headers["Access-Control-Allow-Origin"] = "*"
         resp.headers["Access-Control-Allow-Methods"] = "GET, HEAD, OPTIONS"
         resp.headers["Access-Control-Allow-Headers"] = "Range"
-        resp.headers["Access-Control-Expose-Headers"] = "Content-Range, Accept-Ranges, Content-Length"
+        resp.headers["Access-Control-Expose-Headers"] = "Content-Range, Accept-Ranges, Content-Length, ETag"
         return resp
 
-    @app.route("/api/pe/export", methods=["GET"])
-    def pe_export():
-        """All verdicts for the loaded experiment as JSON (for training / audit)."""
+    @app.route("/api/pe/media_index", methods=["GET"])
+    def pe_media_index():
+        """Stems of the burst videos and plots available for the loaded experiment,
+        as {"videos": [...], "plots": [...]}, so the client never probes missing files."""
         exp, err = _experiment_or_400()
         if err:
             return err
-        with sqlite3.connect(PE_DB) as c:
-            c.row_factory = sqlite3.Row
-            rows = [dict(r) for r in c.execute(
-                "SELECT * FROM pe_annotations WHERE experiment=?", (exp,))]
-        return jsonify(rows)
+        return jsonify(_media_index(exp))
+
+    @app.route("/api/pe/export", methods=["GET"])
+    def pe_export():
+        """All verdicts for the loaded experiment (for training / audit), streamed.
+        Query: ?format=json|ndjson|csv|parquet  (default json)
+               &since=<reviewed_at>  only verdicts reviewed after this timestamp
+               &all=1  verdicts of every experiment, not only the loaded one"""
+        fmt = request.args.get("format", "json")
+        if fmt not in _EXPORTERS:
+            return jsonify({"error": f"format must be one of {tuple(_EXPORTERS)}"}), 400
+
+        if request.args.get("all", "0") == "1":
+            exp = None
+            name = "all"
+        else:
+            exp, err = _experiment_or_400()
+            if err:
+                return err
+            name = exp.replace("/", "_")
+
+        batches = _export_batches(exp, request.args.get("since"))
+        resp = Response(_EXPORTERS[fmt](batches), mimetype=_EXPORT_MIMETYPES[fmt])
+        resp.headers["Content-Disposition"] = f"attachment; filename=pe_annotations_{name}.{fmt}"
+        return resp
 
 
     @app.route("/api/pe/trace", methods=["GET"])
     def pe_trace():
         """Per-frame trace + bout spans + inter-bout gaps for ONE burst.
-        Query: ?identity=1&burst_id=2639"""
-        import time; t0 = time.time()
+        Query: ?fly=<fly>&burst_id=2639  (add &format=columns for one list per column
+        instead of one dict per frame)"""
         exp, err = _experiment_or_400()
         if err:
             return err
@@ -233,52 +936,61 @@ def register_pe_validation(app, get_selected_experiment):
         traces_file = os.path.join(_media_dir(exp), f"{fly}_traces.feather")   # the extract_burst_traces output
         if not os.path.exists(traces_file):
             return jsonify({"error": f"no trace feather for {fly}"}), 404
-        d = _load_traces_cached(traces_file, fly)
-        d = d[d["burst_id"] == burst_id].sort_values("frame_number").copy()
+        with timed("pe_trace_read"):
+            d = _load_traces_cached(traces_file, fly).burst(burst_id)
 
-        if d.empty:
+        if d is None:
             return jsonify({"error": f"burst {burst_id} not in trace"}), 404
 
         # normalize like the R script: t from 0, dist from its min
-        f0 = int(d["frame_number"].min())
-        d["t_s"] = (d["frame_number"] - f0) / fps
-        dmin = d["dist_mm"].min(skipna=True)
-        d["dist_rel"] = d["dist_mm"] - dmin
+        f0 = int(d["frame_number"][0])
+        t_s = (d["frame_number"] - f0) / fps
+        dist = d["dist_mm"]
+        dist_rel = dist - np.nanmin(dist) if not np.isnan(dist).all() else dist
 
         # per-bout spans (duration) and inter-bout gaps, computed once here
-        spans = (d.dropna(subset=["bout_in_burst"])
-                .groupby("bout_in_burst")["t_s"].agg(["min", "max"])
-                .reset_index().sort_values("min"))
-        spans_out = [{"bout_in_burst": int(r["bout_in_burst"]),
-                    "t0": float(r["min"]), "t1": float(r["max"]),
-                    "dur": float(r["max"] - r["min"])} for _, r in spans.iterrows()]
-        gaps_out = []
-        for a, b in zip(spans_out[:-1], spans_out[1:]):
-            gaps_out.append({"g0": a["t1"], "g1": b["t0"], "gap": b["t0"] - a["t1"]})
-
-        return jsonify({
-            "fly": fly, "burst_id": burst_id, "fps": fps, "start_frame": f0,
-            "points": [{"t_s": round(float(t), 4),
-                    "dist": None if pd.isna(v) else round(float(v), 4),
-                    "conf": None if pd.isna(cf) else round(float(cf), 4),   # NEW
-                    "bout_uid": None if pd.isna(u) else int(u),
-                    "is_peak": bool(p)}
-                   for t, v, cf, u, p in zip(d["t_s"], d["dist_rel"],
-                                             d["prob_conf"], d["bout_uid"],  # NEW: prob_conf
-                                             d["is_peak"])],
-            "spans": spans_out, "gaps": gaps_out,
-        })
+        spans_out, gaps_out = _spans_and_gaps(t_s, d["bout_in_burst"])
+
+        columns = {
+            "t_s": np.round(t_s, 4).tolist(),
+            "dist": _nullable(dist_rel, 4),
+            "conf": _nullable(d["prob_conf"], 4),
+            "bout_uid": _nullable(d["bout_uid"], cast=int),
+            "is_peak": d["is_peak"].tolist(),
+        }
+        out = {"fly": fly, "burst_id": burst_id, "fps": fps, "start_frame": f0,
+               "spans": spans_out, "gaps": gaps_out}
+
+        if request.args.get("format") == "columns":
+            # a fraction of the size of the points for long bursts
+            out["columns"] = columns
+        else:
+            out["points"] = [dict(zip(columns, values)) for values in zip(*columns.values())]
+        with timed("json"):
+            return jsonify(out)
 
 
     @app.route("/api/pe/audit", methods=["GET"])
     def pe_audit():
+        """burst_ids of the fly listed in AUDIT_CSV. Query: ?fly=<fly>"""
         exp, err = _experiment_or_400()
         if err:
             return err
         fly = request.args["fly"]
         if not os.path.exists(AUDIT_CSV):
             return jsonify([])
-        logger.info("Reading %s", AUDIT_CSV)
-        a = pd.read_csv(AUDIT_CSV)
-        a = a[a["fly"] == fly]
-        return jsonify([int(b) for b in a["burst_id"]])
+        audit = _load_audit_cached(AUDIT_CSV)
+        return jsonify(audit.get(fly, np.array([], dtype=np.int64)).tolist())
+
+    @app.route("/api/pe/audit_all", methods=["GET"])
+    def pe_audit_all():
+        """burst_ids listed in AUDIT_CSV for every fly of the loaded experiment, as {fly: [...]}"""
+        exp, err = _experiment_or_400()
+        if err:
+            return err
+        if not os.path.exists(AUDIT_CSV):
+            return jsonify({})
+        prefix = exp.replace("/", "_") + "__"
+        audit = _load_audit_cached(AUDIT_CSV)
+        return jsonify({fly: bursts.tolist() for fly, bursts in audit.items()
+                        if str(fly).startswith(prefix)})
@@ -0,0 +1,51 @@
+"""
+Serve the validator with several worker processes (gunicorn)
+
+Every worker keeps its own experiment state (database engine, VideoCapture,
+pose handles). The experiment selected with /api/load is published to the other
+workers through a small selection file, and frames are shared between workers
+through frame_cache.SharedFrameCache.
+
+gunicorn is an optional dependency: pip install .[production]
+"""
+import os
+import logging
+
+logger=logging.getLogger(__name__)
+
+VALIDATOR_WORKERS=int(os.environ.get("VALIDATOR_WORKERS", os.cpu_count() or 1))
+VALIDATOR_THREADS=int(os.environ.get("VALIDATOR_THREADS", 4))
+
+
+def run(app, host, port, workers=VALIDATOR_WORKERS, threads=VALIDATOR_THREADS, post_fork=None):
+    """
+    Run app under gunicorn with workers processes of threads threads each
+
+    Arguments:
+
+        post_fork (callable): optional, called in every worker right after it is forked
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError as error:
+        raise ImportError(
+            "Multi-worker mode needs gunicorn. Install it with pip install .[production]"
+        ) from error
+
+    class ValidatorApplication(BaseApplication):
+
+        def load_config(self):
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", threads)
+            self.cfg.set("worker_class", "gthread")
+            # decoding a frame on slow storage can take a while
+            self.cfg.set("timeout", 120)
+            if post_fork is not None:
+                self.cfg.set("post_fork", lambda server, worker: post_fork())
+
+        def load(self):
+            return app
+
+    logger.info("Serving on %s:%s with %s workers x %s threads", host, port, workers, threads)
+    ValidatorApplication().run()
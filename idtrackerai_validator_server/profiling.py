@@ -0,0 +1,192 @@
+"""
+On-demand profiling of API requests, enabled with VALIDATOR_PROFILING=1
+
+* ?profile=1 on any route: the request runs under cProfile and the profile is
+  saved in PROFILES_DIR as <time>_<endpoint>_<frame>_<experiment>.prof (the path
+  is returned in the X-Profile header, the response is unchanged)
+* ?profile=text: the pstats report is returned instead of the response
+  (&sort=cumulative|tottime|..., &limit=40, at most REPORT_MAX_LINES)
+* POST /api/profile {"route": "/api/tracking/<int:frame_number>", "count": N}
+  profiles the next N requests to route into a single .prof;
+  GET /api/profile lists the routes being profiled and the saved profiles
+
+Open the .prof files with python -m pstats or snakeviz. Profiled requests run one
+at a time (cProfile profiles a single thread and, from python 3.12, a single
+profiler can be active), the others are not affected. Only the view is profiled,
+the body of a streamed response is produced after it.
+"""
+import io
+import os
+import re
+import time
+import pstats
+import cProfile
+import logging
+import threading
+
+logger=logging.getLogger(__name__)
+
+VALIDATOR_PROFILING=os.environ.get("VALIDATOR_PROFILING", "0").lower() in ("1", "true", "yes")
+PROFILES_DIR=os.environ.get("PROFILES_DIR", "profiles")
+REPORT_MAX_LINES=1000
+# profiles saved by the aggregate mode that GET /api/profile remembers
+MAX_RECENT_PROFILES=50
+
+_profile_lock=threading.Lock()
+_state_lock=threading.Lock()
+_armed={}     # route -> {"count": N, "remaining": not started yet, "done": finished, "stats": pstats.Stats}
+_recent=[]    # paths of the last saved profiles
+
+
+def _slug(value):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "-", str(value)).strip("-")
+
+
+def profile_filename(endpoint, experiment=None, frame_number=None, burst_id=None, prefix=None):
+    """<time>[_prefix]_<endpoint>[_f<frame>][_b<burst>][_<experiment>].prof"""
+    parts=[time.strftime("%Y%m%d-%H%M%S")]
+    if prefix:
+        parts.append(prefix)
+    parts.append(_slug(endpoint))
+    if frame_number is not None:
+        parts.append(f"f{frame_number}")
+    if burst_id is not None:
+        parts.append(f"b{_slug(burst_id)}")
+    if experiment:
+        parts.append(_slug(experiment.replace("/", "_")))
+    return "_".join(parts) + ".prof"
+
+
+def _save(stats, filename):
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    path=os.path.join(PROFILES_DIR, filename)
+    stats.dump_stats(path)
+    with _state_lock:
+        _recent.append(path)
+        del _recent[:-MAX_RECENT_PROFILES]
+    logger.info("Saved profile %s", path)
+    return path
+
+
+def report(stats, sort="cumulative", limit=40):
+    """pstats report of stats as text"""
+    stream=io.StringIO()
+    pstats.Stats(stats, stream=stream).sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+
+def init_app(app, get_selected_experiment):
+    """Register the profiling hooks and /api/profile, if VALIDATOR_PROFILING is set"""
+    if not VALIDATOR_PROFILING:
+        return
+
+    from flask import Response, g, jsonify, request
+
+    logger.warning("Request profiling is enabled (VALIDATOR_PROFILING), profiles go to %s", PROFILES_DIR)
+
+    def _armed_route():
+        if request.url_rule is None:
+            return None
+        with _state_lock:
+            entry=_armed.get(request.url_rule.rule)
+            if entry is None or entry["remaining"] <= 0:
+                return None
+            entry["remaining"]-=1
+        return request.url_rule.rule
+
+    @app.before_request
+    def _start_profile():
+        mode=request.args.get("profile")
+        armed=_armed_route()
+        if not mode and armed is None:
+            return
+        _profile_lock.acquire()
+        g.profile=(cProfile.Profile(), mode, armed)
+        g.profile[0].enable()
+
+    def _stop_profile():
+        profile=g.pop("profile", None)
+        if profile is None:
+            return None
+        profile[0].disable()
+        _profile_lock.release()
+        return profile
+
+    @app.after_request
+    def _finish_profile(response):
+        profile=_stop_profile()
+        if profile is None:
+            return response
+        profiler, mode, armed=profile
+        experiment=get_selected_experiment()
+        view_args=request.view_args or {}
+
+        if armed is not None:
+            _accumulate(armed, profiler, request.endpoint, experiment)
+
+        if mode=="text":
+            sort=request.args.get("sort", "cumulative")
+            if sort not in pstats.Stats.sort_arg_dict_default:
+                return Response(f"Unknown sort {sort}", status=400, mimetype="text/plain")
+            limit=min(max(request.args.get("limit", 40, type=int), 1), REPORT_MAX_LINES)
+            return Response(report(profiler, sort=sort, limit=limit), mimetype="text/plain")
+        if mode:
+            path=_save(profiler, profile_filename(
+                request.endpoint, experiment,
+                frame_number=view_args.get("frame_number"),
+                burst_id=request.args.get("burst_id"),
+            ))
+            response.headers["X-Profile"]=path
+        return response
+
+    @app.teardown_request
+    def _abort_profile(error=None):
+        # the view raised, after_request did not run
+        profile=_stop_profile()
+        if profile is not None and profile[2] is not None:
+            _accumulate(profile[2], profile[0], request.endpoint, get_selected_experiment())
+
+    @app.route("/api/profile", methods=["GET", "POST"])
+    def profile_routes():
+        """
+        POST {"route": <url rule>, "count": N}: profile the next N requests to route.
+        GET: the routes being profiled and the last saved profiles
+        """
+        if request.method=="POST":
+            body=request.get_json(force=True) or {}
+            route=body.get("route")
+            count=int(body.get("count", 10))
+            rules={rule.rule for rule in app.url_map.iter_rules()}
+            if route not in rules:
+                return jsonify({"error": f"Unknown route {route}", "routes": sorted(rules)}), 400
+            if count <= 0:
+                return jsonify({"error": "count must be positive"}), 400
+            with _state_lock:
+                _armed[route]={"count": count, "remaining": count, "done": 0, "stats": None}
+            return jsonify({"route": route, "count": count}), 202
+
+        with _state_lock:
+            armed={
+                route: {"count": entry["count"], "done": entry["done"]}
+                for route, entry in _armed.items()
+            }
+            recent=_recent[::-1]
+        return jsonify({"armed": armed, "profiles": recent})
+
+
+def _accumulate(route, profiler, endpoint, experiment):
+    """Add a profiled request to the aggregate of route, saved once all its requests are in"""
+    with _state_lock:
+        entry=_armed.get(route)
+        if entry is None:
+            return
+        if entry["stats"] is None:
+            entry["stats"]=pstats.Stats(profiler)
+        else:
+            entry["stats"].add(profiler)
+        entry["done"]+=1
+        if entry["done"] < entry["count"]:
+            return
+        del _armed[route]
+
+    _save(entry["stats"], profile_filename(endpoint, experiment, prefix=f"aggregate{entry['count']}"))
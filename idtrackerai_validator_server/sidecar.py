@@ -0,0 +1,501 @@
+"""
+Columnar sidecar of the tracking database of an experiment
+
+    idtrackerai-validator-server build-cache FlyHostel1_6X_2023-01-01_10-00-00
+
+exports ROI_0, IDENTITY, CONCATENATION (plain and _VAL), STORE_INDEX and AI to
+<experiment>.sidecar/ next to the .db, one uncompressed Arrow IPC file per table and chunk
+(<TABLE>/<chunk>.arrow, rows sorted by frame_number). The files are memory-mapped when
+read, so the workers of a server share their pages through the OS cache.
+
+manifest.json remembers the mtime and size of the .db (and of its -wal) the sidecar was built from: the
+server reads from the sidecar only while the .db is unchanged, and falls back to SQL
+otherwise (set VALIDATOR_SIDECAR=0 to never use it). The corrections made through the
+server (see corrections.py) export again only the chunks they changed with update_sidecar,
+which bumps their revision in the manifest so every Sidecar drops its copy of them.
+"""
+import os
+import json
+import time
+import shutil
+import sqlite3
+import logging
+import datetime
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from idtrackerai_validator_server import metrics
+from idtrackerai_validator_server.startup import lazy_import
+
+pa = lazy_import("pyarrow")
+
+logger=logging.getLogger(__name__)
+
+VALIDATOR_SIDECAR=os.environ.get("VALIDATOR_SIDECAR", "1").lower() not in ("0", "false", "no")
+# chunk tables a Sidecar keeps decoded (memory-mapped, so they cost address space, not memory)
+SIDECAR_MAX_CHUNKS=int(os.environ.get("SIDECAR_MAX_CHUNKS", 256))
+# seconds between the checks of manifest.json and that the .db is still the one the sidecar was built from
+SIDECAR_CHECK_INTERVAL=float(os.environ.get("SIDECAR_CHECK_INTERVAL", 1.0))
+SIDECAR_VERSION=1
+
+# table -> column the table is partitioned by
+SIDECAR_TABLES={
+    "ROI_0": "frame_number",
+    "ROI_0_VAL": "frame_number",
+    "IDENTITY": "frame_number",
+    "IDENTITY_VAL": "frame_number",
+    "CONCATENATION": "chunk",
+    "CONCATENATION_VAL": "chunk",
+    "STORE_INDEX": "frame_number",
+    "AI": "frame_number",
+}
+_FETCH_ROWS=100000
+
+
+def sidecar_dir(dbfile):
+    return os.path.splitext(dbfile)[0] + ".sidecar"
+
+
+def db_signature(dbfile):
+    stat=os.stat(dbfile)
+    signature={"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "wal": None}
+    # commits of a database in WAL mode land in the -wal until a checkpoint,
+    # an empty -wal (created by every connection that opens it) holds none
+    try:
+        wal=os.stat(dbfile+"-wal")
+    except FileNotFoundError:
+        wal=None
+    if wal is not None and wal.st_size:
+        signature["wal"]={"mtime_ns": wal.st_mtime_ns, "size": wal.st_size}
+    return signature
+
+
+def _arrow_type(declared):
+    """Arrow type of a column from its declared sqlite type (sqlite affinity rules)"""
+    declared=(declared or "").upper()
+    if "INT" in declared:
+        return pa.int64()
+    if any(token in declared for token in ("CHAR", "CLOB", "TEXT")):
+        return pa.string()
+    if any(token in declared for token in ("REAL", "FLOA", "DOUB")):
+        return pa.float64()
+    return pa.string()
+
+
+def _write_table(path, schema, rows):
+    columns=list(zip(*rows))
+    table=pa.table(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+        schema=schema
+    )
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            writer.write_table(table)
+
+
+def _chunk_rows(conn, table, key, chunksize, chunk):
+    """Rows of table in chunk, as _export_table writes them"""
+    if key=="chunk":
+        return conn.execute(f"SELECT * FROM {table} WHERE chunk = ? ORDER BY chunk, rowid", (chunk, )).fetchall()
+    return conn.execute(
+        f"SELECT * FROM {table} WHERE {key} BETWEEN ? AND ? ORDER BY {key}, rowid",
+        (chunk*chunksize, (chunk+1)*chunksize-1)
+    ).fetchall()
+
+
+def _export_table(conn, table, key, chunksize, folder):
+    """Write table into folder, one file per chunk. Returns its entry of the manifest"""
+    info=conn.execute(f"PRAGMA table_info({table})").fetchall()
+    names=[row[1] for row in info]
+    schema=pa.schema([(row[1], _arrow_type(row[2])) for row in info])
+    key_index=names.index(key)
+    os.makedirs(folder)
+
+    cursor=conn.execute(f"SELECT * FROM {table} ORDER BY {key}, rowid")
+    chunks={}
+    rows=[]
+    current=None
+    while True:
+        batch=cursor.fetchmany(_FETCH_ROWS)
+        for row in batch:
+            chunk=row[key_index] if key=="chunk" else row[key_index]//chunksize
+            if chunk!=current:
+                if rows:
+                    _write_table(os.path.join(folder, f"{current}.arrow"), schema, rows)
+                    chunks[current]=len(rows)
+                rows=[]
+                current=chunk
+            rows.append(row)
+        if not batch:
+            break
+    if rows:
+        _write_table(os.path.join(folder, f"{current}.arrow"), schema, rows)
+        chunks[current]=len(rows)
+
+    entry={"key": key, "columns": names, "chunks": {str(chunk): n for chunk, n in chunks.items()}}
+    if key=="frame_number" and chunks:
+        entry["min"], entry["max"]=conn.execute(f"SELECT MIN({key}), MAX({key}) FROM {table}").fetchone()
+    return entry
+
+
+def build_sidecar(dbfile, force=False):
+    """
+    Export the tables of dbfile to its sidecar (see the module docstring).
+    Does nothing if the sidecar is already up to date, unless force
+
+    Returns:
+        folder (str): the sidecar folder
+    """
+    folder=sidecar_dir(dbfile)
+    signature=db_signature(dbfile)
+    if not force and _read_manifest(folder, signature) is not None:
+        logger.info("%s is up to date", folder)
+        return folder
+
+    t0=time.perf_counter()
+    tmp=f"{folder}.tmp-{os.getpid()}"
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    with sqlite3.connect(f"file:{dbfile}?mode=ro", uri=True) as conn:
+        present={row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        chunksize=int(float(conn.execute("SELECT value FROM METADATA WHERE field='chunksize'").fetchone()[0]))
+        tables={}
+        for table, key in SIDECAR_TABLES.items():
+            if table not in present:
+                continue
+            logger.info("Exporting %s", table)
+            tables[table]=_export_table(conn, table, key, chunksize, os.path.join(tmp, table))
+
+    manifest={
+        "version": SIDECAR_VERSION,
+        "dbfile": os.path.basename(dbfile),
+        "db": signature,
+        "chunksize": chunksize,
+        "built_at": datetime.datetime.now().isoformat(),
+        "tables": tables,
+    }
+    with open(os.path.join(tmp, "manifest.json"), "w") as filehandle:
+        json.dump(manifest, filehandle, indent=2)
+
+    if os.path.exists(folder):
+        shutil.rmtree(folder)
+    os.replace(tmp, folder)
+    logger.info("Built %s in %.1f s", folder, time.perf_counter()-t0)
+    return folder
+
+
+def _write_manifest(folder, manifest):
+    tmp=os.path.join(folder, f"manifest.json.tmp-{os.getpid()}")
+    with open(tmp, "w") as filehandle:
+        json.dump(manifest, filehandle, indent=2)
+    os.replace(tmp, os.path.join(folder, "manifest.json"))
+
+
+def update_sidecar(dbfile, signature, tables, chunks):
+    """
+    Export again the chunks of tables after the .db was changed by the server.
+    Only if the sidecar was up to date with the .db before the change (its signature then)
+
+    Returns:
+        updated (bool): False if the sidecar was missing or older than the .db
+    """
+    folder=sidecar_dir(dbfile)
+    manifest=_read_manifest(folder, signature)
+    if manifest is None:
+        return False
+    t0=time.perf_counter()
+    chunksize=manifest["chunksize"]
+    with sqlite3.connect(f"file:{dbfile}?mode=ro", uri=True) as conn:
+        for table in tables:
+            entry=manifest["tables"].get(table)
+            if entry is None:
+                continue
+            info=conn.execute(f"PRAGMA table_info({table})").fetchall()
+            schema=pa.schema([(row[1], _arrow_type(row[2])) for row in info])
+            revisions=entry.setdefault("revisions", {})
+            for chunk in chunks:
+                rows=_chunk_rows(conn, table, entry["key"], chunksize, chunk)
+                path=os.path.join(folder, table, f"{chunk}.arrow")
+                if rows:
+                    tmp=f"{path}.tmp-{os.getpid()}"
+                    _write_table(tmp, schema, rows)
+                    # readers keep the pages of the previous file mapped until they drop it
+                    os.replace(tmp, path)
+                    entry["chunks"][str(chunk)]=len(rows)
+                elif str(chunk) in entry["chunks"]:
+                    os.remove(path)
+                    del entry["chunks"][str(chunk)]
+                revisions[str(chunk)]=revisions.get(str(chunk), 0)+1
+    manifest["db"]=db_signature(dbfile)
+    _write_manifest(folder, manifest)
+    logger.info("Updated %s chunks of %s in %.3f s", len(chunks), folder, time.perf_counter()-t0)
+    return True
+
+
+def _read_manifest(folder, signature):
+    """The manifest of the sidecar in folder, if it was built from the .db with signature"""
+    try:
+        with open(os.path.join(folder, "manifest.json")) as filehandle:
+            manifest=json.load(filehandle)
+    except (FileNotFoundError, ValueError):
+        return None
+    if manifest.get("version")!=SIDECAR_VERSION or manifest.get("db")!=signature:
+        return None
+    return manifest
+
+
+def open_sidecar(dbfile, use_val=""):
+    """
+    Sidecar of dbfile, or None if serving from it is disabled, it was not built
+    or the .db changed since it was built
+    """
+    if not VALIDATOR_SIDECAR:
+        return None
+    folder=sidecar_dir(dbfile)
+    manifest=_read_manifest(folder, db_signature(dbfile))
+    if manifest is None:
+        if os.path.exists(folder):
+            logger.warning("%s is older than %s, build it again to use it", folder, dbfile)
+        return None
+    sidecar=Sidecar(folder, manifest, use_val, dbfile)
+    for table in ("ROI_0", "IDENTITY", "STORE_INDEX"):
+        if sidecar.table_name(table) not in manifest["tables"]:
+            logger.warning("%s has no %s table, not using it", folder, sidecar.table_name(table))
+            return None
+    return sidecar
+
+
+class Sidecar:
+    """Read-only queries of the tracking database answered from its sidecar"""
+
+    def __init__(self, folder, manifest, use_val="", dbfile=None):
+        self.folder=folder
+        self.manifest=manifest
+        self.dbfile=dbfile
+        self.stale=False   # the .db changed since the sidecar was last exported from it
+        self._checked_at=time.monotonic()
+        self._manifest_mtime=self._stat_manifest()
+        self.use_val=use_val or ""
+        self.chunksize=manifest["chunksize"]
+        self._chunks=OrderedDict()   # (table, chunk) -> {column: numpy array}
+        self._lock=threading.Lock()
+
+    def _stat_manifest(self):
+        try:
+            return os.stat(os.path.join(self.folder, "manifest.json")).st_mtime_ns
+        except OSError:
+            return None
+
+    def refresh(self, force=False):
+        """
+        Every SIDECAR_CHECK_INTERVAL seconds (or now if force) drop the chunks update_sidecar
+        exported again since they were read (by any process) and check that the .db was not
+        changed by someone else
+        """
+        now=time.monotonic()
+        if not force and self._checked_at is not None and now-self._checked_at < SIDECAR_CHECK_INTERVAL:
+            return
+
+        mtime=self._stat_manifest()
+        if mtime!=self._manifest_mtime:
+            try:
+                with open(os.path.join(self.folder, "manifest.json")) as filehandle:
+                    manifest=json.load(filehandle)
+            except (FileNotFoundError, ValueError):
+                manifest=None
+            if manifest is not None:
+                with self._lock:
+                    for name, chunk in list(self._chunks):
+                        before=self.manifest["tables"].get(name, {}).get("revisions", {}).get(str(chunk), 0)
+                        after=manifest["tables"].get(name, {}).get("revisions", {}).get(str(chunk), 0)
+                        if before!=after:
+                            del self._chunks[(name, chunk)]
+                    self.manifest=manifest
+                    self._manifest_mtime=mtime
+
+        self._checked_at=now
+        if self.dbfile is None:
+            return
+        try:
+            stale=db_signature(self.dbfile)!=self.manifest["db"]
+        except OSError:
+            stale=True
+        if stale and not self.stale:
+            logger.warning("%s changed since %s was exported, reading from SQL", self.dbfile, self.folder)
+        self.stale=stale
+
+    def current(self):
+        """False while the .db differs from the one the sidecar was exported from (see refresh)"""
+        self.refresh()
+        return not self.stale
+
+    def table_name(self, table):
+        if table in ("ROI_0", "IDENTITY", "CONCATENATION"):
+            return table+self.use_val
+        return table
+
+    def _entry(self, table):
+        return self.manifest["tables"].get(self.table_name(table))
+
+    def chunks(self, table):
+        """Sorted chunks of table"""
+        self.refresh()
+        entry=self._entry(table)
+        if entry is None:
+            return []
+        return sorted(int(chunk) for chunk in entry["chunks"])
+
+    def read_chunk(self, table, chunk):
+        """Columns of table in chunk as numpy arrays (None if the chunk is empty)"""
+        self.refresh()
+        name=self.table_name(table)
+        key=(name, chunk)
+        with self._lock:
+            columns=self._chunks.get(key)
+            if columns is not None:
+                self._chunks.move_to_end(key)
+        metrics.cache_hit("sidecar_chunks", columns is not None)
+        if columns is not None:
+            return columns
+        if str(chunk) not in (self._entry(table) or {}).get("chunks", {}):
+            return None
+
+        path=os.path.join(self.folder, name, f"{chunk}.arrow")
+        arrow=pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        columns={}
+        for column in arrow.column_names:
+            values=arrow.column(column)
+            if values.null_count and pa.types.is_integer(values.type):
+                # keep NULL as None, as SQL returns it (to_numpy would turn the column into floats)
+                columns[column]=np.array(values.to_pylist(), dtype=object)
+            else:
+                columns[column]=values.to_numpy(zero_copy_only=False)
+        with self._lock:
+            self._chunks[key]=columns
+            while len(self._chunks) > SIDECAR_MAX_CHUNKS:
+                self._chunks.popitem(last=False)
+        return columns
+
+    def _frame_rows(self, table, frame_number):
+        """Columns of the rows of table in frame_number"""
+        columns=self.read_chunk(table, frame_number//self.chunksize)
+        if columns is None:
+            return None
+        frames=columns["frame_number"]
+        start, end=np.searchsorted(frames, [frame_number, frame_number+1])
+        return {column: values[start:end] for column, values in columns.items()}
+
+    def frame_range(self):
+        """min and max frame_number of IDENTITY"""
+        entry=self._entry("IDENTITY")
+        return entry.get("min"), entry.get("max")
+
+    def tracking(self, frame_number):
+        """
+        Rows of ROI_0 in frame_number with the identity and local identity
+        of the IDENTITY row with the same in_frame_index, and the frame_time of the frame
+
+        Returns:
+            rows (list): one dict per row of ROI_0
+            frame_time (int): None if the frame is not in STORE_INDEX
+        """
+        rois=self._frame_rows("ROI_0", frame_number)
+        identities=self._frame_rows("IDENTITY", frame_number)
+        store=self._frame_rows("STORE_INDEX", frame_number)
+        frame_time=None
+        if store is not None and len(store["frame_number"]):
+            frame_time=int(store["frame_time"][0])
+        if rois is None:
+            return [], frame_time
+
+        by_index={}
+        if identities is not None:
+            for in_frame_index, identity, local_identity in zip(
+                identities["in_frame_index"].tolist(), identities["identity"].tolist(),
+                identities["local_identity"].tolist()
+            ):
+                by_index[in_frame_index]=(identity, local_identity)
+
+        names=[name for name in rois if name!="frame_number"]
+        values=[rois[name].tolist() for name in names]
+        rows=[]
+        for row in zip(*values):
+            row=dict(zip(names, row))
+            row["identity"], row["local_identity"]=by_index.get(row["in_frame_index"], (None, None))
+            rows.append(row)
+        return rows, frame_time
+
+    def _scan(self, table, frame_number, direction, match):
+        """
+        First frame after (direction="next") or last frame before (direction="previous")
+        frame_number for which match(columns) is True, visiting the chunks in order
+
+        Arguments:
+            match (callable): columns of a chunk -> (frames, boolean mask) of the candidate rows
+        Returns:
+            hit (tuple): columns of the chunk, index of the hit and the frames match returned, or None
+        """
+        chunks=self.chunks(table)
+        start=frame_number//self.chunksize
+        if direction=="next":
+            chunks=[chunk for chunk in chunks if chunk >= start]
+        elif direction=="previous":
+            chunks=[chunk for chunk in chunks if chunk <= start][::-1]
+        else:
+            raise Exception(f"direction must be either next or previous. direction={direction}")
+
+        for chunk in chunks:
+            columns=self.read_chunk(table, chunk)
+            if columns is None:
+                continue
+            frames, mask=match(columns)
+            if direction=="next":
+                hits=np.flatnonzero(mask & (frames > frame_number))
+                if hits.size:
+                    return columns, hits[0], frames
+            else:
+                hits=np.flatnonzero(mask & (frames < frame_number))
+                if hits.size:
+                    return columns, hits[-1], frames
+        return None
+
+    def next_ok(self, frame_number, direction):
+        """Nearest frame in direction where no animal has identity 0, see app.get_first_non_zero_frame"""
+        def match(columns):
+            frames=columns["frame_number"]
+            starts=np.flatnonzero(np.r_[True, frames[1:]!=frames[:-1]])
+            identity=columns["identity"]
+            known=np.ones(len(identity), dtype=bool)
+            if identity.dtype==object:
+                # MIN() skips NULL, and is NULL (no match) in a frame without any identity
+                known=np.array([i is not None for i in identity], dtype=bool)
+                identity=np.array([np.iinfo(np.int64).max if i is None else i for i in identity], dtype=np.int64)
+            minimum=np.minimum.reduceat(identity, starts)
+            return frames[starts], (minimum!=0) & np.logical_or.reduceat(known, starts)
+
+        hit=self._scan("IDENTITY", frame_number, direction, match)
+        return None if hit is None else int(hit[2][hit[1]])
+
+    def next_error(self, frame_number, direction):
+        """Nearest frame in direction with an animal with identity 0"""
+        hit=self._scan(
+            "IDENTITY", frame_number, direction,
+            lambda columns: (columns["frame_number"], columns["identity"]==0)
+        )
+        return None if hit is None else int(hit[2][hit[1]])
+
+    def next_ai(self, frame_number, direction):
+        """Nearest frame in direction listed in AI, and its ai field"""
+        if self._entry("AI") is None:
+            return None, None
+        hit=self._scan(
+            "AI", frame_number, direction,
+            lambda columns: (columns["frame_number"], np.ones(len(columns["frame_number"]), dtype=bool))
+        )
+        if hit is None:
+            return None, None
+        columns, index, frames=hit
+        return int(frames[index]), columns["ai"][index]
@@ -0,0 +1,152 @@
+"""
+Fast startup of the validator
+
+The heavy dependencies (OpenCV, h5py, pandas, pyarrow, imgstore, idtrackerai, flyhostel)
+are not imported when the server starts: modules hold a lazy_import proxy that imports
+the module on first use. warm_up imports them (and optionally loads an experiment) in a
+background thread once the server is listening, so the first request rarely waits.
+
+Every phase of the startup and every lazy import is timed; the report is logged once the
+warm-up is done and served at /api/startup.
+"""
+import sys
+import time
+import logging
+import importlib
+import threading
+import contextlib
+
+logger=logging.getLogger(__name__)
+
+# modules warm_up imports, in this order
+WARM_UP_MODULES=(
+    "cv2",
+    "pandas",
+    "pyarrow",
+    "pyarrow.feather",
+    "h5py",
+    "flyhostel.utils",
+    "flyhostel.utils.pose_export",
+    "flyhostel.data.human_validation.utils",
+    "imgstore.interface",
+    "idtrackerai.animals_detection.segmentation",
+    "idtrackerai.utils.py_utils",
+)
+
+STARTED_AT=time.perf_counter()
+_lock=threading.Lock()
+_phases=[]    # (name, seconds since STARTED_AT, duration)
+_imports={}   # module -> (seconds since STARTED_AT, duration, thread name)
+_warm_up_thread=None
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Time a phase of the startup"""
+    t0=time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _phases.append((name, round(t0-STARTED_AT, 4), round(time.perf_counter()-t0, 4)))
+
+
+def import_module(name):
+    """importlib.import_module, timing the first import of name"""
+    module=sys.modules.get(name)
+    if module is not None:
+        return module
+    t0=time.perf_counter()
+    module=importlib.import_module(name)
+    with _lock:
+        _imports.setdefault(
+            name, (round(t0-STARTED_AT, 4), round(time.perf_counter()-t0, 4), threading.current_thread().name)
+        )
+    return module
+
+
+class LazyModule:
+    """Stands for a module that is imported when one of its attributes is first read"""
+
+    def __init__(self, name):
+        self.__dict__["_name"]=name
+        self.__dict__["_module"]=None
+
+    def _load(self):
+        module=self.__dict__["_module"]
+        if module is None:
+            module=import_module(self.__dict__["_name"])
+            self.__dict__["_module"]=module
+        return module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __setattr__(self, attribute, value):
+        setattr(self._load(), attribute, value)
+
+    def __repr__(self):
+        state="imported" if self.__dict__["_module"] is not None else "not imported"
+        return f"<lazy module {self.__dict__['_name']} ({state})>"
+
+
+def lazy_import(name):
+    """Proxy of module name, imported on first use"""
+    return LazyModule(name)
+
+
+def lazy_callable(module, name):
+    """Function (or class) name of module, imported when it is first called"""
+    proxy=LazyModule(module)
+
+    def call(*args, **kwargs):
+        return getattr(proxy, name)(*args, **kwargs)
+
+    call.__name__=name
+    call.__qualname__=name
+    call.__doc__=f"{module}.{name}, imported on first call"
+    return call
+
+
+def warm_up(modules=WARM_UP_MODULES, then=None):
+    """
+    Import modules in a background thread, then call then() (for example to load an experiment)
+
+    Returns:
+        thread (threading.Thread): the warm-up thread, already started
+    """
+    global _warm_up_thread
+
+    def target():
+        with phase("warm_up"):
+            for name in modules:
+                try:
+                    import_module(name)
+                except Exception as error:
+                    logger.warning("Cannot import %s during warm-up: %s", name, error)
+            if then is not None:
+                try:
+                    then()
+                except Exception as error:
+                    logger.error("Error during warm-up: %s", error)
+        logger.info("Startup report: %s", report())
+
+    _warm_up_thread=threading.Thread(target=target, name="warm-up", daemon=True)
+    _warm_up_thread.start()
+    return _warm_up_thread
+
+
+def report():
+    """Timing of the phases of the startup and of the lazy imports"""
+    with _lock:
+        phases=[{"name": name, "start": start, "duration": duration} for name, start, duration in _phases]
+        imports=[
+            {"module": name, "start": start, "duration": duration, "thread": thread}
+            for name, (start, duration, thread) in sorted(_imports.items(), key=lambda item: item[1][0])
+        ]
+    return {
+        "uptime": round(time.perf_counter()-STARTED_AT, 4),
+        "warming_up": _warm_up_thread is not None and _warm_up_thread.is_alive(),
+        "phases": phases,
+        "imports": imports,
+    }
@@ -0,0 +1,153 @@
+"""
+Segmentation parameter sweep
+
+POST /api/segmentation/sweep segments a sample of frames with every combination of
+a grid of _intensity and _area values of the idtrackerai config and reports how many
+blobs idtrackerai finds in every frame, compared to the number of animals.
+The frames are decoded once by the server and the ROI mask is computed once per sweep;
+the grid is split among the processes of a pool (SWEEP_WORKERS), every task segments
+one frame with a group of settings so every frame is sent to a worker as few times as possible.
+"""
+import os
+import math
+import time
+import logging
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from idtrackerai_validator_server.backend import process_config, roi_mask, _process_frame
+
+logger=logging.getLogger(__name__)
+
+SWEEP_WORKERS=int(os.environ.get("SWEEP_WORKERS", os.cpu_count() or 1))
+SWEEP_MAX_FRAMES=int(os.environ.get("SWEEP_MAX_FRAMES", 100))
+SWEEP_MAX_SETTINGS=int(os.environ.get("SWEEP_MAX_SETTINGS", 400))
+
+_pool=None
+_pool_lock=threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the server process is multi-threaded
+            _pool=ProcessPoolExecutor(max_workers=SWEEP_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def settings_grid(intensity, area):
+    """
+    Every combination of the intensity and area thresholds
+
+    Arguments:
+        intensity, area (list): [min, max] pairs
+    Returns:
+        settings (list): {"intensity": [min, max], "area": [min, max]}
+    """
+    settings=[]
+    for values in (intensity, area):
+        if not values or any(len(pair) != 2 for pair in values):
+            raise ValueError("intensity and area must be lists of [min, max] pairs")
+    for intensity_range, area_range in itertools.product(intensity, area):
+        settings.append({
+            "intensity": [float(value) for value in intensity_range],
+            "area": [float(value) for value in area_range],
+        })
+    if len(settings) > SWEEP_MAX_SETTINGS:
+        raise ValueError(f"The grid has {len(settings)} settings, at most {SWEEP_MAX_SETTINGS} are allowed")
+    return settings
+
+
+def count_blobs(task):
+    """
+    Segment one frame with several settings (runs in the pool)
+
+    Arguments:
+        task (dict): frame, mask, parameters (see backend.process_config), settings
+    Returns:
+        blobs (list): number of blobs found with every setting
+    """
+    frame=task["frame"]
+    blobs=[]
+    for setting in task["settings"]:
+        parameters=dict(
+            task["parameters"],
+            min_threshold=setting["intensity"][0], max_threshold=setting["intensity"][1],
+            min_area=setting["area"][0], max_area=setting["area"][1],
+        )
+        try:
+            contours=_process_frame(frame, parameters, 0, "NONE", "NONE")[5]
+            blobs.append(len(contours))
+        except Exception as error:
+            logger.warning("Cannot segment with %s: %s", setting, error)
+            blobs.append(None)
+    return blobs
+
+
+def run_sweep(frames, config, settings, number_of_animals):
+    """
+    Arguments:
+        frames (dict): frame_number -> decoded frame (grayscale)
+        config (dict): idtrackerai config, its _intensity and _area are replaced by every setting
+        settings (list): see settings_grid
+    Returns:
+        result (dict): frames, and the blobs of every frame and summary of every setting
+    """
+    t0=time.perf_counter()
+    frame_numbers=sorted(frames)
+    parameters=process_config(config)
+    parameters["resolution_reduction"]=1.0
+    masks={}
+
+    # as many tasks as workers at least, without splitting the settings more than needed
+    groups=max(1, min(len(settings), math.ceil(SWEEP_WORKERS/max(1, len(frame_numbers)))))
+    group_size=math.ceil(len(settings)/groups)
+    tasks=[]
+    for frame_number in frame_numbers:
+        frame=frames[frame_number]
+        if frame.shape not in masks:
+            masks[frame.shape]=roi_mask(frame.shape, parameters["rois"])
+        for i in range(0, len(settings), group_size):
+            tasks.append((frame_number, i, {
+                "frame": frame,
+                "parameters": dict(parameters, mask=masks[frame.shape]),
+                "settings": settings[i:i+group_size],
+            }))
+
+    blobs=np.full((len(settings), len(frame_numbers)), -1, dtype=np.int64)
+    pool=_get_pool()
+    futures=[(frame_number, i, pool.submit(count_blobs, task)) for frame_number, i, task in tasks]
+    for frame_number, i, future in futures:
+        counts=[-1 if count is None else count for count in future.result()]
+        blobs[i:i+len(counts), frame_numbers.index(frame_number)]=counts
+
+    out=[]
+    for setting, setting_blobs in zip(settings, blobs):
+        segmented=setting_blobs >= 0
+        error=np.abs(setting_blobs[segmented]-number_of_animals)
+        out.append(dict(
+            setting,
+            blobs=setting_blobs.tolist(),
+            correct=int((error==0).sum()),
+            fewer=int((setting_blobs[segmented] < number_of_animals).sum()),
+            more=int((setting_blobs[segmented] > number_of_animals).sum()),
+            mean_error=round(float(error.mean()), 4) if len(error) else None,
+        ))
+
+    # most frames with all the animals, then the smallest error
+    best=min(
+        range(len(out)),
+        key=lambda i: (-out[i]["correct"], math.inf if out[i]["mean_error"] is None else out[i]["mean_error"])
+    ) if out else None
+    logger.info("Swept %s settings in %s frames in %.2f s", len(settings), len(frame_numbers), time.perf_counter()-t0)
+    return {
+        "number_of_animals": number_of_animals,
+        "frames": frame_numbers,
+        "settings": out,
+        "best": best,
+    }
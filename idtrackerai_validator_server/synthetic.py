@@ -0,0 +1,380 @@
+"""
+Synthetic FlyHostel experiments, to run and benchmark the validator without real data
+
+make_experiment writes under root everything the validator reads:
+
+* FlyHostelN/NX/YYYY-MM-DD_HH-MM-SS/FlyHostelN_NX_YYYY-MM-DD_HH-MM-SS.db with
+  METADATA, ROI_0, IDENTITY (and their _VAL versions), CONCATENATION(_VAL),
+  STORE_INDEX and AI
+* the video, laid out like an imgstore VideoImgStore: metadata.yaml and one
+  small mp4 (dark flies on a light background) plus .npz index per chunk
+* the pose H5 file of every fly
+* the PE bouts and traces feathers, burst plots and bout videos, and an audit csv
+* index.txt, like backend.update_experiments
+
+python -m idtrackerai_validator_server.synthetic ROOT --animals 6 --chunks 3 --chunksize 1000
+"""
+import os
+import json
+import uuid
+import sqlite3
+import argparse
+import datetime
+
+import cv2
+import h5py
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as pa_feather
+
+# number of bodyparts in the pose H5 files (see app.BODYPART_NAMES)
+N_BODYPARTS=18
+# side of the square around every fly the pose is relative to (flyhostel.utils.get_square_width)
+SQUARE_SIZE=100
+FLY_AXES=(7, 3)
+
+
+def _experiment_name(flyhostel, number_of_animals, date_time):
+    return f"FlyHostel{flyhostel}/{number_of_animals}X/{date_time}"
+
+
+def _trajectories(rng, n_frames, number_of_animals, width, height, step=2.0):
+    """Random walks of every animal, shape (n_frames, number_of_animals, 2)"""
+    margin=SQUARE_SIZE//2
+    start=rng.uniform([margin, margin], [width-margin, height-margin], size=(number_of_animals, 2))
+    steps=rng.normal(0, step, size=(n_frames, number_of_animals, 2))
+    xy=start+np.cumsum(steps, axis=0)
+    # reflect on the walls of the arena
+    for axis, size in enumerate((width, height)):
+        span=size-2*margin
+        position=np.mod(xy[..., axis]-margin, 2*span)
+        xy[..., axis]=margin+np.where(position > span, 2*span-position, position)
+    return np.round(xy).astype(np.int64)
+
+
+def _write_database(dbfile, frames, xy, rng, chunksize, framerate, start_time, width, height,
+                    error_rate, fragment_length, ai_rate):
+    number_of_animals=xy.shape[1]
+    config={
+        "_number_of_animals": {"value": number_of_animals},
+        "_intensity": {"value": [0, 120]},
+        "_area": {"value": [10, 1000]},
+        "_roi": {"value": [[f"[[0, 0], [0, {height-1}], [{width-1}, {height-1}], [{width-1}, 0]]"]]},
+        "_resreduct": {"value": 1.0},
+    }
+    metadata={
+        "chunksize": chunksize,
+        "framerate": framerate,
+        "date_time": start_time,
+        "ethoscope_metadata": ",reference_hour\n0,8\n",
+        "idtrackerai_conf": json.dumps(config),
+    }
+
+    frame_index=np.repeat(frames, number_of_animals)
+    in_frame_index=np.tile(np.arange(number_of_animals), len(frames))
+    identity=in_frame_index+1
+    # every animal starts a new fragment every fragment_length frames
+    errors=rng.random(len(frame_index)) < error_rate
+    fragment=(frame_index-frames[0])//fragment_length*number_of_animals+in_frame_index
+    roi_rows=[
+        (int(fn), int(i), int(x), int(y), None, str(int(f)), int(area))
+        for fn, i, (x, y), f, area in zip(
+            frame_index, in_frame_index, xy.reshape(-1, 2), fragment,
+            rng.integers(60, 120, len(frame_index))
+        )
+    ]
+    identity_rows=[
+        (int(fn), int(i), int(i)+1, 0 if error else int(ident))
+        for fn, i, ident, error in zip(frame_index, in_frame_index, identity, errors)
+    ]
+    identity_val_rows=[(fn, i, local, i+1) for fn, i, local, _ in identity_rows]
+
+    chunks=np.unique(frames//chunksize)
+    concatenation_rows=[
+        (int(chunk), local, local, 0, 0)
+        for chunk in chunks for local in range(1, number_of_animals+1)
+    ]
+
+    if os.path.exists(dbfile):
+        os.remove(dbfile)
+    with sqlite3.connect(dbfile) as conn:
+        conn.execute("CREATE TABLE METADATA (field TEXT PRIMARY KEY, value TEXT)")
+        conn.executemany("INSERT INTO METADATA VALUES (?, ?)", [(k, str(v)) for k, v in metadata.items()])
+        conn.execute("CREATE TABLE STORE_INDEX (frame_number INTEGER PRIMARY KEY, frame_time INTEGER)")
+        conn.executemany(
+            "INSERT INTO STORE_INDEX VALUES (?, ?)",
+            [(int(fn), int(round((fn-frames[0])*1000/framerate))) for fn in frames]
+        )
+        conn.execute("CREATE TABLE AI (frame_number INTEGER PRIMARY KEY, ai TEXT)")
+        conn.executemany(
+            "INSERT INTO AI VALUES (?, 'yolov7')",
+            [(int(fn),) for fn in frames[rng.random(len(frames)) < ai_rate]]
+        )
+        for suffix, rows in (("", identity_rows), ("_VAL", identity_val_rows)):
+            conn.execute(f"""
+                CREATE TABLE ROI_0{suffix} (
+                    id INTEGER PRIMARY KEY, frame_number INTEGER, in_frame_index INTEGER,
+                    x INTEGER, y INTEGER, modified TEXT, fragment TEXT, area INTEGER)""")
+            conn.executemany(
+                f"INSERT INTO ROI_0{suffix} (frame_number, in_frame_index, x, y, modified, fragment, area) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", roi_rows
+            )
+            conn.execute(f"""
+                CREATE TABLE IDENTITY{suffix} (
+                    id INTEGER PRIMARY KEY, frame_number INTEGER, in_frame_index INTEGER,
+                    local_identity INTEGER, identity INTEGER)""")
+            conn.executemany(
+                f"INSERT INTO IDENTITY{suffix} (frame_number, in_frame_index, local_identity, identity) "
+                "VALUES (?, ?, ?, ?)", rows
+            )
+            conn.execute(f"""
+                CREATE TABLE CONCATENATION{suffix} (
+                    id INTEGER PRIMARY KEY, chunk INTEGER, local_identity INTEGER,
+                    local_identity_after INTEGER, is_inferred INTEGER, is_broken INTEGER)""")
+            conn.executemany(
+                f"INSERT INTO CONCATENATION{suffix} (chunk, local_identity, local_identity_after, is_inferred, is_broken) "
+                "VALUES (?, ?, ?, ?, ?)", concatenation_rows
+            )
+            conn.execute(f"CREATE INDEX ROI_0{suffix}_frame_number ON ROI_0{suffix} (frame_number)")
+            conn.execute(f"CREATE INDEX IDENTITY{suffix}_frame_number ON IDENTITY{suffix} (frame_number)")
+
+
+def _write_store(basedir, frames, xy, chunksize, framerate, start_time, width, height):
+    """metadata.yaml and one mp4 + npz index per chunk, like an imgstore VideoImgStore"""
+    store={
+        "__store": {
+            "class": "VideoImgStore",
+            "version": 2,
+            "chunksize": chunksize,
+            "encoding": "mp4v",
+            "extension": ".mp4",
+            "format": "mp4v/mp4",
+            "framerate": framerate,
+            "imgdtype": "uint8",
+            "imgshape": [height, width],
+            "uuid": uuid.uuid4().hex,
+            "created_utc": datetime.datetime.utcnow().isoformat(),
+        }
+    }
+    # JSON is valid YAML
+    with open(os.path.join(basedir, "metadata.yaml"), "w") as filehandle:
+        json.dump(store, filehandle, indent=2)
+
+    chunk_files=[]
+    for chunk in np.unique(frames//chunksize):
+        in_chunk=frames//chunksize==chunk
+        path=os.path.join(basedir, f"{int(chunk):06d}.mp4")
+        writer=cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), framerate, (width, height), False)
+        for positions in xy[in_chunk]:
+            image=np.full((height, width), 220, np.uint8)
+            for x, y in positions:
+                cv2.ellipse(image, (int(x), int(y)), FLY_AXES, 0, 0, 360, 40, -1)
+            writer.write(image)
+        writer.release()
+        np.savez(
+            os.path.join(basedir, f"{int(chunk):06d}.npz"),
+            frame_number=frames[in_chunk],
+            frame_time=start_time+(frames[in_chunk]-frames[0])/framerate,
+        )
+        chunk_files.append(path)
+    return chunk_files
+
+
+def _write_pose(root, flat, identities, n_frames, chunk_files, rng):
+    """Pose of every fly relative to its square, where app.get_h5_file looks for it"""
+    paths=[]
+    for identity in identities:
+        key=f"{flat}__{str(identity).zfill(2)}"
+        folder=os.path.join(root, flat, "motionmapper", str(identity).zfill(2), "pose_raw", key)
+        os.makedirs(folder, exist_ok=True)
+        tracks=SQUARE_SIZE/2+rng.normal(0, 10, size=(1, 2, N_BODYPARTS, n_frames))
+        # a few missing detections
+        tracks[:, :, :, rng.random(n_frames) < 0.01]=np.nan
+        path=os.path.join(folder, f"{key}.h5")
+        with h5py.File(path, "w") as h5:
+            h5.create_dataset("files", data=np.array([f.encode() for f in chunk_files]))
+            h5.create_dataset("tracks", data=tracks.astype(np.float32))
+        paths.append(path)
+    return paths
+
+
+def _write_pe(basedir, root, flat, identities, frames, chunksize, framerate, rng, bouts_per_fly, media):
+    """PE bouts and traces feathers of every fly, a few burst plots and bout videos, and an audit csv"""
+    pe_dir=os.path.join(basedir, "flyhostel", "proboscis_extensions")
+    for subdir in ("pe_bouts", "plots", "videos"):
+        os.makedirs(os.path.join(pe_dir, subdir), exist_ok=True)
+
+    labels=np.array(["pe", "pe", "pe", "groom", "feed", "other"])
+    audit=[]
+    media_written=0
+    for identity in identities:
+        fly=f"{flat}__{str(identity).zfill(2)}"
+        n=bouts_per_fly
+        burst_id=np.sort(rng.integers(0, max(n//3, 1), n))
+        start_fn=np.sort(rng.integers(frames[0], frames[-1]-framerate, n))
+        duration=rng.integers(framerate//10, framerate, n)
+        bout_uid=np.arange(n)+identity*100000
+        bouts=pd.DataFrame({
+            "burst_id": burst_id,
+            "bout_uid": bout_uid,
+            "start_fn": start_fn,
+            "end_fn": start_fn+duration,
+            "n_in_burst": pd.Series(burst_id).map(pd.Series(burst_id).value_counts()).values,
+            "is_solitary": rng.random(n) < 0.3,
+            "pe_score": rng.random(n).round(4),
+            "dur_s": (duration/framerate).round(4),
+            "label": labels[rng.integers(0, len(labels), n)],
+            "label_reason": "synthetic",
+        })
+        pa_feather.write_feather(
+            pa.Table.from_pandas(bouts, preserve_index=False),
+            os.path.join(pe_dir, "pe_bouts", f"{fly}_pe_bouts.feather")
+        )
+
+        traces=[]
+        for burst, group in bouts.groupby("burst_id"):
+            first, last=int(group["start_fn"].min()), int(group["end_fn"].max())
+            frame_number=np.arange(first, last+1)
+            bout_in_burst=np.full(len(frame_number), np.nan)
+            uid=np.full(len(frame_number), np.nan)
+            for position, bout in enumerate(group.itertuples()):
+                inside=(frame_number >= bout.start_fn) & (frame_number <= bout.end_fn)
+                bout_in_burst[inside]=position
+                uid[inside]=bout.bout_uid
+            dist=np.abs(np.sin((frame_number-first)/framerate*8))*0.3+rng.normal(0, 0.01, len(frame_number))
+            traces.append(pd.DataFrame({
+                "burst_id": burst,
+                "frame_number": frame_number,
+                "dist_mm": dist,
+                "prob_conf": rng.uniform(0.5, 1, len(frame_number)),
+                "bout_uid": uid,
+                "bout_in_burst": bout_in_burst,
+                "is_peak": np.r_[False, (dist[1:-1] > dist[:-2]) & (dist[1:-1] > dist[2:]), False],
+            }))
+            audit.append((fly, int(burst)))
+
+            if media_written < media:
+                plot=np.full((120, 240, 3), 255, np.uint8)
+                cv2.polylines(plot, [np.c_[np.linspace(0, 239, len(dist)), 110-dist*300].astype(np.int32)], False, (0, 0, 0))
+                cv2.imwrite(os.path.join(pe_dir, "plots", f"{fly}_burst_{int(burst)}.png"), plot)
+                bout=group.iloc[0]
+                writer=cv2.VideoWriter(
+                    os.path.join(pe_dir, "videos", f"{fly}_burst_{int(burst)}_bout_{int(bout.bout_uid)}.mp4"),
+                    cv2.VideoWriter_fourcc(*"mp4v"), framerate, (SQUARE_SIZE, SQUARE_SIZE), False
+                )
+                for i in range(int(bout.end_fn-bout.start_fn)):
+                    writer.write(np.full((SQUARE_SIZE, SQUARE_SIZE), (i*5) % 255, np.uint8))
+                writer.release()
+                media_written+=1
+
+        pa_feather.write_feather(
+            pa.Table.from_pandas(pd.concat(traces, ignore_index=True), preserve_index=False),
+            os.path.join(pe_dir, f"{fly}_traces.feather")
+        )
+
+    audit_csv=os.path.join(root, "audit.csv")
+    pd.DataFrame(audit, columns=["fly", "burst_id"]).to_csv(audit_csv, index=False)
+    return audit_csv
+
+
+def make_experiment(root, flyhostel=1, number_of_animals=3, date_time="2023-01-01_10-00-00",
+                    first_chunk=50, chunks=2, chunksize=1000, framerate=150, width=256, height=256,
+                    pose=True, pe=True, bouts_per_fly=60, media=10,
+                    error_rate=0.01, fragment_length=100, ai_rate=0.005, seed=0):
+    """
+    Write a synthetic experiment under root (used as $FLYHOSTEL_VIDEOS)
+
+    Arguments:
+
+        first_chunk (int): chunk the experiment starts on (constants.first_chunk by default)
+        chunks (int): number of chunks of chunksize frames
+        error_rate (float): fraction of IDENTITY rows with identity 0 (not in the _VAL tables)
+        fragment_length (int): frames of every fragment
+        ai_rate (float): fraction of frames with a row in AI
+        bouts_per_fly (int): rows of every _pe_bouts.feather
+        media (int): number of bursts with a plot and a bout video
+
+    Returns:
+        info (dict): root, experiment (FlyHostelN/NX/YYYY-MM-DD_HH-MM-SS), basedir, dbfile,
+        min_frame, max_frame, identities, flies, and audit_csv if pe
+    """
+    rng=np.random.default_rng(seed)
+    experiment=_experiment_name(flyhostel, number_of_animals, date_time)
+    flat=experiment.replace("/", "_")
+    basedir=os.path.join(root, experiment)
+    os.makedirs(basedir, exist_ok=True)
+    dbfile=os.path.join(basedir, f"{flat}.db")
+
+    start_time=int(datetime.datetime.strptime(date_time, "%Y-%m-%d_%H-%M-%S")
+                   .replace(tzinfo=datetime.timezone.utc).timestamp())
+    frames=np.arange(first_chunk*chunksize, (first_chunk+chunks)*chunksize)
+    xy=_trajectories(rng, len(frames), number_of_animals, width, height)
+    identities=list(range(1, number_of_animals+1))
+
+    _write_database(
+        dbfile, frames, xy, rng, chunksize, framerate, start_time, width, height,
+        error_rate, fragment_length, ai_rate
+    )
+    chunk_files=_write_store(basedir, frames, xy, chunksize, framerate, start_time, width, height)
+
+    info={
+        "root": root,
+        "experiment": experiment,
+        "basedir": basedir,
+        "dbfile": dbfile,
+        "min_frame": int(frames[0]),
+        "max_frame": int(frames[-1]),
+        "identities": identities,
+        "flies": [f"{flat}__{str(identity).zfill(2)}" for identity in identities],
+    }
+    if pose:
+        _write_pose(root, flat, identities, len(frames), chunk_files, rng)
+    if pe:
+        info["audit_csv"]=_write_pe(
+            basedir, root, flat, identities, frames, chunksize, framerate, rng, bouts_per_fly, media
+        )
+
+    index=os.path.join(root, "index.txt")
+    entries=set()
+    if os.path.exists(index):
+        with open(index) as filehandle:
+            entries={line.strip() for line in filehandle if line.strip()}
+    entries.add(f"./{experiment}/{flat}.db")
+    with open(index, "w") as filehandle:
+        filehandle.write("\n".join(sorted(entries)) + "\n")
+    return info
+
+
+def get_parser():
+    ap=argparse.ArgumentParser(description="Write a synthetic FlyHostel experiment")
+    ap.add_argument("root", help="Folder used as $FLYHOSTEL_VIDEOS")
+    ap.add_argument("--flyhostel", default=1, type=int)
+    ap.add_argument("--animals", default=3, type=int)
+    ap.add_argument("--date-time", default="2023-01-01_10-00-00")
+    ap.add_argument("--first-chunk", default=50, type=int)
+    ap.add_argument("--chunks", default=2, type=int)
+    ap.add_argument("--chunksize", default=1000, type=int)
+    ap.add_argument("--framerate", default=150, type=int)
+    ap.add_argument("--width", default=256, type=int)
+    ap.add_argument("--height", default=256, type=int)
+    ap.add_argument("--bouts-per-fly", default=60, type=int)
+    ap.add_argument("--no-pose", action="store_true")
+    ap.add_argument("--no-pe", action="store_true")
+    ap.add_argument("--seed", default=0, type=int)
+    return ap
+
+
+def main():
+    args=get_parser().parse_args()
+    info=make_experiment(
+        args.root, flyhostel=args.flyhostel, number_of_animals=args.animals, date_time=args.date_time,
+        first_chunk=args.first_chunk, chunks=args.chunks, chunksize=args.chunksize,
+        framerate=args.framerate, width=args.width, height=args.height,
+        pose=not args.no_pose, pe=not args.no_pe, bouts_per_fly=args.bouts_per_fly, seed=args.seed,
+    )
+    print(json.dumps(info, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+Overview of a whole experiment for /api/timeline
+
+The frames of the experiment are split in at most TIMELINE_MAX_BINS bins of the same width
+and, for every bin, the validator counts
+    frames:     frames in STORE_INDEX
+    errors:     frames with an animal with identity 0
+    missing:    frames with fewer ROIs than number_of_animals
+    ai:         frames listed in AI
+    rejections: interactions rejected in the sociability analysis (first_frame)
+    modified:   rows of ROI_0 modified during validation
+with grouped SQL queries (or from the columnar sidecar, see sidecar.py).
+Every level of the pyramid doubles the width of the bins of the previous one,
+so a request for N bins between two frames adds up the bins of the coarsest
+level with several bins per output bin, and zooming in never reads the database again.
+The timeline is cached per experiment until its .db or its rejections change; the
+corrections made through the server count again only the base bins of the frames they changed.
+"""
+import os
+import math
+import sqlite3
+import logging
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+logger=logging.getLogger(__name__)
+
+TIMELINE_MAX_BINS=int(os.environ.get("TIMELINE_MAX_BINS", 65536))
+# output bins are at least this many level bins wide
+LEVEL_OVERSAMPLING=8
+COUNTS=("frames", "errors", "missing", "ai", "rejections", "modified")
+_FETCH_ROWS=100000
+
+_TIMELINES={}   # experiment -> (key, Timeline)
+_BUILDING={}    # (experiment, key) -> Future of the Timeline being built
+_lock=threading.Lock()
+
+
+class Timeline:
+    """Counts of COUNTS per bin of the experiment, at every level of the pyramid"""
+
+    def __init__(self, first_frame, last_frame, width, counts):
+        self.first_frame=first_frame
+        self.last_frame=last_frame
+        self.width=width
+        # levels[k][name]: counts in bins of self.width*2**k frames
+        self.levels=_pyramid(counts)
+
+    def update(self, start, end, count):
+        """
+        Count again the base bins with frames between start and end
+
+        Arguments:
+            count (callable): fills a _Counter of those bins, see count_events
+        """
+        first=(max(start, self.first_frame)-self.first_frame)//self.width
+        last=(min(end, self.last_frame)-self.first_frame)//self.width
+        if last < first:
+            return
+        counter=_Counter(
+            self.first_frame+first*self.width,
+            min(self.last_frame, self.first_frame+(last+1)*self.width-1),
+            self.width
+        )
+        count(counter)
+        counts={name: values.copy() for name, values in self.levels[0].items()}
+        for name in COUNTS:
+            # the rejections do not come from the database
+            if name!="rejections":
+                counts[name][first:last+1]=counter.counts[name]
+        # replaced at once, so concurrent queries see the old or the new pyramid
+        self.levels=_pyramid(counts)
+
+    def query(self, bins, start=None, end=None):
+        """
+        counts of COUNTS in bins bins of the same width between start and end (both included)
+        """
+        start=self.first_frame if start is None else max(start, self.first_frame)
+        end=self.last_frame if end is None else min(end, self.last_frame)
+        if end < start:
+            raise ValueError(f"Empty range {start}-{end}")
+        # bins cannot be narrower than the base bins
+        bins=max(1, min(bins, (end-start+1)//self.width))
+        bin_width=(end-start+1)/bins
+
+        # the coarsest level with several bins per output bin: a level bin split between two
+        # output bins is shared in proportion, the error is a fraction of a level bin
+        level=0
+        while level+1 < len(self.levels) and self.width*2**(level+1)*LEVEL_OVERSAMPLING <= bin_width:
+            level+=1
+        width=self.width*2**level
+        counts=self.levels[level]
+
+        first=(start-self.first_frame)//width
+        last=(end-self.first_frame)//width
+        boundaries=self.first_frame+np.arange(first, last+2)*width
+        edges=start+np.arange(bins+1)*bin_width
+
+        out={}
+        for name in COUNTS:
+            cumulative=np.r_[0, np.cumsum(counts[name][first:last+1])]
+            out[name]=np.diff(np.round(np.interp(edges, boundaries, cumulative)).astype(np.int64)).tolist()
+
+        return {
+            "start": int(start),
+            "end": int(end),
+            "bins": int(bins),
+            "bin_width": round(bin_width, 4),
+            "resolution": int(width),
+            "edges": np.round(edges).astype(np.int64).tolist(),
+            "counts": out,
+        }
+
+
+def _pyramid(counts):
+    levels=[counts]
+    while len(levels[-1]["frames"]) > 1:
+        levels.append({name: _pairwise_sum(values) for name, values in levels[-1].items()})
+    return levels
+
+
+def _pairwise_sum(values):
+    if len(values) % 2:
+        values=np.r_[values, 0]
+    return values[0::2]+values[1::2]
+
+
+class _Counter:
+    """Adds up frame numbers into the base bins of the timeline"""
+
+    def __init__(self, first_frame, last_frame, width=None):
+        self.first_frame=first_frame
+        self.last_frame=last_frame
+        if width is None:
+            bins=min(TIMELINE_MAX_BINS, last_frame-first_frame+1)
+            width=max(1, math.ceil((last_frame-first_frame+1)/bins))
+        self.width=width
+        self.bins=math.ceil((last_frame-first_frame+1)/self.width)
+        self.counts={name: np.zeros(self.bins, dtype=np.int64) for name in COUNTS}
+
+    def add(self, name, frames):
+        frames=np.asarray(frames, dtype=np.int64)
+        frames=frames[(frames >= self.first_frame) & (frames <= self.last_frame)]
+        self.counts[name]+=np.bincount((frames-self.first_frame)//self.width, minlength=self.bins)
+
+    def add_query(self, name, conn, sql, parameters=()):
+        cursor=conn.execute(sql, parameters)
+        while True:
+            rows=cursor.fetchmany(_FETCH_ROWS)
+            if not rows:
+                break
+            self.add(name, [row[0] for row in rows])
+
+
+def _count_sql(counter, dbfile, use_val, number_of_animals):
+    between="frame_number BETWEEN ? AND ?"
+    frames=(counter.first_frame, counter.last_frame)
+    with sqlite3.connect(f"file:{dbfile}?mode=ro", uri=True) as conn:
+        tables={row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        counter.add_query("frames", conn, f"SELECT frame_number FROM STORE_INDEX WHERE {between}", frames)
+        counter.add_query(
+            "errors", conn,
+            f"SELECT DISTINCT frame_number FROM IDENTITY{use_val} WHERE {between} AND identity = 0", frames
+        )
+        counter.add_query(
+            "missing", conn,
+            f"SELECT frame_number FROM ROI_0{use_val} WHERE {between} GROUP BY frame_number HAVING COUNT(*) >= ?",
+            (*frames, number_of_animals)
+        )
+        if "AI" in tables:
+            counter.add_query("ai", conn, f"SELECT frame_number FROM AI WHERE {between}", frames)
+        counter.add_query(
+            "modified", conn,
+            f"SELECT frame_number FROM ROI_0{use_val} WHERE {between} AND modified IS NOT NULL AND modified NOT IN ('', '0')",
+            frames
+        )
+
+
+def _modified(values):
+    """
+    Rows of a modified column of the sidecar that _count_sql counts (not NULL, '' or 0),
+    whatever the type the column was exported with
+    """
+    if values.dtype.kind in "iub":
+        return values!=0
+    if values.dtype.kind=="f":
+        # NULL in a REAL column
+        return ~np.isnan(values) & (values!=0)
+    return np.array([
+        value is not None and value==value and value not in ("", "0", 0) for value in values.tolist()
+    ], dtype=bool)
+
+
+def _count_sidecar(counter, sidecar, number_of_animals):
+    def chunks(table):
+        first, last=counter.first_frame//sidecar.chunksize, counter.last_frame//sidecar.chunksize
+        return [chunk for chunk in sidecar.chunks(table) if first <= chunk <= last]
+
+    for chunk in chunks("STORE_INDEX"):
+        counter.add("frames", sidecar.read_chunk("STORE_INDEX", chunk)["frame_number"])
+    for chunk in chunks("IDENTITY"):
+        columns=sidecar.read_chunk("IDENTITY", chunk)
+        counter.add("errors", np.unique(columns["frame_number"][columns["identity"]==0]))
+    for chunk in chunks("ROI_0"):
+        columns=sidecar.read_chunk("ROI_0", chunk)
+        frames, rois=np.unique(columns["frame_number"], return_counts=True)
+        counter.add("missing", frames[rois >= number_of_animals])
+        counter.add("modified", columns["frame_number"][_modified(columns["modified"])])
+    for chunk in chunks("AI"):
+        counter.add("ai", sidecar.read_chunk("AI", chunk)["frame_number"])
+
+
+def count_events(counter, dbfile, use_val, number_of_animals, sidecar=None):
+    """Count the events of the database in the bins of counter (all but the rejections)"""
+    if sidecar is not None:
+        _count_sidecar(counter, sidecar, number_of_animals)
+    else:
+        _count_sql(counter, dbfile, use_val, number_of_animals)
+    # until here missing counted the frames with all the animals
+    counter.counts["missing"]=np.clip(counter.counts["frames"]-counter.counts["missing"], 0, None)
+
+
+def frame_range(dbfile, use_val, sidecar=None):
+    """min and max frame_number of IDENTITY"""
+    if sidecar is not None:
+        return sidecar.frame_range()
+    with sqlite3.connect(f"file:{dbfile}?mode=ro", uri=True) as conn:
+        return conn.execute(f"SELECT MIN(frame_number), MAX(frame_number) FROM IDENTITY{use_val}").fetchone()
+
+
+def build_timeline(first_frame, last_frame, dbfile, use_val, number_of_animals, rejections=None, sidecar=None):
+    """
+    Count the events of the experiment in the base bins
+
+    Arguments:
+        first_frame, last_frame (int): range of the timeline
+        rejections (np.ndarray): first_frame of the rejected interactions, if available
+        sidecar (sidecar.Sidecar): read the tables from the sidecar instead of dbfile
+    """
+    counter=_Counter(first_frame, last_frame)
+    count_events(counter, dbfile, use_val, number_of_animals, sidecar)
+    if rejections is not None:
+        counter.add("rejections", rejections)
+    return Timeline(first_frame, last_frame, counter.width, counter.counts)
+
+
+def get_timeline(experiment, key, build, publish=None):
+    """
+    The cached timeline of experiment, built again with build() when key changed.
+    The new timeline is only cached if publish() is True (the experiment is still the loaded one).
+    _lock is not held during the build, the requests for the same timeline wait for it
+    """
+    with _lock:
+        hit=_TIMELINES.get(experiment)
+        if hit and hit[0]==key:
+            return hit[1]
+        pending=_BUILDING.get((experiment, key))
+        building=pending is None
+        if building:
+            pending=_BUILDING[(experiment, key)]=Future()
+    if not building:
+        return pending.result()
+
+    logger.info("Building the timeline of %s", experiment)
+    try:
+        timeline=build()
+    except BaseException as error:
+        with _lock:
+            del _BUILDING[(experiment, key)]
+        pending.set_exception(error)
+        raise
+    with _lock:
+        del _BUILDING[(experiment, key)]
+        if publish is None or publish():
+            _TIMELINES[experiment]=(key, timeline)
+    pending.set_result(timeline)
+    return timeline
+
+
+def update_timeline(experiment, key, new_key, start, end, count):
+    """
+    Count again the frames between start and end of the cached timeline of experiment,
+    if it is the one for key, and keep it for new_key (see Timeline.update)
+    """
+    with _lock:
+        hit=_TIMELINES.get(experiment)
+        if not hit or hit[0]!=key:
+            return False
+        hit[1].update(start, end, count)
+        _TIMELINES[experiment]=(new_key, hit[1])
+        return True
@@ -1,18 +1,22 @@
 import os.path
 import pickle
-import pandas as pd
-from flyhostel.utils import (
-    get_basedir,
-)
+from idtrackerai_validator_server.startup import lazy_import, lazy_callable
+
+pd=lazy_import("pandas")
+get_basedir=lazy_callable("flyhostel.utils", "get_basedir")
+
+def rejections_file(experiment):
+    return os.path.join(
+        get_basedir(experiment), "interactions", f"{experiment}_rejections.csv"
+    )
+
 
 def load_rejections(experiment):
     """
     This function is also implemented in
     from flyhostel.data.interactions.sociability.behavior_integration.load_rejections
     """
-    csv_file=os.path.join(
-        get_basedir(experiment), "interactions", f"{experiment}_rejections.csv"
-    )
+    csv_file=rejections_file(experiment)
     index_file=os.path.join(
         get_basedir(experiment), "interactions", f"{experiment}_index.csv"
     )
@@ -26,11 +26,18 @@ setup(
         "opencv-python",
         "webcolors",
         "h5py",
+        "pyarrow",
         ""
     ],
+    extras_require={
+        "production": ["gunicorn>=21.2.0"],
+        "asgi": ["uvicorn>=0.23.0"],
+        "bench": ["pytest", "pytest-benchmark"],
+    },
     entry_points={
         'console_scripts': [
             "start-idtrackerai-validator-server=idtrackerai_validator_server.main:main",
+            "idtrackerai-validator-server=idtrackerai_validator_server.main:cli",
         ],
     },
 
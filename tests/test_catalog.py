@@ -0,0 +1,77 @@
+import os
+import sqlite3
+
+import pytest
+
+from idtrackerai_validator_server import catalog
+
+
+def _add_experiment(root, flyhostel, number_of_animals, date_time, suffixes=("", ), validated=False, pose=False):
+    folder=os.path.join(root, f"FlyHostel{flyhostel}", f"{number_of_animals}X", date_time)
+    os.makedirs(folder, exist_ok=True)
+    for suffix in suffixes:
+        with sqlite3.connect(os.path.join(folder, f"FlyHostel{flyhostel}_{number_of_animals}X_{date_time}{suffix}.db")) as conn:
+            conn.execute("CREATE TABLE IDENTITY (frame_number INTEGER, identity INTEGER)")
+            if validated:
+                conn.execute("CREATE TABLE IDENTITY_VAL (frame_number INTEGER, identity INTEGER)")
+    open(os.path.join(folder, "000050.mp4"), "w").close()
+    if pose:
+        os.makedirs(os.path.join(folder, "motionmapper"), exist_ok=True)
+    return folder
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, "CATALOG_DB", None)
+    # the tests refresh the catalog themselves
+    monkeypatch.setattr(catalog, "refresh_catalog_in_background", lambda root=None: False)
+    root=str(tmp_path)
+    _add_experiment(root, 1, 6, "2023-01-01_10-00-00", suffixes=("", "_v2"), validated=True, pose=True)
+    _add_experiment(root, 2, 1, "2023-02-01_10-00-00")
+    _add_experiment(root, 3, 6, "2023-03-01_10-00-00", pose=True)
+    return root
+
+
+def test_fallback_until_the_first_refresh(root):
+    with pytest.raises(FileNotFoundError):
+        catalog.list_catalog(root)
+    # the file exists, but the first scan has not committed
+    catalog._connect(catalog.get_catalog_file(root)).close()
+    with pytest.raises(FileNotFoundError):
+        catalog.list_catalog(root)
+
+    catalog.refresh_catalog(root)
+    assert catalog.list_catalog(root)["total"]==4
+
+
+def test_one_row_per_database(root):
+    catalog.refresh_catalog(root)
+    assert catalog.list_catalog(root)["experiments"]==[
+        "FlyHostel1_6X_2023-01-01_10-00-00", "FlyHostel1_6X_2023-01-01_10-00-00_v2",
+        "FlyHostel2_1X_2023-02-01_10-00-00", "FlyHostel3_6X_2023-03-01_10-00-00",
+    ]
+
+
+@pytest.mark.parametrize("filters, expected", [
+    ({"search": "FlyHostel2"}, ["FlyHostel2_1X_2023-02-01_10-00-00"]),
+    ({"number_of_animals": 6, "validated": False}, ["FlyHostel3_6X_2023-03-01_10-00-00"]),
+    ({"validated": True, "pose": True}, ["FlyHostel1_6X_2023-01-01_10-00-00", "FlyHostel1_6X_2023-01-01_10-00-00_v2"]),
+    ({"pose": False}, ["FlyHostel2_1X_2023-02-01_10-00-00"]),
+    ({"offset": 1, "limit": 2}, ["FlyHostel1_6X_2023-01-01_10-00-00_v2", "FlyHostel2_1X_2023-02-01_10-00-00"]),
+])
+def test_filters(root, filters, expected):
+    catalog.refresh_catalog(root)
+    out=catalog.list_catalog(root, **filters)
+    assert out["experiments"]==expected
+    assert out["total"]==(4 if "offset" in filters else len(expected))
+
+
+def test_refresh_inspects_only_changes(root):
+    assert catalog.refresh_catalog(root)["inspected"]==3
+    assert catalog.refresh_catalog(root)["inspected"]==0
+
+    _add_experiment(root, 2, 1, "2023-02-01_10-00-00", suffixes=("_v2", ))
+    os.rename(os.path.join(root, "FlyHostel3"), os.path.join(root, "Other"))
+    stats=catalog.refresh_catalog(root)
+    assert (stats["inspected"], stats["removed"], stats["experiments"])==(1, 1, 4)
+    assert catalog.list_catalog(root, search="FlyHostel2")["total"]==2
@@ -0,0 +1,81 @@
+import pytest
+
+
+def _identities(get_ok, frame_number):
+    """in_frame_index -> (identity, modified) of the animals in frame_number"""
+    tracking=get_ok(f"/api/tracking/{frame_number}?pose=0").get_json()["tracking_data"]
+    return {animal["in_frame_index"]: (animal["identity"], animal["modified"]) for animal in tracking}
+
+
+def _timeline(get_ok, validator, rebuild=False):
+    if rebuild:
+        validator.timeline._TIMELINES.clear()
+    return get_ok("/api/timeline?bins=50").get_json()["counts"]
+
+
+@pytest.fixture
+def window(experiment):
+    start=experiment["min_frame"]+250
+    return start, start+300
+
+
+def test_range_round_trip(client, get_ok, validator, window, tracking_backend):
+    start, end=window
+    frames=(start, (start+end)//2, end, end+1)
+    before={frame_number: _identities(get_ok, frame_number) for frame_number in frames}
+    timeline_before=_timeline(get_ok, validator)
+
+    response=client.post("/api/corrections/range", json={"start": start, "end": end, "identity": 1, "to": 2, "swap": True})
+    assert response.status_code==200, response.get_json()
+    correction=response.get_json()
+    assert correction["rows"] > 0
+
+    swap={1: 2, 2: 1}
+    for frame_number in frames:
+        after=_identities(get_ok, frame_number)
+        for in_frame_index, (identity, modified) in before[frame_number].items():
+            if frame_number <= end and identity in swap:
+                assert after[in_frame_index]==(swap[identity], str(correction["id"]))
+            else:
+                assert after[in_frame_index]==(identity, modified)
+    # the timeline updated in the corrected bins is the one built from scratch
+    assert _timeline(get_ok, validator)==_timeline(get_ok, validator, rebuild=True)
+
+    undone=client.post(f"/api/corrections/{correction['id']}/undo")
+    assert undone.status_code==200, undone.get_json()
+    assert undone.get_json()["undone_at"] is not None
+    assert {frame_number: _identities(get_ok, frame_number) for frame_number in frames}==before
+    assert _timeline(get_ok, validator)==timeline_before
+
+    assert client.post(f"/api/corrections/{correction['id']}/undo").status_code==409
+
+
+def test_undo_latest_first(client, get_ok, window):
+    start, end=window
+    before=_identities(get_ok, end)
+    first=client.post("/api/corrections/range", json={"start": start, "end": end, "identity": 1, "to": 3}).get_json()
+    second=client.post("/api/corrections/range", json={"start": end, "end": end+10, "identity": 3, "to": 4}).get_json()
+
+    assert client.post(f"/api/corrections/{first['id']}/undo").status_code==409
+    assert client.post(f"/api/corrections/{second['id']}/undo").status_code==200
+    assert client.post(f"/api/corrections/{first['id']}/undo").status_code==200
+    assert _identities(get_ok, end)==before
+
+
+def test_fragment_round_trip(client, get_ok, window):
+    frame_number=window[0]
+    tracking=get_ok(f"/api/tracking/{frame_number}?pose=0").get_json()["tracking_data"]
+    animal=next(animal for animal in tracking if animal["identity"]!=1)
+
+    response=client.post("/api/corrections/fragment", json={"fragment": animal["fragment"], "to": 1})
+    assert response.status_code==200, response.get_json()
+    correction=response.get_json()
+    assert _identities(get_ok, frame_number)[animal["in_frame_index"]]==(1, str(correction["id"]))
+
+    assert client.post(f"/api/corrections/{correction['id']}/undo").status_code==200
+    assert _identities(get_ok, frame_number)[animal["in_frame_index"]]==(animal["identity"], animal["modified"])
+
+
+def test_invalid_corrections(client):
+    assert client.post("/api/corrections/range", json={"start": 0, "end": 10, "identity": 1, "to": 999}).status_code==400
+    assert client.post("/api/corrections/999999/undo").status_code==404
@@ -0,0 +1,118 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from idtrackerai_validator_server.locks import ReadWriteLock
+
+
+def _writer_can_acquire(lock, timeout=2):
+    """True if a writer gets lock within timeout (it is released right away)"""
+    writer=threading.Thread(target=lambda: (lock.acquire_write(), lock.release_write()), daemon=True)
+    writer.start()
+    writer.join(timeout)
+    return not writer.is_alive()
+
+
+def test_waiting_writer_blocks_new_readers():
+    lock=ReadWriteLock()
+    lock.acquire_read()
+    writer=threading.Thread(target=lambda: (lock.acquire_write(), lock.release_write()), daemon=True)
+    writer.start()
+    while not lock._writers_waiting:
+        time.sleep(0.001)
+
+    reader=threading.Thread(target=lambda: (lock.acquire_read(), lock.release_read()), daemon=True)
+    reader.start()
+    reader.join(0.2)
+    assert reader.is_alive()
+
+    lock.release_read()
+    writer.join(2)
+    reader.join(2)
+    assert not writer.is_alive() and not reader.is_alive()
+
+
+@pytest.fixture
+def probe(validator, monkeypatch):
+    """Wrap the builders of the timeline and the fragment index to check state_lock while they run"""
+    free={}
+
+    def wrap(module, name):
+        build=getattr(module, name)
+
+        def probed(*args, **kwargs):
+            free[name]=_writer_can_acquire(validator.state_lock)
+            return build(*args, **kwargs)
+        monkeypatch.setattr(module, name, probed)
+
+    wrap(validator.timeline, "build_timeline")
+    wrap(validator.fragments, "build_fragment_index")
+    monkeypatch.setattr(validator.timeline, "_TIMELINES", {})
+    monkeypatch.setattr(validator.fragments, "_INDEXES", {})
+    return free
+
+
+def test_builds_do_not_block_a_load(get_ok, experiment, probe):
+    get_ok("/api/timeline?bins=10")
+    get_ok(f"/api/next_fragment_start/{experiment['min_frame']}")
+    assert probe=={"build_timeline": True, "build_fragment_index": True}
+
+
+def test_warm_up_does_not_block_a_load(validator, experiment, probe, monkeypatch):
+    monkeypatch.setattr(validator, "WARM_CACHES", ["timeline", "fragments"])
+    job={"first_frame": experiment["min_frame"]}
+    validator._warm_caches(job, validator.SELECTED_EXPERIMENT)
+    assert job["cache_warm_up"]["status"]=="done"
+    assert [stage["status"] for stage in job["cache_warm_up"]["stages"]]==["done", "done"]
+    assert probe=={"build_timeline": True, "build_fragment_index": True}
+
+
+class SlowReadLock(ReadWriteLock):
+    """Leaves time for a writer to queue up while the readers hold the lock"""
+
+    def acquire_read(self):
+        super().acquire_read()
+        time.sleep(0.2)
+
+
+def _asgi_get(application, path):
+    scope={
+        "type": "http", "method": "GET", "path": path, "query_string": b"",
+        "headers": [], "http_version": "1.1",
+    }
+    sent=[]
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    async def get():
+        await application(scope, receive, send)
+        return sent[0]["status"]
+    return get()
+
+
+def test_asgi_tracking_with_a_waiting_writer(validator, experiment, monkeypatch):
+    """The tracking route holds state_lock while the pool threads of other requests wait for it behind a load"""
+    from idtrackerai_validator_server.asgi import ValidatorASGI
+    application=ValidatorASGI(validator, threads=2)
+    monkeypatch.setattr(validator, "state_lock", SlowReadLock())
+    frame_number=experiment["min_frame"]
+
+    async def main():
+        tracking=asyncio.ensure_future(_asgi_get(application, f"/api/tracking/{frame_number}"))
+        await asyncio.sleep(0.02)
+        others=[asyncio.ensure_future(_asgi_get(application, f"/api/next_error/{frame_number+i}")) for i in range(3)]
+        await asyncio.sleep(0.05)
+        threading.Thread(target=lambda: _writer_can_acquire(validator.state_lock, timeout=10), daemon=True).start()
+        return await asyncio.wait_for(asyncio.gather(tracking, *others), 10)
+
+    try:
+        assert asyncio.run(main())==[200]*4
+    finally:
+        application.executor.shutdown(wait=False)
+        application.locked_executor.shutdown(wait=False)
@@ -0,0 +1,70 @@
+import shutil
+import sqlite3
+
+import numpy as np
+import pytest
+
+from idtrackerai_validator_server import corrections
+from idtrackerai_validator_server.sidecar import build_sidecar, open_sidecar, update_sidecar, db_signature
+
+
+@pytest.fixture
+def dbfile(experiment, tmp_path):
+    """A copy of the tracking database of the experiment, with its sidecar"""
+    dbfile=str(tmp_path / experiment["dbfile"].split("/")[-1])
+    shutil.copy(experiment["dbfile"], dbfile)
+    build_sidecar(dbfile)
+    return dbfile
+
+
+def _identities(sidecar, chunk):
+    return sidecar.read_chunk("IDENTITY", chunk)["identity"].copy()
+
+
+def test_update_sidecar_drops_the_chunks_of_every_reader(dbfile, experiment):
+    reader=open_sidecar(dbfile, use_val="_VAL")
+    other=open_sidecar(dbfile, use_val="_VAL")
+    chunk=experiment["min_frame"]//reader.chunksize
+    before=_identities(reader, chunk)
+    _identities(other, chunk)
+
+    signature=db_signature(dbfile)
+    start=chunk*reader.chunksize
+    correction=corrections.reassign_range(dbfile, "_VAL", start, start+reader.chunksize-1, 1, 2, swap=True)
+    assert correction["rows"] > 0
+    assert update_sidecar(dbfile, signature, ["ROI_0_VAL", "IDENTITY_VAL"], [chunk])
+
+    expected=np.where(before==1, 2, np.where(before==2, 1, before))
+    for sidecar in (reader, other):
+        sidecar.refresh(force=True)
+        assert sidecar.current()
+        assert (_identities(sidecar, chunk)==expected).all()
+
+
+def test_update_sidecar_of_an_older_sidecar(dbfile):
+    """A sidecar that was not up to date before the correction is not updated"""
+    with sqlite3.connect(dbfile) as conn:
+        conn.execute("CREATE TABLE OTHER (x INTEGER)")
+    signature=db_signature(dbfile)
+    assert not update_sidecar(dbfile, signature, ["IDENTITY_VAL"], [0])
+    assert open_sidecar(dbfile, use_val="_VAL") is None
+
+
+@pytest.mark.parametrize("journal_mode", ["delete", "wal"])
+def test_external_write_makes_the_sidecar_stale(dbfile, journal_mode):
+    with sqlite3.connect(dbfile) as conn:
+        conn.execute(f"PRAGMA journal_mode={journal_mode}")
+    build_sidecar(dbfile, force=True)
+    sidecar=open_sidecar(dbfile, use_val="_VAL")
+    assert sidecar.current()
+
+    conn=sqlite3.connect(dbfile)
+    try:
+        # keep the commit in the -wal
+        conn.execute("PRAGMA wal_autocheckpoint=0")
+        conn.execute("CREATE TABLE OTHER (x INTEGER)")
+        conn.commit()
+        sidecar.refresh(force=True)
+        assert not sidecar.current()
+    finally:
+        conn.close()
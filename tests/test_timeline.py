@@ -0,0 +1,58 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from idtrackerai_validator_server import timeline
+from idtrackerai_validator_server.sidecar import build_sidecar, open_sidecar
+
+CHUNKSIZE=100
+FRAMES=range(0, 300)
+
+
+def _make_database(path, declared, values):
+    """3 ROIs per frame, the modified field of every ROI taken from values in turn"""
+    dbfile=str(path / "experiment.db")
+    with sqlite3.connect(dbfile) as conn:
+        conn.execute("CREATE TABLE METADATA (field TEXT, value TEXT)")
+        conn.execute("INSERT INTO METADATA VALUES ('chunksize', ?)", (str(CHUNKSIZE), ))
+        conn.execute("CREATE TABLE STORE_INDEX (frame_number INTEGER, frame_time INTEGER)")
+        conn.execute(f"CREATE TABLE ROI_0 (frame_number INTEGER, in_frame_index INTEGER, modified {declared}, fragment TEXT)")
+        conn.execute("CREATE TABLE IDENTITY (frame_number INTEGER, in_frame_index INTEGER, identity INTEGER, local_identity INTEGER)")
+        rows=0
+        for frame_number in FRAMES:
+            conn.execute("INSERT INTO STORE_INDEX VALUES (?, ?)", (frame_number, frame_number*40))
+            for in_frame_index in range(3):
+                conn.execute(
+                    "INSERT INTO ROI_0 VALUES (?, ?, ?, '1')",
+                    (frame_number, in_frame_index, values[rows % len(values)])
+                )
+                conn.execute(
+                    "INSERT INTO IDENTITY VALUES (?, ?, ?, ?)",
+                    (frame_number, in_frame_index, (frame_number+in_frame_index) % 4, in_frame_index)
+                )
+                rows+=1
+    return dbfile
+
+
+@pytest.mark.parametrize("declared, values", [
+    ("TEXT", [None, "", "0", "3", "x"]),
+    ("INTEGER", [None, 0, 3, 5]),
+    ("INTEGER NOT NULL", [0, 0, 7]),
+    ("REAL", [None, 0.0, 2.5]),
+])
+def test_sidecar_counts_like_sql(tmp_path, declared, values):
+    dbfile=_make_database(tmp_path, declared, values)
+    build_sidecar(dbfile)
+    sidecar=open_sidecar(dbfile)
+    assert sidecar is not None
+
+    counts={}
+    for name, source in (("sql", None), ("sidecar", sidecar)):
+        counter=timeline._Counter(FRAMES[0], FRAMES[-1], width=10)
+        timeline.count_events(counter, dbfile, "", 3, sidecar=source)
+        counts[name]=counter.counts
+
+    assert counts["sql"]["modified"].sum() > 0
+    for name in timeline.COUNTS:
+        np.testing.assert_array_equal(counts["sidecar"][name], counts["sql"][name], err_msg=name)